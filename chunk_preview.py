@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Chunking Preview Script
+
+Reproduces the schema's `chunk fixed-length 1024` split locally
+(rag-blueprint/app/schemas/doc.sd), so the number of chunks, and therefore of
+embeddings, is known before anything is fed to Vespa.
+
+Reports per corpus:
+- Chunks per document and chunk size histograms
+- Total embeddings (one per chunk plus one per title)
+- Estimated embedding compute time for the ModernBERT embedder
+- Estimated attribute and HNSW memory for chunk_embeddings and title_embedding
+
+Chunking rule: a chunk ends at the first whitespace at or after `length`
+characters; if there is none within a further 10% of `length`, it is cut hard
+at that point. Chunks never start with whitespace, and whitespace-only
+remainders are dropped.
+"""
+
+import argparse
+import bisect
+import csv
+import gzip
+import json
+import re
+import sys
+from array import array
+from pathlib import Path
+
+from markdown2feed import iter_markdown_files
+
+WHITESPACE_PATTERN = re.compile(r"\s")
+NON_WHITESPACE_PATTERN = re.compile(r"\S")
+
+# Storage per embedding in the doc schema: tensor<int8>(x[96]) after pack_bits
+PACKED_EMBEDDING_BYTES = 96
+# Rough per-cell overhead of the mapped chunk{} dimension (label + cell index)
+MAPPED_LABEL_BYTES = 16
+# HNSW graph per vector with Vespa's default max-links-per-node 16: level 0
+# holds up to 2x16 links of 4 bytes, plus node and upper-level bookkeeping
+HNSW_NODE_BYTES = 2 * 16 * 4 + 32
+
+
+def fixed_length_chunks(text: str, length: int = 1024, slack: float = 0.1) -> list[str]:
+    """Split text the way `chunk fixed-length <length>` does
+
+    Whitespace positions are found in one regex pass; each cut point is then a
+    binary search into that index instead of a character-by-character scan.
+    """
+    whitespace = array("l", (m.start() for m in WHITESPACE_PATTERN.finditer(text)))
+    hard_limit = length + int(length * slack)
+    chunks = []
+
+    match = NON_WHITESPACE_PATTERN.search(text)
+    start = match.start() if match else len(text)
+    while start < len(text):
+        if len(text) - start <= length:
+            end = len(text)
+        else:
+            i = bisect.bisect_left(whitespace, start + length)
+            if i < len(whitespace) and whitespace[i] < start + hard_limit:
+                end = whitespace[i] + 1
+            else:
+                end = start + hard_limit
+        chunks.append(text[start:end])
+
+        match = NON_WHITESPACE_PATTERN.search(text, end)
+        start = match.start() if match else len(text)
+    return chunks
+
+
+def iter_documents(args: argparse.Namespace):
+    """Yield (document id, text) from a markdown tree or from feed shards"""
+    if args.feed_dir is not None:
+        for shard in sorted(args.feed_dir.glob("*.jsonl.gz")):
+            with gzip.open(shard, "rt", encoding="utf-8") as f:
+                for line in f:
+                    fields = json.loads(line)["fields"]
+                    yield fields["id"], fields.get("text", "")
+        return
+
+    for md_file in iter_markdown_files(args.input_dir, args.exclude_reviews):
+        doc_id = md_file.relative_to(args.input_dir).as_posix()
+        yield doc_id, md_file.read_text(encoding="utf-8")
+
+
+def power_of_two_bucket(value: int) -> str:
+    """Histogram bucket label: 0, 1, 2, 3-4, 5-8, 9-16, ..."""
+    if value <= 2:
+        return str(value)
+    upper = 1 << (value - 1).bit_length()
+    return f"{upper // 2 + 1}-{upper}"
+
+
+def print_histogram(title: str, counts: dict, order_key, width: int = 40):
+    """Print a text histogram of bucket -> count"""
+    print(f"\n{title}:")
+    peak = max(counts.values(), default=0)
+    for bucket in sorted(counts, key=order_key):
+        bar = "#" * max(1, round(counts[bucket] / peak * width))
+        print(f"  {bucket:>11} | {counts[bucket]:8d} {bar}")
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Preview Vespa fixed-length chunking and estimate embedding cost",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--input-dir",
+        type=Path,
+        default=Path("MarkdownOutput/"),
+        help="Directory searched recursively for markdown files",
+    )
+
+    parser.add_argument(
+        "--feed-dir",
+        type=Path,
+        default=None,
+        help="Read documents from *.jsonl.gz feed shards instead of --input-dir",
+    )
+
+    parser.add_argument(
+        "--exclude-reviews",
+        action="store_true",
+        default=False,
+        help="Exclude files ending with _REVIEW.md",
+    )
+
+    parser.add_argument(
+        "--chunk-length",
+        type=int,
+        default=1024,
+        help="Target chunk length, as in `chunk fixed-length <n>`",
+    )
+
+    parser.add_argument(
+        "--embed-ms-per-chunk",
+        type=float,
+        default=30.0,
+        help="Embedder cost per chunk on one CPU thread, in milliseconds",
+    )
+
+    parser.add_argument(
+        "--redundancy",
+        type=int,
+        default=2,
+        help="Content cluster redundancy (min-redundancy in services.xml)",
+    )
+
+    parser.add_argument(
+        "--per-doc-csv",
+        type=Path,
+        default=None,
+        help="Write document id, characters and chunk count per document to this CSV",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point for the script"""
+    args = parse_args()
+
+    if args.feed_dir is None and not args.input_dir.exists():
+        print(f"Error: Input directory does not exist: {args.input_dir}")
+        sys.exit(1)
+
+    chunks_per_doc = []
+    chunk_count_hist = {}
+    chunk_size_hist = {}
+    total_chars = 0
+    size_bucket = max(1, args.chunk_length // 8)
+
+    per_doc_file = None
+    per_doc_writer = None
+    if args.per_doc_csv is not None:
+        per_doc_file = open(args.per_doc_csv, "w", newline="")
+        per_doc_writer = csv.writer(per_doc_file)
+        per_doc_writer.writerow(["doc_id", "characters", "chunks"])
+
+    for doc_id, text in iter_documents(args):
+        chunks = fixed_length_chunks(text, args.chunk_length)
+        chunks_per_doc.append(len(chunks))
+        total_chars += len(text)
+
+        bucket = power_of_two_bucket(len(chunks))
+        chunk_count_hist[bucket] = chunk_count_hist.get(bucket, 0) + 1
+        for chunk in chunks:
+            size = len(chunk) // size_bucket * size_bucket
+            chunk_size_hist[size] = chunk_size_hist.get(size, 0) + 1
+
+        if per_doc_writer is not None:
+            per_doc_writer.writerow([doc_id, len(text), len(chunks)])
+
+    if per_doc_file is not None:
+        per_doc_file.close()
+
+    if not chunks_per_doc:
+        print("Error: No documents found")
+        sys.exit(1)
+
+    docs = len(chunks_per_doc)
+    total_chunks = sum(chunks_per_doc)
+    sorted_counts = sorted(chunks_per_doc)
+    embeddings = total_chunks + docs
+
+    print(f"{'=' * 60}")
+    print(f"Chunking preview (fixed-length {args.chunk_length}):")
+    print(f"  Documents: {docs}")
+    print(f"  Characters: {total_chars}")
+    print(f"  Chunks: {total_chunks}")
+    print(
+        f"  Chunks per document: mean {total_chunks / docs:.1f},"
+        f" p50 {sorted_counts[docs // 2]},"
+        f" p95 {sorted_counts[min(docs - 1, int(docs * 0.95))]},"
+        f" max {sorted_counts[-1]}"
+    )
+
+    print_histogram(
+        "Chunks per document",
+        chunk_count_hist,
+        order_key=lambda bucket: int(bucket.split("-")[0]),
+    )
+    print_histogram(
+        f"Chunk size (characters, buckets of {size_bucket})",
+        {f"{size}+": count for size, count in chunk_size_hist.items()},
+        order_key=lambda bucket: int(bucket.rstrip("+")),
+    )
+
+    # Estimates: one embedding per chunk and one per title, stored once per replica
+    embed_hours = embeddings * args.embed_ms_per_chunk / 1000 / 3600
+    chunk_bytes = total_chunks * (
+        PACKED_EMBEDDING_BYTES + MAPPED_LABEL_BYTES + HNSW_NODE_BYTES
+    )
+    title_bytes = docs * (PACKED_EMBEDDING_BYTES + HNSW_NODE_BYTES)
+    print(f"\n{'=' * 60}")
+    print("Feed estimates:")
+    print(
+        f"  Embeddings to compute: {embeddings} ({total_chunks} chunks + {docs} titles)"
+    )
+    print(
+        f"  Embedder time: {embed_hours:.2f} CPU-hours"
+        f" at {args.embed_ms_per_chunk:.0f} ms per chunk"
+    )
+    print(
+        f"  chunk_embeddings attribute + HNSW: {chunk_bytes / 2**20:.1f} MiB per replica,"
+        f" {chunk_bytes * args.redundancy / 2**20:.1f} MiB total"
+    )
+    print(
+        f"  title_embedding attribute + HNSW: {title_bytes / 2**20:.1f} MiB per replica,"
+        f" {title_bytes * args.redundancy / 2**20:.1f} MiB total"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Markdown Detection Script
+
+Clusters near-identical markdown documents (repeated FDA 510(k) summaries,
+`_REVIEW.md` variants, ...) so that downstream stages embed and extract only
+one representative per cluster.
+
+Method:
+- Documents are reduced to word 5-gram shingles
+- One-permutation MinHash: each shingle is hashed once and kept as the minimum
+  of one of 128 bins, so a signature costs O(shingles) instead of
+  O(shingles x permutations); empty bins are filled by rotation densification
+- Locality-sensitive hashing over 16 bands of 8 bins finds candidate pairs in
+  sub-linear time; candidates are confirmed by estimated Jaccard similarity
+- Confirmed pairs are merged with union-find into clusters
+
+Output is a JSON canonical-id map. Pass it as --dedup-map to markdown2feed.py
+or extract_structured.py to skip the non-canonical members of each cluster.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+NUM_BINS = 128
+BAND_ROWS = 8
+SHINGLE_SIZE = 5
+
+HASH_BITS = 64
+BIN_BITS = (NUM_BINS - 1).bit_length()
+VALUE_MASK = (1 << (HASH_BITS - BIN_BITS)) - 1
+# Offset added per bin when densification borrows a value from a neighbour, so
+# borrowed values never collide with genuine ones
+DENSIFY_OFFSET = VALUE_MASK + 1
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> set[int]:
+    """64-bit hashes of the word n-grams of a lower-cased text"""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) < size:
+        tokens = tokens + [""] * (size - len(tokens))
+    return {
+        int.from_bytes(
+            hashlib.blake2b(
+                " ".join(tokens[i : i + size]).encode(), digest_size=8
+            ).digest(),
+            "big",
+        )
+        for i in range(len(tokens) - size + 1)
+    }
+
+
+def minhash_signature(hashes: set[int]) -> tuple[int, ...]:
+    """One-permutation MinHash signature with rotation densification"""
+    bins = [None] * NUM_BINS
+    for h in hashes:
+        index, value = h >> (HASH_BITS - BIN_BITS), h & VALUE_MASK
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+
+    if all(value is None for value in bins):
+        return tuple([0] * NUM_BINS)
+
+    # Fill each empty bin from the next non-empty bin to its right (circular)
+    signature = list(bins)
+    for index in range(NUM_BINS):
+        distance = 1
+        while signature[index] is None:
+            borrowed = bins[(index + distance) % NUM_BINS]
+            if borrowed is not None:
+                signature[index] = borrowed + distance * DENSIFY_OFFSET
+            distance += 1
+    return tuple(signature)
+
+
+def estimated_jaccard(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    return sum(x == y for x, y in zip(a, b, strict=True)) / len(a)
+
+
+def signature_for_file(md_file: Path) -> tuple[Path, int, tuple[int, ...]]:
+    """Worker: read one markdown file and compute its signature"""
+    text = md_file.read_text(encoding="utf-8", errors="replace")
+    return md_file, len(text), minhash_signature(shingle_hashes(text))
+
+
+class UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def cluster_signatures(
+    signatures: list[tuple[int, ...]], threshold: float
+) -> tuple[UnionFind, int]:
+    """Merge documents whose signatures collide in a band and are similar enough
+
+    Every band bucket keeps one representative per cluster that reached it. A
+    document is compared with each representative not already in its cluster
+    and becomes a representative itself if it matches none, so a bucket of k
+    identical documents costs k - 1 comparisons, not k^2, while dissimilar
+    documents that share a band are still compared with each other.
+    Returns the union-find structure and the number of comparisons made.
+    """
+    clusters = UnionFind(len(signatures))
+    comparisons = 0
+    for band_start in range(0, NUM_BINS, BAND_ROWS):
+        buckets = {}
+        for doc_index, signature in enumerate(signatures):
+            band = signature[band_start : band_start + BAND_ROWS]
+            representatives = buckets.setdefault(band, [])
+            matched = False
+            for representative in representatives:
+                if clusters.find(representative) == clusters.find(doc_index):
+                    matched = True
+                    continue
+                comparisons += 1
+                if (
+                    estimated_jaccard(signatures[representative], signature)
+                    >= threshold
+                ):
+                    clusters.union(representative, doc_index)
+                    matched = True
+            if not matched:
+                representatives.append(doc_index)
+    return clusters, comparisons
+
+
+def canonical_order(relative_path: str, length: int) -> tuple:
+    """Prefer non-review files, then the longest text, then the first path"""
+    return (relative_path.endswith("_REVIEW.md"), -length, relative_path)
+
+
+def load_duplicates(map_file: Path) -> set[Path]:
+    """Absolute paths of the non-canonical documents listed in a dedup map"""
+    dedup_map = json.loads(map_file.read_text(encoding="utf-8"))
+    root = Path(dedup_map["root"])
+    return {
+        (root / relative_path).resolve()
+        for relative_path, canonical in dedup_map["canonical"].items()
+        if relative_path != canonical
+    }
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Cluster near-duplicate markdown files and write a canonical-id map",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--input-dir",
+        type=Path,
+        default=Path("MarkdownOutput/"),
+        help="Directory searched recursively for markdown files",
+    )
+
+    parser.add_argument(
+        "--output-file",
+        type=Path,
+        default=Path("dedup_map.json"),
+        help="Canonical-id map to write",
+    )
+
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.85,
+        help="Minimum estimated Jaccard similarity of word 5-grams for a duplicate",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point for the script"""
+    args = parse_args()
+
+    if not args.input_dir.exists():
+        print(f"Error: Input directory does not exist: {args.input_dir}")
+        sys.exit(1)
+
+    print(f"Scanning for markdown files in: {args.input_dir}")
+
+    # Use num_cpu - 1 workers for signature computation
+    max_workers = max(1, os.cpu_count() - 1)
+    paths, lengths, signatures = [], [], []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for md_file, length, signature in executor.map(
+            signature_for_file,
+            args.input_dir.rglob("*.md"),
+            chunksize=64,
+        ):
+            paths.append(md_file.relative_to(args.input_dir).as_posix())
+            lengths.append(length)
+            signatures.append(signature)
+    print(f"Computed signatures for {len(paths)} files")
+
+    clusters, comparisons = cluster_signatures(signatures, args.threshold)
+
+    members = {}
+    for doc_index in range(len(paths)):
+        members.setdefault(clusters.find(doc_index), []).append(doc_index)
+    duplicate_clusters = [group for group in members.values() if len(group) > 1]
+
+    # Every member of a multi-document cluster maps to its canonical document
+    canonical = {}
+    for group in duplicate_clusters:
+        best = min(group, key=lambda i: canonical_order(paths[i], lengths[i]))
+        for doc_index in group:
+            canonical[paths[doc_index]] = paths[best]
+
+    output = {
+        "root": str(args.input_dir.resolve()),
+        "threshold": args.threshold,
+        "total_files": len(paths),
+        "clusters": len(duplicate_clusters),
+        "canonical": canonical,
+    }
+    with open(args.output_file, "w") as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+
+    duplicates = sum(len(group) - 1 for group in duplicate_clusters)
+    print(f"\n{'=' * 60}")
+    print("✓ Deduplication complete!")
+    print(f"  Files scanned: {len(paths)}")
+    print(f"  Candidate comparisons: {comparisons}")
+    print(f"  Near-duplicate clusters: {len(duplicate_clusters)}")
+    print(f"  Redundant files (skippable): {duplicates}")
+    print(f"  Unique documents: {len(paths) - duplicates}")
+    print(f"  Canonical-id map saved to: {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@
 Laboratory Document Data Extraction Script
 
 Extracts structured data from FDA 510(k) and Lab SOP (Standard Operating Procedure) markdown files
-using Google's Gemini 2.5 Flash Lite API. Processes files in batches to handle arbitrarily large datasets efficiently.
+using Google's Gemini 2.5 Flash Lite API. Files flow through a pipeline of read, prepare, call, validate
+and write stages joined by bounded queues, to handle arbitrarily large datasets efficiently.
 
 FDA 510(k) Extracted Fields:
 - Device Trade Name: Commercial/proprietary name of the device
@@ -28,97 +29,54 @@ Lab SOP Extracted Fields:
 
 import argparse
 import asyncio
+import contextlib
+import hashlib
 import json
+import multiprocessing
 import os
+import random
+import re
+import shutil
+import sqlite3
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
 
+import httpx
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
 from tqdm.auto import tqdm
 
+from dedup_markdown import load_duplicates
+from extraction_schemas import DOC_TYPES
 
-# Define the structured data model for FDA 510(k) documents
-class FDA510k(BaseModel):
-    """Structured Tier 1 data extracted from FDA 510(k) markdown documents"""
-
-    device_trade_name: str = Field(
-        description="Commercial/proprietary name of the device"
-    )
-    product_code: Optional[str] = Field(
-        None, description="3-letter FDA product classification code (e.g., DAP, NTV)"
-    )
-    intended_use: str = Field(
-        description="Official FDA-approved statement of device purpose and clinical application"
-    )
-    analyte_biomarker: Optional[str] = Field(
-        None,
-        description="Molecule or substance being measured (e.g., D-Dimer, Myeloperoxidase, Hemoglobin)",
-    )
-    medical_specialty: Optional[str] = Field(
-        None,
-        description="FDA review panel/medical domain (e.g., Hematology, Immunology, Clinical Chemistry)",
-    )
-    manufacturer_name: str = Field(description="Company name submitting the 510(k)")
-    fda_decision_date: Optional[str] = Field(
-        None,
-        description="Date FDA granted substantial equivalence in mm-dd-yyyy format (e.g., 03-10-2005, 12-23-2005)",
-    )
 
-
-# Define the structured data model for Lab SOP documents
-class LabSOP(BaseModel):
-    """Structured data extracted from Laboratory Standard Operating Procedure documents"""
-
-    procedure_name: str = Field(
-        description="Official name of the laboratory procedure/test"
-    )
-    specimen_type: str = Field(
-        description="Type of biological sample required (e.g., Serum, Plasma, Whole Blood, Urine, CSF)"
-    )
-    analyte_biomarker: Optional[str] = Field(
-        None,
-        description="Molecule or substance being measured (e.g., D-Dimer, Glucose, Hemoglobin)",
-    )
-    medical_specialty: Optional[str] = Field(
-        None,
-        description="Clinical domain or specialty (e.g., Hematology, Clinical Chemistry, Immunology)",
-    )
-    purpose: str = Field(
-        description="Clinical purpose, indications, and diagnostic applications of the test"
-    )
-    equipment: list[str] = Field(
-        default_factory=list,
-        description="List of instruments, analyzers, and devices used in the procedure",
-    )
-    reagents: list[str] = Field(
-        default_factory=list,
-        description="List of reagents, kits, consumables, and materials required",
-    )
-    quality_control: Optional[str] = Field(
-        None,
-        description="Quality control requirements, acceptance criteria, and QC protocols",
-    )
-    interpretation_guidelines: Optional[str] = Field(
-        None,
-        description="Guidelines for interpreting test results, reference ranges, and clinical significance",
-    )
+# Only this much of a file is read when its path does not give its type away
+DETECT_BYTES = 2048
 
 
+@lru_cache(maxsize=None)
 def detect_document_type(file_path: Path) -> str:
-    """Detect whether a markdown file is an FDA 510(k) or Lab SOP document"""
+    """Detect whether a markdown file is an FDA 510(k) or Lab SOP document
+
+    Cached per path, so every stage of a run can ask again for free.
+    """
     # Check based on directory structure
     if "Synthetic_Procedures" in str(file_path):
         return "sop"
     elif "FDA" in str(file_path):
         return "fda"
     else:
-        # Fallback: check file content for keywords
+        # Fallback: check the start of the file for keywords
         try:
-            content = file_path.read_text(encoding="utf-8")[:500].lower()
+            with open(file_path, "rb") as f:
+                head = f.read(DETECT_BYTES)
+            content = head.decode("utf-8", errors="ignore").lower()
             if "510(k)" in content or "substantial equivalence" in content:
                 return "fda"
             elif "procedure" in content or "specimen" in content:
@@ -128,104 +86,1027 @@ def detect_document_type(file_path: Path) -> str:
     return "unknown"
 
 
-async def extract_fda_data(md_file: Path, client: genai.Client) -> dict:
-    """Extract FDA 510(k) data from a single markdown file"""
-    try:
-        # Read the markdown content
-        content = md_file.read_text(encoding="utf-8")
+MODEL = "gemini-2.5-flash-lite"
+
+# Heading keywords of the sections that hold the extracted fields; used to
+# shrink documents that exceed --max-prompt-tokens
+SECTION_KEYWORDS = {
+    "fda": [
+        "intended use",
+        "indications for use",
+        "decision",
+        "product code",
+        "classification",
+        "regulation",
+        "panel",
+        "applicant",
+        "manufacturer",
+        "submitter",
+        "sponsor",
+        "trade name",
+        "proprietary name",
+        "device name",
+        "measurand",
+        "analyte",
+    ],
+    "sop": [
+        "purpose",
+        "principle",
+        "scope",
+        "clinical significance",
+        "specimen",
+        "sample",
+        "equipment",
+        "instrument",
+        "reagent",
+        "material",
+        "supplies",
+        "quality control",
+        "calibration",
+        "interpretation",
+        "reference range",
+        "reference interval",
+        "results",
+        "reporting",
+    ],
+}
+
+# The head of a long document (title page, summary, applicant block) is
+# always kept, up to this many characters
+DOCUMENT_HEAD_CHARS = 6000
+
+# Fields sit at the start of their section; a relevant section is cut here
+SECTION_CHARS = 3000
+
+# A markdown heading, or a line that starts with a bold label (pymupdf4llm
+# renders many form-style headings as "**Intended Use:** ...")
+SECTION_START_PATTERN = re.compile(r"^(?:#{1,6}\s+|\*\*)(.{1,120})", re.MULTILINE)
+
+# Prepended to the document type's prompt when several documents share one request
+PACK_PROMPT = "The text below contains {count} separate documents, each wrapped in <document index=N> tags. Treat every document independently and return one item per document, with doc_index set to the N of its tag.\n\n"
+
+# HTTP status codes worth retrying: request timeout, rate limit, server errors
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def route_document_type(md_file: Path) -> str:
+    """Extraction a file is routed to in a mixed run; undetected files get the FDA one"""
+    doc_type = detect_document_type(md_file)
+    return doc_type if doc_type in DOC_TYPES else "fda"
+
+
+def doc_type_spec(doc_type: str) -> dict:
+    """Prompt and schema for a document type; unknown types use the FDA extraction"""
+    return DOC_TYPES.get(doc_type, DOC_TYPES["fda"])
+
+
+def cache_key(content: str, doc_type: str, pre_extracted: bool = True) -> str:
+    """Content address of an extraction: document, model, prompt template, schema
+    and pre-extractor version"""
+    spec = doc_type_spec(doc_type)
+    digest = hashlib.sha256()
+    for part in (
+        MODEL,
+        spec["prompt"],
+        spec.get("pre_extract_version", "") if pre_extracted else "",
+        json.dumps(spec["schema"].model_json_schema(), sort_keys=True),
+        content,
+    ):
+        # Length-prefix each part so different splits never hash alike
+        encoded = part.encode()
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """SQLite cache of extraction results, keyed by cache_key
+
+    Each result is committed as soon as it arrives, so an interrupted run
+    resumes where it stopped: finished documents are served from the cache
+    and only new or edited ones cost API calls. WAL mode keeps commits cheap
+    and lets other processes read the cache while a run is writing it.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.hits = 0
+        # Worker processes share the file; wait for each other's commits
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                doc_type TEXT NOT NULL,
+                model TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get(self, key: str) -> dict | None:
+        row = self.conn.execute(
+            "SELECT data FROM extractions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, doc_type: str, data: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?)",
+            (key, doc_type, MODEL, json.dumps(data), datetime.now().isoformat()),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def split_sections(content: str) -> list[tuple[str, str]]:
+    """Split markdown into (heading, text) sections; leading text gets an empty heading"""
+    starts = [match.start() for match in SECTION_START_PATTERN.finditer(content)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    sections = []
+    for start, end in zip(starts, starts[1:] + [len(content)], strict=True):
+        text = content[start:end]
+        match = SECTION_START_PATTERN.match(text)
+        heading = match.group(1).replace("*", "").strip().lower() if match else ""
+        sections.append((heading, text))
+    return sections
+
+
+def pack_parts(texts: list[str], max_chars: int) -> list[str]:
+    """Pack consecutive texts into parts of at most max_chars, splitting oversized ones"""
+    parts = []
+    current = ""
+    for text in texts:
+        while len(text) > max_chars:
+            cut = text.rfind("\n", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            piece, text = text[:cut], text[cut:]
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(piece)
+        if len(current) + len(text) > max_chars and current:
+            parts.append(current)
+            current = ""
+        current += text
+    if current:
+        parts.append(current)
+    return parts
+
+
+def plan_prompts(content: str, doc_type: str, max_tokens: int) -> tuple[str, list[str]]:
+    """Decide how much of a document to send, returning (strategy, contents)
+
+    - "full": the document fits into max_tokens and is sent as is
+    - "sections": the document head plus the sections whose headings match
+      SECTION_KEYWORDS fit, and only those are sent
+    - "map-reduce": even the relevant text is too long; it is split into
+      parts of at most max_tokens whose partial extractions are merged
+    """
+    if not max_tokens or estimate_tokens(content) <= max_tokens:
+        return "full", [content]
+
+    keywords = SECTION_KEYWORDS.get(doc_type, SECTION_KEYWORDS["fda"])
+    head = content[:DOCUMENT_HEAD_CHARS]
+    relevant = [
+        text[:SECTION_CHARS]
+        for heading, text in split_sections(content[DOCUMENT_HEAD_CHARS:])
+        if any(keyword in heading for keyword in keywords)
+    ]
+    if relevant:
+        selected = head + "\n\n[...]\n\n" + "\n\n[...]\n\n".join(relevant)
+        if estimate_tokens(selected) <= max_tokens:
+            return "sections", [selected]
+        texts = [head, *relevant]
+    else:
+        texts = [text for _, text in split_sections(content)]
+    return "map-reduce", pack_parts(texts, max_tokens * 4)
+
+
+@lru_cache(maxsize=None)
+def partial_model(schema: type[BaseModel]) -> type[BaseModel]:
+    """Variant of a schema with every field optional, for extracting from excerpts"""
+    fields = {
+        name: (field.annotation | None, Field(None, description=field.description))
+        for name, field in schema.model_fields.items()
+    }
+    return create_model(f"{schema.__name__}Partial", **fields)
+
 
-        # Extract structured data using Google GenAI (async)
-        response = await client.aio.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=f"Extract the structured information from this FDA 510(k) document. Focus on: device trade name, product code, intended use, analyte/biomarker, medical specialty, manufacturer name, and FDA decision date (convert to mm-dd-yyyy format, e.g., 03-10-2005 for March 10, 2005):\n\n{content}",
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=FDA510k,
-            ),
+@lru_cache(maxsize=None)
+def subset_model(schema: type[BaseModel], names: tuple[str, ...]) -> type[BaseModel]:
+    """Variant of a schema with only the named fields, for what pre-extraction missed"""
+    fields = {
+        name: (field.annotation, field)
+        for name, field in schema.model_fields.items()
+        if name in names
+    }
+    return create_model(f"{schema.__name__}Subset", **fields)
+
+
+def pre_extract(content: str, doc_type: str, enabled: bool = True) -> dict:
+    """Fields the document type's pattern pre-extractor fills, if it has one"""
+    extractor = doc_type_spec(doc_type).get("pre_extract")
+    if not enabled or extractor is None:
+        return {}
+    return extractor(content)
+
+
+def merge_partials(schema: type[BaseModel], partials: list[BaseModel]) -> BaseModel:
+    """Merge excerpt extractions in document order into one full model
+
+    Scalars take the first non-empty value; lists are the union of all
+    values, in order of first appearance, without case-insensitive repeats.
+    """
+    merged = {}
+    for name in schema.model_fields:
+        values = [getattr(partial, name) for partial in partials]
+        values = [value for value in values if value not in (None, "", [])]
+        if values and isinstance(values[0], list):
+            seen = set()
+            merged[name] = [
+                item
+                for value in values
+                for item in value
+                if not (item.lower() in seen or seen.add(item.lower()))
+            ]
+        elif values:
+            merged[name] = values[0]
+    return schema.model_validate(merged)
+
+
+class RateLimiter:
+    """Token buckets for requests/minute and tokens/minute, adapted to 429s
+
+    Each bucket holds at most one minute of budget and refills continuously.
+    The budget is scaled by an AIMD factor: every 429 halves it (at most once
+    per `cooldown` seconds, since a burst of requests in flight tends to be
+    rejected together) and every success adds back `increase` of the
+    configured limit. Waiters are served in arrival order. `clock` and `sleep`
+    can be replaced to test the limiter without waiting.
+
+    The state lives in a flat array of doubles. Pass the array from
+    shared_state() as `shared` in every process of a run, and they all draw
+    from one budget: it is only ever touched under the array's lock, which is
+    never held across an await. time.monotonic is system-wide, so the
+    processes agree on refill times.
+    """
+
+    # Positions in the state array
+    FACTOR, REQUESTS, TOKENS, UPDATED, LAST_DECREASE, THROTTLED = range(6)
+    BUCKETS = {"requests": REQUESTS, "tokens": TOKENS}
+
+    def __init__(
+        self,
+        requests_per_minute: float | None,
+        tokens_per_minute: float | None,
+        min_factor: float = 0.05,
+        increase: float = 0.01,
+        cooldown: float = 5.0,
+        clock=time.monotonic,
+        sleep=asyncio.sleep,
+        shared=None,
+    ):
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.min_factor = min_factor
+        self.increase = increase
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+
+        self.buckets = [name for name, limit in self.limits.items() if limit]
+        if shared is None:
+            self._state = self.initial_state(
+                requests_per_minute, tokens_per_minute, clock
+            )
+            self._shared_lock = contextlib.nullcontext()
+        else:
+            self._state = shared
+            self._shared_lock = shared.get_lock()
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def initial_state(
+        requests_per_minute: float | None,
+        tokens_per_minute: float | None,
+        clock=time.monotonic,
+    ) -> list[float]:
+        """Full buckets, factor 1, no 429s yet"""
+        return [
+            1.0,
+            requests_per_minute or 0.0,
+            tokens_per_minute or 0.0,
+            clock(),
+            float("-inf"),
+            0.0,
+        ]
+
+    @classmethod
+    def shared_state(
+        cls,
+        requests_per_minute: float | None,
+        tokens_per_minute: float | None,
+        context=multiprocessing,
+    ):
+        """State array for RateLimiters in several processes to share one budget"""
+        return context.Array(
+            "d", cls.initial_state(requests_per_minute, tokens_per_minute)
         )
 
-        # Parse the response into our Pydantic model
-        fda_data = response.parsed
+    @property
+    def factor(self) -> float:
+        return self._state[self.FACTOR]
+
+    @property
+    def throttled_count(self) -> int:
+        return int(self._state[self.THROTTLED])
+
+    def _capacity(self, name: str) -> float:
+        return self.limits[name] * self._state[self.FACTOR]
+
+    def _refill(self):
+        now = self.clock()
+        elapsed = max(0.0, now - self._state[self.UPDATED])
+        self._state[self.UPDATED] = now
+        for name in self.buckets:
+            capacity = self._capacity(name)
+            slot = self.BUCKETS[name]
+            self._state[slot] = min(
+                capacity, self._state[slot] + elapsed * capacity / 60
+            )
+
+    def _take(self, tokens: int) -> float:
+        """Take one request's budget and return 0, or return the seconds to wait"""
+        with self._shared_lock:
+            self._refill()
+            # A request larger than a whole bucket only needs a full bucket
+            cost = {
+                "requests": 1,
+                "tokens": min(tokens, self._capacity("tokens"))
+                if "tokens" in self.buckets
+                else 0,
+            }
+            wait = max(
+                (
+                    (cost[name] - self._state[self.BUCKETS[name]])
+                    * 60
+                    / self._capacity(name)
+                    for name in self.buckets
+                ),
+                default=0.0,
+            )
+            if wait <= 0:
+                for name in self.buckets:
+                    self._state[self.BUCKETS[name]] -= cost[name]
+            return wait
+
+    async def acquire(self, tokens: int = 0):
+        """Wait until one request costing `tokens` fits into both buckets"""
+        async with self._lock:
+            while (wait := self._take(tokens)) > 0:
+                await self.sleep(wait)
+
+    def throttled(self):
+        """Multiplicative decrease after a 429"""
+        with self._shared_lock:
+            self._state[self.THROTTLED] += 1
+            now = self.clock()
+            if now - self._state[self.LAST_DECREASE] < self.cooldown:
+                return
+            self._state[self.LAST_DECREASE] = now
+            self._refill()
+            self._state[self.FACTOR] = max(
+                self.min_factor, self._state[self.FACTOR] / 2
+            )
+            for name in self.buckets:
+                # Pause: the server just told us the budget is used up
+                slot = self.BUCKETS[name]
+                self._state[slot] = min(self._state[slot], 0.0)
+
+    def succeeded(self):
+        """Additive increase after a successful request"""
+        with self._shared_lock:
+            self._refill()
+            self._state[self.FACTOR] = min(
+                1.0, self._state[self.FACTOR] + self.increase
+            )
+
+
+def is_transient(error: Exception) -> bool:
+    """Errors that may succeed on retry: rate limits, server and network errors"""
+    if isinstance(error, genai_errors.APIError):
+        return error.code in TRANSIENT_STATUS_CODES
+    # Network errors only: other OSErrors (missing or unreadable input files)
+    # fail again on every retry
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter, so retries do not arrive in waves"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+async def _generate(
+    client: genai.Client,
+    limiter: RateLimiter | None,
+    contents: str,
+    schema: type[BaseModel],
+    max_retries: int,
+) -> tuple[BaseModel, int]:
+    """Call Gemini under the rate limiter, retrying transient errors
+
+    Returns the parsed model and the number of attempts it took. Transient
+    errors that outlast max_retries, and permanent errors, are raised.
+    """
+    tokens = estimate_tokens(contents)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            await limiter.acquire(tokens)
+        try:
+            response = await client.aio.models.generate_content(
+                model=MODEL,
+                contents=contents,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=schema,
+                ),
+            )
+        except Exception as e:
+            if not is_transient(e) or attempt >= max_retries:
+                raise
+            if limiter is not None and getattr(e, "code", None) == 429:
+                limiter.throttled()
+            await (limiter.sleep if limiter is not None else asyncio.sleep)(
+                backoff_delay(attempt)
+            )
+            attempt += 1
+            continue
+
+        if limiter is not None:
+            limiter.succeeded()
+        if response.parsed is None:
+            raise ValueError(f"Response does not match the {schema.__name__} schema")
+        return response.parsed, attempt + 1
+
+
+def error_result(md_file: Path, doc_type: str, error: Exception) -> dict:
+    """Error record of a document; `transient` marks errors worth retrying later"""
+    return {
+        "status": "error",
+        "file": str(md_file),
+        "error": str(error),
+        "type": doc_type,
+        "transient": is_transient(error),
+    }
+
+
+def prepare_document(
+    md_file: Path,
+    content: str,
+    doc_type: str,
+    cache: ExtractionCache | None = None,
+    max_prompt_tokens: int = 0,
+    use_pre_extract: bool = True,
+) -> dict:
+    """Plan the extraction of one document without calling the API
+
+    The plan holds the prompts to send and the schema of their responses.
+    Documents found in `cache` for the same content, model, prompt and schema,
+    and documents the pattern pre-extractor (see fda_preextract.py) resolves
+    completely, get a plan without prompts whose `data` is already final.
+    Otherwise only the fields the pre-extractor missed are requested, and
+    documents longer than `max_prompt_tokens` are reduced as described in
+    plan_prompts.
+    """
+    spec = doc_type_spec(doc_type)
+    plan = {
+        "file": md_file,
+        "type": doc_type,
+        "content": content,
+        "key": (
+            cache_key(content, doc_type, use_pre_extract) if cache is not None else None
+        ),
+        "prefilled": {},
+        "schema": spec["schema"],
+        "prompts": [],
+        "data": None,
+    }
+
+    cached = cache.get(plan["key"]) if cache is not None else None
+    if cached is not None:
+        plan["strategy"] = "cache"
+        plan["data"] = spec["schema"].model_validate(cached)
+        return plan
+
+    prefilled = pre_extract(content, doc_type, use_pre_extract)
+    missing = tuple(
+        name for name in spec["schema"].model_fields if name not in prefilled
+    )
+    if not missing:
+        plan["strategy"] = "regex"
+        plan["data"] = spec["schema"].model_validate(prefilled)
+        return plan
+    if prefilled:
+        plan["prefilled"] = prefilled
+        plan["schema"] = subset_model(spec["schema"], missing)
+
+    strategy, contents = plan_prompts(content, doc_type, max_prompt_tokens)
+    plan["strategy"] = strategy
+    if strategy == "map-reduce":
+        plan["prompts"] = [
+            spec["prompt"].format(
+                content=f"[Excerpt {i} of {len(contents)}; leave fields this excerpt does not mention empty]\n\n{part}"
+            )
+            for i, part in enumerate(contents, 1)
+        ]
+    else:
+        plan["prompts"] = [spec["prompt"].format(content=contents[0])]
+    return plan
 
-        return {
-            "status": "success",
-            "file": str(md_file),
-            "data": fda_data,
-            "type": "fda",
-        }
 
+async def call_document(
+    plan: dict,
+    client: genai.Client,
+    limiter: RateLimiter | None = None,
+    max_retries: int = 5,
+) -> list[tuple[BaseModel, int]] | Exception:
+    """Send a plan's prompts concurrently
+
+    Returns (parsed response, attempts) per prompt, or the error that ended
+    the call; the excerpts of a map-reduce are requested with every field
+    optional.
+    """
+    schema = plan["schema"]
+    if plan["strategy"] == "map-reduce":
+        schema = partial_model(schema)
+    try:
+        return await asyncio.gather(
+            *(
+                _generate(client, limiter, prompt, schema, max_retries)
+                for prompt in plan["prompts"]
+            )
+        )
+    except Exception as e:
+        return e
+
+
+def finish_document(
+    plan: dict,
+    outcomes: list[tuple[BaseModel, int]] | Exception,
+    cache: ExtractionCache | None = None,
+) -> dict:
+    """Validate a plan's outcomes into the document's result and cache it
+
+    Pattern matches are exact copies of header lines, so they win over the
+    model's values. Errors are reported with `transient` set when they were
+    still retryable (rate limits, server or network errors) after max_retries
+    attempts, so those files can be retried later while permanent failures
+    are not.
+    """
+    md_file, doc_type = plan["file"], plan["type"]
+    if isinstance(outcomes, Exception):
+        return error_result(md_file, doc_type, outcomes)
+
+    schema = doc_type_spec(doc_type)["schema"]
+    try:
+        if plan["data"] is not None:
+            data = plan["data"]
+        else:
+            if plan["strategy"] == "map-reduce":
+                data = merge_partials(
+                    plan["schema"], [partial for partial, _ in outcomes]
+                )
+            else:
+                data = outcomes[0][0]
+            data = schema.model_validate({**data.model_dump(), **plan["prefilled"]})
+        if cache is not None and plan["strategy"] != "cache":
+            cache.put(plan["key"], doc_type, data.model_dump())
     except Exception as e:
-        return {"status": "error", "file": str(md_file), "error": str(e), "type": "fda"}
+        return error_result(md_file, doc_type, e)
+
+    return {
+        "status": "success",
+        "file": str(md_file),
+        "data": data,
+        "type": doc_type,
+        "attempts": sum(attempts for _, attempts in outcomes),
+        "calls": len(plan["prompts"]),
+        "strategy": plan["strategy"],
+        "prompt_tokens": sum(estimate_tokens(prompt) for prompt in plan["prompts"]),
+    }
 
 
-async def extract_sop_data(md_file: Path, client: genai.Client) -> dict:
-    """Extract Lab SOP data from a single markdown file"""
+async def extract_document(
+    md_file: Path,
+    client: genai.Client,
+    doc_type: str,
+    limiter: RateLimiter | None = None,
+    max_retries: int = 5,
+    cache: ExtractionCache | None = None,
+    max_prompt_tokens: int = 0,
+    use_pre_extract: bool = True,
+) -> dict:
+    """Extract structured data from a single markdown file
+
+    Runs prepare_document, call_document and finish_document in turn; results
+    from the cache or the pre-extractor take zero attempts and calls.
+    """
     try:
         # Read the markdown content
         content = md_file.read_text(encoding="utf-8")
-
-        # Extract structured data using Google GenAI (async)
-        response = await client.aio.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=f"Extract the structured information from this Laboratory Standard Operating Procedure (SOP) document. Focus on: procedure name, specimen type, analyte/biomarker being measured, medical specialty, clinical purpose, equipment/instruments used, reagents/kits required, quality control requirements, and interpretation guidelines:\n\n{content}",
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=LabSOP,
-            ),
+        plan = prepare_document(
+            md_file, content, doc_type, cache, max_prompt_tokens, use_pre_extract
         )
+    except Exception as e:
+        return error_result(md_file, doc_type, e)
 
-        # Parse the response into our Pydantic model
-        sop_data = response.parsed
+    # Extract structured data using Google GenAI (async)
+    outcomes = await call_document(plan, client, limiter, max_retries)
+    return finish_document(plan, outcomes, cache)
 
-        return {
-            "status": "success",
-            "file": str(md_file),
-            "data": sop_data,
-            "type": "sop",
-        }
 
+async def extract_fda_data(
+    md_file: Path,
+    client: genai.Client,
+    limiter: RateLimiter | None = None,
+    max_retries: int = 5,
+) -> dict:
+    """Extract FDA 510(k) data from a single markdown file"""
+    return await extract_document(md_file, client, "fda", limiter, max_retries)
+
+
+async def extract_sop_data(
+    md_file: Path,
+    client: genai.Client,
+    limiter: RateLimiter | None = None,
+    max_retries: int = 5,
+) -> dict:
+    """Extract Lab SOP data from a single markdown file"""
+    return await extract_document(md_file, client, "sop", limiter, max_retries)
+
+
+@lru_cache(maxsize=None)
+def packed_item_model(schema: type[BaseModel]) -> type[BaseModel]:
+    """One document's result inside a packed response"""
+    return create_model(
+        f"{schema.__name__}PackedItem",
+        doc_index=(
+            int,
+            Field(description="The N of the document's <document index=N> tag"),
+        ),
+        data=(
+            schema,
+            Field(description="Structured data extracted from that document"),
+        ),
+    )
+
+
+def plan_jobs(
+    files: list[Path], pack_size: int, pack_max_tokens: int, doc_type: str = "fda"
+):
+    """Group files into (document type, files) requests
+
+    Small files are packed together, the rest go alone. A file is small if it
+    needs at most half of pack_max_tokens; a pack closes at pack_size files or
+    pack_max_tokens tokens. Sizes come from the file system (bytes / 4). With
+    doc_type "auto" each file is routed by route_document_type, which reads at
+    most the first bytes of a file, and packs never mix document types.
+    """
+    packs = {}
+    for md_file in files:
+        file_type = route_document_type(md_file) if doc_type == "auto" else doc_type
+        try:
+            tokens = md_file.stat().st_size // 4 + 1 if pack_size > 1 else 0
+        except OSError:
+            # Sent alone; the read stage reports the error
+            tokens = pack_max_tokens
+        if pack_size <= 1 or tokens > pack_max_tokens // 2:
+            yield file_type, [md_file]
+            continue
+        pack, pack_tokens = packs.get(file_type, ([], 0))
+        if pack and (len(pack) >= pack_size or pack_tokens + tokens > pack_max_tokens):
+            yield file_type, pack
+            pack, pack_tokens = [], 0
+        pack.append(md_file)
+        packs[file_type] = (pack, pack_tokens + tokens)
+    for file_type, (pack, _) in packs.items():
+        if pack:
+            yield file_type, pack
+
+
+async def call_pack(
+    plans: list[dict],
+    client: genai.Client,
+    limiter: RateLimiter | None = None,
+    max_retries: int = 5,
+) -> list[tuple[dict, list[tuple[BaseModel, int]] | Exception]]:
+    """Send the documents of several plans with a single request
+
+    The response must hold exactly one valid item per document. Documents
+    whose item is missing, duplicated or invalid, and all documents of a pack
+    whose response cannot be parsed or is rejected as a bad request, fall
+    back to one request each (call_document). A pack that is still failing
+    transiently after max_retries is not split, since that would multiply the
+    load on a service that is already refusing it: every document gets the
+    error, which keeps it retryable. Packed documents get strategy "packed";
+    the request's attempts and tokens are booked on the first of them.
+    Returns (plan, outcomes) per document.
+    """
+    spec = doc_type_spec(plans[0]["type"])
+    contents = PACK_PROMPT.format(count=len(plans)) + spec["prompt"].format(
+        content="\n\n".join(
+            f"<document index={i}>\n{plan['content']}\n</document>"
+            for i, plan in enumerate(plans)
+        )
+    )
+    try:
+        items, attempts = await _generate(
+            client,
+            limiter,
+            contents,
+            list[packed_item_model(spec["schema"])],
+            max_retries,
+        )
     except Exception as e:
-        return {"status": "error", "file": str(md_file), "error": str(e), "type": "sop"}
+        if is_transient(e):
+            return [(plan, e) for plan in plans]
+        items, attempts = [], 0
+
+    by_index = {}
+    for item in items:
+        by_index.setdefault(item.doc_index, []).append(item)
+    answered, fallback = [], []
+    for i, plan in enumerate(plans):
+        matches = by_index.get(i, [])
+        if len(matches) != 1:
+            fallback.append(plan)
+            continue
+        # Documents of a pack need different fields, so the full schema was
+        # requested; finish_document lays the pattern matches over it
+        first = not answered
+        packed = {
+            **plan,
+            "strategy": "packed",
+            "prompts": [contents] if first else [],
+        }
+        answered.append((packed, [(matches[0].data, attempts if first else 0)]))
+
+    singles = await asyncio.gather(
+        *(call_document(plan, client, limiter, max_retries) for plan in fallback)
+    )
+    return answered + list(zip(fallback, singles, strict=True))
 
 
-async def process_batch(
-    files_batch: list[Path],
-    batch_num: int,
-    total_batches: int,
+async def call_plans(
+    plans: list[dict],
     client: genai.Client,
-    doc_type: str = "fda",
+    limiter: RateLimiter | None = None,
+    max_retries: int = 5,
+) -> list[tuple[dict, list[tuple[BaseModel, int]] | Exception]]:
+    """Send one plan on its own, or several as a pack; (plan, outcomes) per document"""
+    if len(plans) > 1:
+        return await call_pack(plans, client, limiter, max_retries)
+    return [
+        (plan, await call_document(plan, client, limiter, max_retries))
+        for plan in plans
+    ]
+
+
+async def extract_pack(
+    md_files: list[Path],
+    client: genai.Client,
+    doc_type: str,
+    limiter: RateLimiter | None = None,
+    max_retries: int = 5,
+    cache: ExtractionCache | None = None,
+    max_prompt_tokens: int = 0,
+    use_pre_extract: bool = True,
 ) -> list[dict]:
-    """Process a batch of files concurrently"""
-    print(
-        f"\n[Batch {batch_num}/{total_batches}] Processing {len(files_batch)} files..."
-    )
+    """Extract several small documents with a single request
+
+    Cached documents and documents the pattern pre-extractor resolves
+    completely are answered locally, a single remaining document is sent on
+    its own and the rest together (see call_pack). Results are in the order
+    of md_files.
+    """
+    results = {}
+    pending = []
+    for md_file in md_files:
+        try:
+            plan = prepare_document(
+                md_file,
+                md_file.read_text(encoding="utf-8"),
+                doc_type,
+                cache,
+                max_prompt_tokens,
+                use_pre_extract,
+            )
+        except Exception as e:
+            results[md_file] = error_result(md_file, doc_type, e)
+            continue
+        if plan["prompts"]:
+            pending.append(plan)
+        else:
+            results[md_file] = finish_document(plan, [], cache)
+
+    for plan, outcomes in await call_plans(pending, client, limiter, max_retries):
+        results[plan["file"]] = finish_document(plan, outcomes, cache)
+
+    return [results[md_file] for md_file in md_files]
+
+
+def meta_path_for(output_file: Path) -> Path:
+    """Metadata sidecar of an output file, e.g. run.jsonl -> run.meta.json"""
+    return output_file.with_suffix(".meta.json")
+
+
+def write_json_atomic(path: Path, data: dict):
+    """Write JSON to a temp file and rename it into place, so readers never see a partial file"""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
-    # Choose extraction function based on document type
-    if doc_type == "sop":
-        tasks = [extract_sop_data(file, client) for file in files_batch]
-    else:
-        tasks = [extract_fda_data(file, client) for file in files_batch]
-
-    # Process with progress bar
-    results = []
-    for coro in tqdm(
-        asyncio.as_completed(tasks),
-        total=len(tasks),
-        desc=f"Batch {batch_num}",
-        unit="file",
-    ):
-        result = await coro
-        results.append(result)
 
-    # Count successes and errors
-    successes = sum(1 for r in results if r["status"] == "success")
-    errors = sum(1 for r in results if r["status"] == "error")
+class JsonlWriter:
+    """Appends one JSON record per line, fsync'ing every `fsync_every` records
 
+    Every record is flushed to the OS as it is written, so a crashed process
+    loses nothing; fsync bounds what a power loss can take to the last
+    `fsync_every` records. A torn last line is the only possible damage.
+    """
+
+    def __init__(self, path: Path, fsync_every: int = 100):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.records = 0
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.records += 1
+        if self.fsync_every and self.records % self.fsync_every == 0:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+def read_texts(md_files: list[Path]) -> list[str | Exception]:
+    """Read a job's markdown files; meant to run in a worker thread"""
+    texts = []
+    for md_file in md_files:
+        try:
+            texts.append(md_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            texts.append(e)
+    return texts
+
+
+class StageMetrics:
+    """Items, busy time and input queue depth of one pipeline stage
+
+    Depth is sampled each time a worker takes an item. A bottleneck shows as
+    high utilisation together with a full input queue, while the stages after
+    it sit idle on empty queues.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.items = 0
+        self.busy = 0.0
+        self.depth_total = 0
+        self.depth_max = 0
+
+    def record(self, depth: int, seconds: float):
+        self.items += 1
+        self.busy += seconds
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def summary(self, elapsed: float) -> dict:
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "mean_latency_ms": round(self.busy / max(1, self.items) * 1000, 2),
+            "utilisation": round(self.busy / max(1e-9, elapsed * self.workers), 3),
+            "mean_queue_depth": round(self.depth_total / max(1, self.items), 1),
+            "max_queue_depth": self.depth_max,
+            "queue_size": self.queue_size,
+        }
+
+
+# Closes a pipeline queue: every worker of the receiving stage exits on it
+STOP = object()
+
+
+async def run_stage(inbox: asyncio.Queue, handler, metrics: StageMetrics):
+    """Run the workers of one pipeline stage until their inbox is closed
+
+    handler(item) returns the (queue, item) pairs to pass on. They are put
+    after the handler's latency is recorded, so time spent blocked on a full
+    downstream queue (backpressure) is not counted as work.
+    """
+
+    async def worker():
+        while True:
+            item = await inbox.get()
+            if item is STOP:
+                # Leave the sentinel for the other workers of this stage
+                await inbox.put(STOP)
+                return
+            depth = inbox.qsize()
+            start = time.perf_counter()
+            outputs = await handler(item)
+            metrics.record(depth, time.perf_counter() - start)
+            for queue, output in outputs:
+                await queue.put(output)
+
+    await asyncio.gather(*(worker() for _ in range(metrics.workers)))
+
+
+def combine_stage_summaries(summaries: list[dict]) -> dict:
+    """Add up the StageMetrics summaries of one stage in several processes"""
+    items = sum(summary["items"] for summary in summaries)
+    return {
+        "workers": sum(summary["workers"] for summary in summaries),
+        "items": items,
+        "mean_latency_ms": round(
+            sum(s["mean_latency_ms"] * s["items"] for s in summaries) / max(1, items),
+            2,
+        ),
+        "utilisation": round(
+            sum(s["utilisation"] for s in summaries) / len(summaries), 3
+        ),
+        "mean_queue_depth": round(
+            sum(s["mean_queue_depth"] * s["items"] for s in summaries) / max(1, items),
+            1,
+        ),
+        "max_queue_depth": max(s["max_queue_depth"] for s in summaries),
+        "queue_size": summaries[0]["queue_size"],
+    }
+
+
+def print_run_summary(metadata: dict, limiter: RateLimiter | None = None):
+    """Print the statistics of a finished run from its metadata"""
+    duration = metadata["duration_seconds"]
+    total = metadata["total_files"]
+    print(f"\n{'=' * 60}")
+    print("Processing complete!")
+    print(f"  - Total time: {duration:.2f} seconds")
+    print(f"  - Files/second: {total / max(duration, 1e-9):.2f}")
+    print(f"  - Successfully processed: {metadata['successful']}/{total}")
+    print(f"  - Errors: {metadata['errors']}")
+    print(f"  - Retries: {metadata['retries']}")
+    print(f"  - Estimated prompt tokens sent: {metadata['prompt_tokens']}")
     print(
-        f"[Batch {batch_num}/{total_batches}] Complete: {successes} succeeded, {errors} failed"
+        "  - Documents by prompt strategy: "
+        + ", ".join(
+            f"{name} {count}" for name, count in sorted(metadata["strategies"].items())
+        )
     )
-
-    return results
+    if metadata["cache_hits"] is not None:
+        print(f"  - Served from cache: {metadata['cache_hits']}")
+    if limiter is not None:
+        print(f"  - Rate limited (429) responses: {limiter.throttled_count}")
+        print(f"  - Final rate limit factor: {limiter.factor:.2f}")
+    print("  - Pipeline stages (input queue depth is mean/max of its size):")
+    print(
+        f"    {'stage':<9}{'workers':>8}{'items':>8}{'latency ms':>12}{'busy':>7}{'queue depth':>18}"
+    )
+    stages = metadata["stages"]
+    for name, summary in stages.items():
+        depth = f"{summary['mean_queue_depth']:.1f}/{summary['max_queue_depth']} of {summary['queue_size']}"
+        print(
+            f"    {name:<9}{summary['workers']:>8}{summary['items']:>8}"
+            f"{summary['mean_latency_ms']:>12.2f}{summary['utilisation']:>7.0%}{depth:>18}"
+        )
+    busiest = max(stages, key=lambda name: stages[name]["utilisation"])
+    print(f"  - Busiest stage: {busiest}")
+    print(f"{'=' * 60}")
 
 
 async def process_all_files(
@@ -234,84 +1115,437 @@ async def process_all_files(
     client: genai.Client,
     output_file: Path,
     doc_type: str = "fda",
-) -> tuple[list[dict], list[dict]]:
-    """Process all files in batches with streaming output"""
-    all_results = []
+    concurrency: int = 100,
+    limiter: RateLimiter | None = None,
+    max_retries: int = 5,
+    fsync_every: int = 100,
+    cache: ExtractionCache | None = None,
+    max_prompt_tokens: int = 0,
+    pack_size: int = 1,
+    pack_max_tokens: int = 8000,
+    use_pre_extract: bool = True,
+    read_workers: int = 8,
+    shard: int | None = None,
+) -> tuple[int, list[dict]]:
+    """Process all files through a pipeline of stages joined by bounded queues
+
+    read:     `read_workers` threads read the files of each job (see plan_jobs)
+    prepare:  cache lookup, pattern pre-extraction and prompt assembly
+              (prepare_document); resolved documents skip the call stage
+    call:     `concurrency` workers send requests (call_plans), so that many
+              are in flight and one slow document never holds up the rest
+    validate: outcomes become results and are cached (finish_document)
+    write:    each result is appended to the JSONL output as soon as it
+              arrives and then dropped, so memory stays flat however many
+              files are processed
+
+    Every queue holds at most `concurrency` items, so a slow stage holds up
+    the stages before it instead of letting work pile up. The metadata sidecar
+    is rewritten every `batch_size` finished files, and at the end with the
+    per-stage metrics. With doc_type "auto" every file is routed to the FDA or
+    SOP extraction on its own (see plan_jobs), all sharing the same stages and
+    `concurrency`, and results go to one output per document type
+    (partition_path_for). Returns the number of successes and the (small) error
+    records. Worker processes (see process_in_workers) pass their `shard`
+    number, which gives them their own progress bar and no console summary.
+    """
+    successes = 0
+    retries = 0
+    prompt_tokens = 0
+    strategies = {}
     all_errors = []
 
-    # Split files into batches
-    batches = [files[i : i + batch_size] for i in range(0, len(files), batch_size)]
-    total_batches = len(batches)
-
-    print(f"\n{'=' * 60}")
-    print("Starting async processing:")
-    print(f"  - Document type: {doc_type.upper()}")
-    print(f"  - Total files: {len(files)}")
-    print(f"  - Batch size: {batch_size}")
-    print(f"  - Total batches: {total_batches}")
-    print(f"{'=' * 60}")
+    if shard is None:
+        print(f"\n{'=' * 60}")
+        print("Starting async processing:")
+        print(
+            "  - Document type: "
+            + ("AUTO (per file)" if doc_type == "auto" else doc_type.upper())
+        )
+        print(f"  - Total files: {len(files)}")
+        print(f"  - Concurrent requests: {concurrency}")
+        print(f"  - File reader threads: {read_workers}")
+        print(f"  - Checkpoint every: {batch_size} files")
+        if pack_size > 1:
+            print(
+                f"  - Packing: up to {pack_size} files / {pack_max_tokens} tokens per request"
+            )
+        print(f"{'=' * 60}")
 
     start_time = datetime.now()
 
-    # Initialize output file with metadata
-    output_data = {
-        "metadata": {
-            "document_type": doc_type,
-            "total_files": len(files),
-            "extraction_date": datetime.now().isoformat(),
-            "batch_size": batch_size,
-        },
-        "results": [],
-        "errors": [],
+    # Metadata lives in a sidecar so the results file is never rewritten
+    meta_file = meta_path_for(output_file)
+    metadata = {
+        "document_type": doc_type,
+        "total_files": len(files),
+        "extraction_date": datetime.now().isoformat(),
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "results_files": {},
+        "complete": False,
     }
 
-    # Process each batch
-    for batch_num, batch in enumerate(batches, 1):
-        batch_results = await process_batch(
-            batch, batch_num, total_batches, client, doc_type
-        )
+    def write_metadata():
+        metadata["successful"] = successes
+        metadata["errors"] = len(all_errors)
+        metadata["last_updated"] = datetime.now().isoformat()
+        write_json_atomic(meta_file, metadata)
+
+    # One writer per document type, opened when its first result arrives
+    writers = {}
+
+    def writer_for(result_type: str) -> JsonlWriter:
+        if result_type not in writers:
+            path = (
+                partition_path_for(output_file, result_type)
+                if doc_type == "auto"
+                else output_file
+            )
+            writers[result_type] = JsonlWriter(path, fsync_every)
+            metadata["results_files"][result_type] = path.name
+        return writers[result_type]
+
+    if doc_type != "auto":
+        writer_for(doc_type)
+    write_metadata()
+
+    progress = tqdm(
+        total=len(files),
+        desc="Extracting" if shard is None else f"Worker {shard}",
+        unit="file",
+        position=shard or 0,
+    )
 
-        # Separate successes and errors
-        batch_successes = [r for r in batch_results if r["status"] == "success"]
-        batch_errors = [r for r in batch_results if r["status"] == "error"]
+    # A pool of its own, so file reads never queue behind other to_thread work
+    loop = asyncio.get_running_loop()
+    read_pool = ThreadPoolExecutor(read_workers, thread_name_prefix="read")
 
-        all_results.extend(batch_successes)
-        all_errors.extend(batch_errors)
+    queue_size = max(1, concurrency)
+    read_queue, prepare_queue, call_queue, validate_queue, write_queue = (
+        asyncio.Queue(queue_size) for _ in range(5)
+    )
+    stages = {
+        "read": StageMetrics("read", read_workers, queue_size),
+        "prepare": StageMetrics("prepare", 1, queue_size),
+        "call": StageMetrics("call", concurrency, queue_size),
+        "validate": StageMetrics("validate", 1, queue_size),
+        "write": StageMetrics("write", 1, queue_size),
+    }
 
-        # Stream results to file after each batch to avoid memory buildup
-        # Convert Pydantic models to dicts for JSON serialization
-        json_batch_results = [
-            {"file": Path(r["file"]).name, "data": r["data"].model_dump()}
-            for r in batch_successes
-        ]
-        json_batch_errors = [
-            {"file": Path(e["file"]).name, "error": e["error"]} for e in batch_errors
+    async def read(job: tuple[str, list[Path]]):
+        job_type, job_files = job
+        texts = await loop.run_in_executor(read_pool, read_texts, job_files)
+        return [(prepare_queue, (job_type, job_files, texts))]
+
+    async def prepare(item: tuple[str, list[Path], list[str | Exception]]):
+        job_type, job_files, texts = item
+        outputs, pending = [], []
+        for md_file, content in zip(job_files, texts, strict=True):
+            try:
+                if isinstance(content, Exception):
+                    raise content
+                plan = prepare_document(
+                    md_file,
+                    content,
+                    job_type,
+                    cache,
+                    max_prompt_tokens,
+                    use_pre_extract,
+                )
+            except Exception as e:
+                outputs.append((write_queue, error_result(md_file, job_type, e)))
+                continue
+            if plan["prompts"]:
+                pending.append(plan)
+            else:
+                outputs.append((validate_queue, (plan, [])))
+        if pending:
+            outputs.append((call_queue, pending))
+        return outputs
+
+    async def call(plans: list[dict]):
+        return [
+            (validate_queue, answer)
+            for answer in await call_plans(plans, client, limiter, max_retries)
         ]
 
-        output_data["results"].extend(json_batch_results)
-        output_data["errors"].extend(json_batch_errors)
+    async def validate(item: tuple[dict, list | Exception]):
+        plan, outcomes = item
+        return [(write_queue, finish_document(plan, outcomes, cache))]
+
+    async def write(result: dict):
+        nonlocal successes, retries, prompt_tokens
+        if result["status"] == "success":
+            successes += 1
+            retries += result["attempts"] - result["calls"]
+            prompt_tokens += result["prompt_tokens"]
+            strategy = result["strategy"]
+            strategies[strategy] = strategies.get(strategy, 0) + 1
+            # Convert Pydantic models to dicts for JSON serialization
+            record = {
+                "file": Path(result["file"]).name,
+                "status": "success",
+                "data": result["data"].model_dump(),
+            }
+        else:
+            all_errors.append(
+                {
+                    "file": result["file"],
+                    "error": result["error"],
+                    "transient": result["transient"],
+                }
+            )
+            record = {
+                "file": Path(result["file"]).name,
+                "status": "error",
+                "error": result["error"],
+                "transient": result["transient"],
+            }
+        # Inline: a buffered append is cheaper than a thread hand-off; the
+        # fsync every fsync_every records is the only blocking part
+        writer_for(result["type"]).write(record)
+        progress.update(1)
+        progress.set_postfix(errors=len(all_errors))
+
+        # Checkpoint the metadata every batch_size finished files
+        if (successes + len(all_errors)) % batch_size == 0:
+            write_metadata()
+        return []
+
+    async def feed():
+        for job in plan_jobs(files, pack_size, pack_max_tokens, doc_type):
+            await read_queue.put(job)
+        await read_queue.put(STOP)
+
+    async def stage(inbox: asyncio.Queue, handler, metrics: StageMetrics, outbox):
+        await run_stage(inbox, handler, metrics)
+        if outbox is not None:
+            await outbox.put(STOP)
+
+    # Each queue is closed once every stage that feeds it has finished
+    pipeline_start = time.perf_counter()
+    await asyncio.gather(
+        feed(),
+        stage(read_queue, read, stages["read"], prepare_queue),
+        stage(prepare_queue, prepare, stages["prepare"], call_queue),
+        stage(call_queue, call, stages["call"], validate_queue),
+        stage(validate_queue, validate, stages["validate"], write_queue),
+        stage(write_queue, write, stages["write"], None),
+    )
+    elapsed = time.perf_counter() - pipeline_start
+    read_pool.shutdown()
+
+    progress.close()
+    for writer in writers.values():
+        writer.close()
+    metadata["stages"] = {
+        name: metrics.summary(elapsed) for name, metrics in stages.items()
+    }
+    metadata["retries"] = retries
+    metadata["prompt_tokens"] = prompt_tokens
+    metadata["strategies"] = strategies
+    metadata["cache_hits"] = cache.hits if cache is not None else None
+    metadata["duration_seconds"] = (datetime.now() - start_time).total_seconds()
+    metadata["complete"] = True
+    write_metadata()
+
+    if shard is None:
+        print_run_summary(metadata, limiter)
+
+    return successes, all_errors
+
+
+def make_client(api_key: str, api_base_url: str | None = None) -> genai.Client:
+    """Google GenAI client, optionally pointed at another endpoint"""
+    http_options = None
+    if api_base_url:
+        http_options = types.HttpOptions(base_url=api_base_url)
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def partition_path_for(output_file: Path, doc_type: str) -> Path:
+    """Output of one document type in a mixed run, e.g. run.jsonl -> run.sop.jsonl"""
+    return output_file.with_suffix(f".{doc_type}{output_file.suffix}")
+
+
+def shard_path_for(output_file: Path, shard: int) -> Path:
+    """Output of one worker process, e.g. run.jsonl -> run.worker-3.jsonl"""
+    return output_file.with_suffix(f".worker-{shard}{output_file.suffix}")
+
+
+# Rate limiter state shared by all worker processes, set by init_worker
+_shared_limiter_state = None
 
-        # Update metadata with current stats
-        output_data["metadata"]["successful"] = len(all_results)
-        output_data["metadata"]["errors"] = len(all_errors)
-        output_data["metadata"]["last_updated"] = datetime.now().isoformat()
 
-        # Write updated data to file
-        with open(output_file, "w") as f:
-            json.dump(output_data, f, indent=2)
+def init_worker(limiter_state):
+    """Process pool initializer: shared objects can only be passed at startup"""
+    global _shared_limiter_state
+    _shared_limiter_state = limiter_state
 
-    end_time = datetime.now()
-    duration = (end_time - start_time).total_seconds()
+
+def run_worker(
+    shard: int,
+    files: list[Path],
+    output_file: Path,
+    client_options: dict,
+    limits: tuple[float | None, float | None],
+    cache_file: Path | None,
+    options: dict,
+) -> tuple[int, list[dict]]:
+    """Worker process: its own event loop, client and cache connection"""
+    client = make_client(**client_options)
+    limiter = RateLimiter(*limits, shared=_shared_limiter_state)
+    cache = ExtractionCache(cache_file) if cache_file is not None else None
+    try:
+        return asyncio.run(
+            process_all_files(
+                files,
+                client=client,
+                output_file=shard_path_for(output_file, shard),
+                limiter=limiter,
+                cache=cache,
+                shard=shard,
+                **options,
+            )
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def merge_shards(output_file: Path, shards: list[Path]):
+    """Concatenate worker outputs into the output file and remove them"""
+    with open(output_file, "wb") as out:
+        for shard_file in shards:
+            with open(shard_file, "rb") as f:
+                shutil.copyfileobj(f, out)
+        out.flush()
+        os.fsync(out.fileno())
+    for shard_file in shards:
+        shard_file.unlink()
+
+
+async def process_in_workers(
+    files: list[Path],
+    processes: int,
+    output_file: Path,
+    client_options: dict,
+    limits: tuple[float | None, float | None],
+    cache_file: Path | None,
+    **options,
+) -> tuple[int, list[dict]]:
+    """Run process_all_files in several processes and merge their outputs
+
+    Pydantic validation, JSON serialisation and progress reporting all run
+    on the event loop, so at high concurrency one process is CPU-bound before
+    the API is. Each worker process gets every n-th file, its own event loop,
+    client, cache connection and `concurrency` requests in flight, and
+    writes to its own shard. SQLite WAL allows one writer at a time alongside
+    concurrent readers; workers committing at once wait on each other through
+    the cache's 30 s busy timeout. The rate limit is shared: all workers draw
+    from one set of buckets in shared memory, so `limits` holds for the whole
+    run. Workers are spawned, not forked, since a forked event loop or HTTP
+    client is not safe to use. Once all have finished, the shards are
+    concatenated into `output_file` and their metadata combined into its
+    sidecar.
+    """
+    context = multiprocessing.get_context("spawn")
+    limiter_state = RateLimiter.shared_state(*limits, context=context)
+    shards = [files[i::processes] for i in range(processes)]
 
     print(f"\n{'=' * 60}")
-    print("Processing complete!")
-    print(f"  - Total time: {duration:.2f} seconds")
-    print(f"  - Files/second: {len(files) / duration:.2f}")
-    print(f"  - Successfully processed: {len(all_results)}/{len(files)}")
-    print(f"  - Errors: {len(all_errors)}")
+    print("Starting multi-process processing:")
+    print(f"  - Total files: {len(files)}")
+    print(f"  - Worker processes: {processes}")
+    print(
+        f"  - Concurrent requests: {options.get('concurrency', 100)} per process,"
+        f" {options.get('concurrency', 100) * processes} in total"
+    )
     print(f"{'=' * 60}")
 
-    return all_results, all_errors
+    start_time = datetime.now()
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(
+        processes,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(limiter_state,),
+    ) as pool:
+        outcomes = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    pool,
+                    run_worker,
+                    shard,
+                    shard_files,
+                    output_file,
+                    client_options,
+                    limits,
+                    cache_file,
+                    options,
+                )
+                for shard, shard_files in enumerate(shards)
+            )
+        )
+
+    shard_meta_files = [
+        meta_path_for(shard_path_for(output_file, shard)) for shard in range(processes)
+    ]
+    shard_metadata = [json.loads(path.read_text()) for path in shard_meta_files]
+
+    # Merge the shards of each document type (just one unless doc_type is auto)
+    results_files = {}
+    result_types = {name for meta in shard_metadata for name in meta["results_files"]}
+    for result_type in sorted(result_types):
+        target = (
+            partition_path_for(output_file, result_type)
+            if options.get("doc_type") == "auto"
+            else output_file
+        )
+        merge_shards(
+            target,
+            [
+                output_file.parent / meta["results_files"][result_type]
+                for meta in shard_metadata
+                if result_type in meta["results_files"]
+            ],
+        )
+        results_files[result_type] = target.name
+    for path in shard_meta_files:
+        path.unlink()
+
+    strategies = {}
+    for shard_meta in shard_metadata:
+        for name, count in shard_meta["strategies"].items():
+            strategies[name] = strategies.get(name, 0) + count
+    cache_hits = [shard_meta["cache_hits"] for shard_meta in shard_metadata]
+    metadata = {
+        **shard_metadata[0],
+        "total_files": len(files),
+        "processes": processes,
+        "results_files": results_files,
+        "successful": sum(successes for successes, _ in outcomes),
+        "errors": sum(len(errors) for _, errors in outcomes),
+        "retries": sum(shard_meta["retries"] for shard_meta in shard_metadata),
+        "prompt_tokens": sum(
+            shard_meta["prompt_tokens"] for shard_meta in shard_metadata
+        ),
+        "strategies": strategies,
+        "cache_hits": None if None in cache_hits else sum(cache_hits),
+        "stages": {
+            name: combine_stage_summaries(
+                [shard_meta["stages"][name] for shard_meta in shard_metadata]
+            )
+            for name in shard_metadata[0]["stages"]
+        },
+        "duration_seconds": (datetime.now() - start_time).total_seconds(),
+        "last_updated": datetime.now().isoformat(),
+    }
+    write_json_atomic(meta_path_for(output_file), metadata)
+
+    print_run_summary(metadata, RateLimiter(*limits, shared=limiter_state))
+    return metadata["successful"], [error for _, errors in outcomes for error in errors]
 
 
 def parse_args():
@@ -332,7 +1566,7 @@ def parse_args():
         "--output-file",
         type=Path,
         default=None,
-        help="Output JSON file path (default: fda_510k_extracted_<timestamp>.json or lab_sop_extracted_<timestamp>.json)",
+        help="Output JSONL file path, one record per document, with run metadata in <name>.meta.json (default: fda_510k_extracted_<timestamp>.jsonl or lab_sop_extracted_<timestamp>.jsonl)",
     )
 
     parser.add_argument(
@@ -346,7 +1580,112 @@ def parse_args():
         "--batch-size",
         type=int,
         default=100,
-        help="Number of files to process concurrently per batch",
+        help="Number of finished files between checkpoints of the <name>.meta.json sidecar; records are appended to the output as they finish",
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=100,
+        help="Maximum number of extraction requests in flight at once",
+    )
+
+    parser.add_argument(
+        "--doc-type",
+        choices=["auto", *DOC_TYPES],
+        default="auto",
+        help="Extraction to use; auto routes every file by its path (FDA, Synthetic_Procedures) or first bytes, writing one output per type",
+    )
+
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Worker processes, each with its own event loop and --concurrency requests in flight; the rate limits are shared",
+    )
+
+    parser.add_argument(
+        "--read-workers",
+        type=int,
+        default=8,
+        help="Threads reading markdown files ahead of the API calls",
+    )
+
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=4000,
+        help="Request rate limit for the Gemini API (0: unlimited)",
+    )
+
+    parser.add_argument(
+        "--tokens-per-minute",
+        type=float,
+        default=4_000_000,
+        help="Input token rate limit for the Gemini API, estimated at 4 characters per token (0: unlimited)",
+    )
+
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="Retries per file for rate limit, server and network errors",
+    )
+
+    parser.add_argument(
+        "--fsync-every",
+        type=int,
+        default=100,
+        help="fsync the output file after this many records (0: only at the end)",
+    )
+
+    parser.add_argument(
+        "--max-prompt-tokens",
+        type=int,
+        default=16000,
+        help="Longer documents are reduced to their head and relevant sections, or extracted in parts and merged (0: always send the full document)",
+    )
+
+    parser.add_argument(
+        "--pack-size",
+        type=int,
+        default=1,
+        help="Pack up to this many small documents into one request (1: one request per document)",
+    )
+
+    parser.add_argument(
+        "--pack-max-tokens",
+        type=int,
+        default=8000,
+        help="Token budget of a packed request; documents above half of it are sent alone",
+    )
+
+    parser.add_argument(
+        "--api-base-url",
+        type=str,
+        default=None,
+        help="Override the Gemini API endpoint, e.g. a local stub server for testing",
+    )
+
+    parser.add_argument(
+        "--cache-file",
+        type=Path,
+        default=Path("extraction_cache.sqlite"),
+        help="SQLite cache of results keyed by document content, model, prompt and schema; reruns only send new or edited files",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Neither read nor write the result cache",
+    )
+
+    parser.add_argument(
+        "--no-pre-extract",
+        action="store_true",
+        default=False,
+        help="Send every field to the model instead of filling header fields with patterns first (FDA only)",
     )
 
     parser.add_argument(
@@ -363,6 +1702,13 @@ def parse_args():
         help="Exclude files ending with _REVIEW.md",
     )
 
+    parser.add_argument(
+        "--dedup-map",
+        type=Path,
+        default=None,
+        help="Canonical-id map from dedup_markdown.py; non-canonical duplicates are skipped",
+    )
+
     return parser.parse_args()
 
 
@@ -380,7 +1726,7 @@ async def main():
         sys.exit(1)
 
     # Initialize the Google GenAI client
-    client = genai.Client(api_key=api_key)
+    client_options = {"api_key": api_key, "api_base_url": args.api_base_url}
 
     # Get all FDA markdown files
     if not args.input_dir.exists():
@@ -389,10 +1735,6 @@ async def main():
 
     print(f"Scanning for markdown files in: {args.input_dir}")
 
-    # Detect document type from input directory
-    doc_type = detect_document_type(args.input_dir)
-    print(f"Detected document type: {doc_type.upper()}")
-
     if args.exclude_reviews:
         all_markdown_files = sorted(
             [
@@ -404,14 +1746,17 @@ async def main():
     else:
         all_markdown_files = sorted(list(args.input_dir.rglob("*.md")))
 
-    doc_type_label = (
-        "FDA 510(k)"
-        if doc_type == "fda"
-        else "Lab SOP"
-        if doc_type == "sop"
-        else "Unknown"
-    )
-    print(f"Total {doc_type_label} files found: {len(all_markdown_files)}")
+    if args.dedup_map is not None:
+        duplicates = load_duplicates(args.dedup_map)
+        before = len(all_markdown_files)
+        all_markdown_files = [
+            f for f in all_markdown_files if f.resolve() not in duplicates
+        ]
+        print(
+            f"Skipped {before - len(all_markdown_files)} near-duplicates listed in {args.dedup_map}"
+        )
+
+    print(f"Total markdown files found: {len(all_markdown_files)}")
 
     # Limit the number of files if n_docs is set
     if args.n_docs is not None:
@@ -427,31 +1772,111 @@ async def main():
 
     print(f"Files to process: {len(markdown_files)}")
 
+    # Route each file by its path, or else by its first bytes; a run whose
+    # files all share one type writes a single output as before
+    if args.doc_type == "auto":
+        type_counts = {}
+        for md_file in markdown_files:
+            detected = detect_document_type(md_file)
+            type_counts[detected] = type_counts.get(detected, 0) + 1
+        print(
+            "Detected document types: "
+            + ", ".join(
+                f"{name.upper()} {count}" for name, count in sorted(type_counts.items())
+            )
+        )
+        if "unknown" in type_counts:
+            print("  → Undetected files are extracted as FDA 510(k)")
+        routed = {route_document_type(md_file) for md_file in markdown_files}
+        doc_type = routed.pop() if len(routed) == 1 else "auto"
+    else:
+        doc_type = args.doc_type
+    doc_type_label = (
+        DOC_TYPES[doc_type]["label"]
+        if doc_type in DOC_TYPES
+        else "Mixed (FDA 510(k) and Lab SOP, one output per type)"
+    )
+    print(f"Document type: {doc_type_label}")
+
     # Set output file path
     if args.output_file is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         if doc_type == "sop":
-            output_file = Path(f"lab_sop_extracted_{timestamp}.json")
+            output_file = Path(f"lab_sop_extracted_{timestamp}.jsonl")
+        elif doc_type == "auto":
+            output_file = Path(f"lab_docs_extracted_{timestamp}.jsonl")
         else:
-            output_file = Path(f"fda_510k_extracted_{timestamp}.json")
+            output_file = Path(f"fda_510k_extracted_{timestamp}.jsonl")
     else:
         output_file = args.output_file
 
-    # Process all files
-    results, errors = await process_all_files(
-        markdown_files, args.batch_size, client, output_file, doc_type
-    )
-
-    print(f"\n✓ Results saved to: {output_file}")
+    limits = (args.requests_per_minute or None, args.tokens_per_minute or None)
+    options = {
+        "batch_size": args.batch_size,
+        "doc_type": doc_type,
+        "concurrency": args.concurrency,
+        "max_retries": args.max_retries,
+        "fsync_every": args.fsync_every,
+        "max_prompt_tokens": args.max_prompt_tokens,
+        "pack_size": args.pack_size,
+        "pack_max_tokens": args.pack_max_tokens,
+        "use_pre_extract": not args.no_pre_extract,
+        "read_workers": args.read_workers,
+    }
 
-    # Save list of failed files for retry
-    if errors:
+    # Process all files
+    if args.processes > 1:
+        successes, errors = await process_in_workers(
+            markdown_files,
+            args.processes,
+            output_file,
+            client_options,
+            limits,
+            None if args.no_cache else args.cache_file,
+            **options,
+        )
+    else:
+        cache = None if args.no_cache else ExtractionCache(args.cache_file)
+        successes, errors = await process_all_files(
+            markdown_files,
+            client=make_client(**client_options),
+            output_file=output_file,
+            limiter=RateLimiter(*limits),
+            cache=cache,
+            **options,
+        )
+        if cache is not None:
+            cache.close()
+
+    if doc_type == "auto":
+        for result_type in DOC_TYPES:
+            partition = partition_path_for(output_file, result_type)
+            if partition.exists():
+                print(
+                    f"\n✓ {DOC_TYPES[result_type]['label']} results saved to: {partition}"
+                )
+    else:
+        print(f"\n✓ Results saved to: {output_file}")
+    print(f"✓ Run metadata saved to: {meta_path_for(output_file)}")
+
+    # Save list of failed files for retry; permanent failures are listed
+    # separately, since retrying them would only fail again
+    transient = [error for error in errors if error["transient"]]
+    permanent = [error for error in errors if not error["transient"]]
+    if transient:
         failed_files_output = output_file.with_suffix(".failed.txt")
         with open(failed_files_output, "w") as f:
-            for error in errors:
+            for error in transient:
                 f.write(f"{error['file']}\n")
         print(f"✓ Failed files list saved to: {failed_files_output}")
-        print(f"  → You can retry these {len(errors)} files later")
+        print(f"  → You can retry these {len(transient)} files later")
+    if permanent:
+        permanent_files_output = output_file.with_suffix(".permanent.txt")
+        with open(permanent_files_output, "w") as f:
+            for error in permanent:
+                f.write(f"{error['file']}\t{error['error']}\n")
+        print(f"✓ Permanently failed files saved to: {permanent_files_output}")
+        print(f"  → These {len(permanent)} files need fixing before a retry")
 
     # Print summary statistics
     print("\n" + "=" * 60)
@@ -459,10 +1884,12 @@ async def main():
     print(f"  - Document type: {doc_type_label}")
     print(f"  - Total files available: {len(all_markdown_files)}")
     print(f"  - Files processed: {len(markdown_files)}")
-    print(f"  - Successfully extracted: {len(results)}")
+    print(f"  - Successfully extracted: {successes}")
     print(f"  - Errors encountered: {len(errors)}")
+    print(f"    - Transient (retryable): {len(transient)}")
+    print(f"    - Permanent: {len(permanent)}")
     if markdown_files:
-        print(f"  - Success rate: {len(results) / len(markdown_files) * 100:.1f}%")
+        print(f"  - Success rate: {successes / len(markdown_files) * 100:.1f}%")
     print("=" * 60)
 
 
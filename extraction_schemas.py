@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Extraction Schemas
+
+The Pydantic models of the extracted records and the per-document-type
+settings (prompt, schema, pattern pre-extractor) that extract_structured.py
+sends to Gemini. Kept apart from the extraction script so readers of the
+results (structured_store.py, facet_index.py) do not import the API client.
+"""
+
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from fda_preextract import PRE_EXTRACTOR_VERSION, pre_extract_fda
+
+
+# Define the structured data model for FDA 510(k) documents
+class FDA510k(BaseModel):
+    """Structured Tier 1 data extracted from FDA 510(k) markdown documents"""
+
+    device_trade_name: str = Field(
+        description="Commercial/proprietary name of the device"
+    )
+    product_code: Optional[str] = Field(
+        None, description="3-letter FDA product classification code (e.g., DAP, NTV)"
+    )
+    intended_use: str = Field(
+        description="Official FDA-approved statement of device purpose and clinical application"
+    )
+    analyte_biomarker: Optional[str] = Field(
+        None,
+        description="Molecule or substance being measured (e.g., D-Dimer, Myeloperoxidase, Hemoglobin)",
+    )
+    medical_specialty: Optional[str] = Field(
+        None,
+        description="FDA review panel/medical domain (e.g., Hematology, Immunology, Clinical Chemistry)",
+    )
+    manufacturer_name: str = Field(description="Company name submitting the 510(k)")
+    fda_decision_date: Optional[str] = Field(
+        None,
+        description="Date FDA granted substantial equivalence in mm-dd-yyyy format (e.g., 03-10-2005, 12-23-2005)",
+    )
+
+
+# Define the structured data model for Lab SOP documents
+class LabSOP(BaseModel):
+    """Structured data extracted from Laboratory Standard Operating Procedure documents"""
+
+    procedure_name: str = Field(
+        description="Official name of the laboratory procedure/test"
+    )
+    specimen_type: str = Field(
+        description="Type of biological sample required (e.g., Serum, Plasma, Whole Blood, Urine, CSF)"
+    )
+    analyte_biomarker: Optional[str] = Field(
+        None,
+        description="Molecule or substance being measured (e.g., D-Dimer, Glucose, Hemoglobin)",
+    )
+    medical_specialty: Optional[str] = Field(
+        None,
+        description="Clinical domain or specialty (e.g., Hematology, Clinical Chemistry, Immunology)",
+    )
+    purpose: str = Field(
+        description="Clinical purpose, indications, and diagnostic applications of the test"
+    )
+    equipment: list[str] = Field(
+        default_factory=list,
+        description="List of instruments, analyzers, and devices used in the procedure",
+    )
+    reagents: list[str] = Field(
+        default_factory=list,
+        description="List of reagents, kits, consumables, and materials required",
+    )
+    quality_control: Optional[str] = Field(
+        None,
+        description="Quality control requirements, acceptance criteria, and QC protocols",
+    )
+    interpretation_guidelines: Optional[str] = Field(
+        None,
+        description="Guidelines for interpreting test results, reference ranges, and clinical significance",
+    )
+
+
+FDA_PROMPT = "Extract the structured information from this FDA 510(k) document. Focus on: device trade name, product code, intended use, analyte/biomarker, medical specialty, manufacturer name, and FDA decision date (convert to mm-dd-yyyy format, e.g., 03-10-2005 for March 10, 2005):\n\n{content}"
+
+SOP_PROMPT = "Extract the structured information from this Laboratory Standard Operating Procedure (SOP) document. Focus on: procedure name, specimen type, analyte/biomarker being measured, medical specialty, clinical purpose, equipment/instruments used, reagents/kits required, quality control requirements, and interpretation guidelines:\n\n{content}"
+
+# Everything that determines an extraction: a change to any of these
+# invalidates the cached results for that document type
+DOC_TYPES = {
+    "fda": {
+        "label": "FDA 510(k)",
+        "prompt": FDA_PROMPT,
+        "schema": FDA510k,
+        "pre_extract": pre_extract_fda,
+        "pre_extract_version": PRE_EXTRACTOR_VERSION,
+    },
+    "sop": {"label": "Lab SOP", "prompt": SOP_PROMPT, "schema": LabSOP},
+}
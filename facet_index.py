@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+"""
+Facet Index Script
+
+Builds an inverted index over the facet fields of the structured store
+(structured_store.py), so filter counts for the frontend (medical specialty,
+analyte, manufacturer, specimen type, ...) come from posting intersections
+instead of scans over the extracted records.
+
+Values are normalised before indexing, so spellings of one value share a
+posting list and are shown under their most common spelling:
+- Case, punctuation and whitespace are folded ("Clinical  Chemistry.")
+- Per-field word aliases expand abbreviations ("clinical chem." ->
+  clinical chemistry, "haematology" -> hematology)
+- Manufacturer names lose legal suffixes ("Abbott Laboratories, Inc.")
+- Specimen types are split into their parts ("Serum or plasma")
+- --aliases adds project-specific mappings ({"field": {"raw": "canonical"}})
+
+Posting lists are stored like roaring bitmaps: document ids are split into
+chunks of 2^16 ids and each chunk is a sorted uint16 array when it holds at
+most 4096 ids, else a 65536-bit bitmap. Bitmaps are intersected and counted
+as Python integers (AND, bit_count), arrays by set membership, so work is
+proportional to the compressed postings. Top-N counts visit values by
+descending cardinality and stop once no remaining value can enter the top.
+
+The index file is memory-mapped; posting lists are decoded on first use:
+
+    index = FacetIndex(Path("ExtractedStore/facets.idx"))
+    index.counts(["analyte_biomarker", "manufacturer_name"],
+                 {"medical_specialty": "Hematology", "doc_type": "fda"})
+"""
+
+import argparse
+import heapq
+import json
+import mmap
+import re
+import struct
+import sys
+import time
+from array import array
+from pathlib import Path
+
+from structured_store import StructuredStore
+
+FACET_FIELDS = [
+    "doc_type",
+    "medical_specialty",
+    "analyte_biomarker",
+    "manufacturer_name",
+    "specimen_type",
+    "product_code",
+]
+
+MAGIC = b"FACETIX1"
+HEADER_STRUCT = struct.Struct("<8sQ")
+# Per container: high 16 bits of its ids, kind, cardinality
+CONTAINER_STRUCT = struct.Struct("<HBxI")
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+# Above this many ids a bitmap (8 KiB) is smaller than a uint16 array
+ARRAY_MAX = 4096
+ARRAY_KIND, BITMAP_KIND = 0, 1
+BITMAP_BYTES = CHUNK_SIZE // 8
+
+WORD_ALIASES = {
+    "medical_specialty": {
+        "chem": "chemistry",
+        "haematology": "hematology",
+        "heme": "hematology",
+        "immuno": "immunology",
+        "micro": "microbiology",
+        "tox": "toxicology",
+    },
+    "specimen_type": {
+        "sera": "serum",
+        "csf": "cerebrospinal fluid",
+        "wb": "whole blood",
+    },
+}
+PHRASE_ALIASES = {
+    "medical_specialty": {"chemistry": "clinical chemistry"},
+}
+MANUFACTURER_SUFFIXES = {
+    "ag",
+    "co",
+    "company",
+    "corp",
+    "corporation",
+    "gmbh",
+    "inc",
+    "incorporated",
+    "limited",
+    "llc",
+    "ltd",
+    "plc",
+    "sa",
+}
+SPECIMEN_SEPARATOR_PATTERN = re.compile(r"\s*(?:[,;/]|\band\b|\bor\b)\s*", re.I)
+
+
+def normalise_value(field: str, value: str, aliases: dict | None = None) -> str:
+    """Key under which a field value is indexed and looked up"""
+    words = re.sub(r"[^\w\s]", " ", value.casefold()).split()
+    if field == "manufacturer_name":
+        while len(words) > 1 and words[-1] in MANUFACTURER_SUFFIXES:
+            words.pop()
+    word_aliases = WORD_ALIASES.get(field, {})
+    key = " ".join(word_aliases.get(word, word) for word in words)
+    key = PHRASE_ALIASES.get(field, {}).get(key, key)
+    return (aliases or {}).get(field, {}).get(key, key)
+
+
+def split_value(field: str, value) -> list[str]:
+    """The separate values of one record's field"""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [item for item in value if item]
+    if field == "specimen_type":
+        return [part for part in SPECIMEN_SEPARATOR_PATTERN.split(value) if part]
+    return [value] if value.strip() else []
+
+
+def load_aliases(alias_file: Path | None) -> dict:
+    """--aliases mappings with both sides normalised like indexed values"""
+    if alias_file is None:
+        return {}
+    raw = json.loads(alias_file.read_text(encoding="utf-8"))
+    return {
+        field: {
+            normalise_value(field, source): normalise_value(field, target)
+            for source, target in mapping.items()
+        }
+        for field, mapping in raw.items()
+    }
+
+
+def array_to_bitmap(ids: array) -> int:
+    bits = bytearray(BITMAP_BYTES)
+    for low in ids:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, "little")
+
+
+def bitmap_to_array(bitmap: int) -> array:
+    bits = format(bitmap, f"0{CHUNK_SIZE}b")[::-1]
+    return array("H", [low for low, bit in enumerate(bits) if bit == "1"])
+
+
+def container_length(container: array | int) -> int:
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+def compact(container: array | int) -> array | int | None:
+    """Container in its smaller representation, None if empty"""
+    if isinstance(container, int):
+        if container == 0:
+            return None
+        if container.bit_count() <= ARRAY_MAX:
+            return bitmap_to_array(container)
+        return container
+    if not container:
+        return None
+    if len(container) > ARRAY_MAX:
+        return array_to_bitmap(container)
+    return container
+
+
+class Postings:
+    """Sorted document ids in chunks of 2^16, each an array or a bitmap"""
+
+    __slots__ = ("containers",)
+
+    def __init__(self, containers: dict[int, array | int] | None = None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_ids(cls, ids: list[int]) -> "Postings":
+        """Postings of ascending document ids"""
+        chunks = {}
+        for doc_id in ids:
+            chunks.setdefault(doc_id >> CHUNK_BITS, array("H")).append(
+                doc_id & (CHUNK_SIZE - 1)
+            )
+        return cls({high: compact(lows) for high, lows in chunks.items()})
+
+    def __len__(self) -> int:
+        return sum(map(container_length, self.containers.values()))
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            if isinstance(container, int):
+                container = bitmap_to_array(container)
+            base = high << CHUNK_BITS
+            for low in container:
+                yield base + low
+
+    def __and__(self, other: "Postings") -> "Postings":
+        result = {}
+        for high in self.containers.keys() & other.containers.keys():
+            a, b = self.containers[high], other.containers[high]
+            if isinstance(a, int) and isinstance(b, int):
+                container = compact(a & b)
+            elif isinstance(a, int) or isinstance(b, int):
+                ids, bitmap = (b, a) if isinstance(a, int) else (a, b)
+                container = compact(
+                    array("H", [low for low in ids if bitmap >> low & 1])
+                    if len(ids) < 64
+                    else array("H", sorted(set(ids) & set(bitmap_to_array(bitmap))))
+                )
+            else:
+                container = compact(array("H", sorted(set(a) & set(b))))
+            if container is not None:
+                result[high] = container
+        return Postings(result)
+
+    def __or__(self, other: "Postings") -> "Postings":
+        result = dict(self.containers)
+        for high, b in other.containers.items():
+            a = result.get(high)
+            if a is None:
+                result[high] = b
+            elif isinstance(a, int) or isinstance(b, int):
+                a = a if isinstance(a, int) else array_to_bitmap(a)
+                b = b if isinstance(b, int) else array_to_bitmap(b)
+                result[high] = compact(a | b)
+            else:
+                result[high] = compact(array("H", sorted(set(a) | set(b))))
+        return Postings(result)
+
+
+class Selection:
+    """A Postings prepared for counting many posting lists against it"""
+
+    def __init__(self, postings: Postings):
+        self.bitmaps = {
+            high: container
+            if isinstance(container, int)
+            else array_to_bitmap(container)
+            for high, container in postings.containers.items()
+        }
+        self._sets = {
+            high: set(container)
+            for high, container in postings.containers.items()
+            if not isinstance(container, int)
+        }
+
+    def _set(self, high: int) -> set[int]:
+        if high not in self._sets:
+            self._sets[high] = set(bitmap_to_array(self.bitmaps[high]))
+        return self._sets[high]
+
+    def count(self, postings: Postings) -> int:
+        """Size of the intersection with a posting list"""
+        total = 0
+        for high, container in postings.containers.items():
+            bitmap = self.bitmaps.get(high)
+            if bitmap is None:
+                continue
+            if isinstance(container, int):
+                total += (container & bitmap).bit_count()
+            else:
+                # Set membership runs in C, unlike per-id bit tests
+                total += len(self._set(high).intersection(container))
+        return total
+
+
+def build_index(store: StructuredStore, aliases: dict) -> tuple[list, dict]:
+    """Documents and, per facet field, {key: (label, ascending doc ids)}
+
+    Labels are the most common original spelling of each normalised key.
+    """
+    documents = []
+    postings = {field: {} for field in FACET_FIELDS}
+    spellings = {field: {} for field in FACET_FIELDS}
+    for doc_type in store.doc_types():
+        # The dataset schema comes from Parquet footers, no rows are read
+        names = store.dataset(doc_type).schema.names
+        fields = [field for field in FACET_FIELDS if field in names]
+        table = store.query(doc_type, columns=["file", *fields]).sort_by("file")
+        for row in table.to_pylist():
+            doc_id = len(documents)
+            documents.append(f"{doc_type}/{row['file']}")
+            row["doc_type"] = doc_type
+            for field in ["doc_type", *fields]:
+                keys = set()
+                for value in split_value(field, row.get(field)):
+                    value = value.strip()
+                    key = normalise_value(field, value, aliases)
+                    if not key or key in keys:
+                        continue
+                    keys.add(key)
+                    postings[field].setdefault(key, []).append(doc_id)
+                    counts = spellings[field].setdefault(key, {})
+                    counts[value] = counts.get(value, 0) + 1
+
+    values = {}
+    for field in FACET_FIELDS:
+        values[field] = {
+            key: (max(spellings[field][key].items(), key=lambda kv: kv[1])[0], ids)
+            for key, ids in postings[field].items()
+        }
+    return documents, values
+
+
+def write_index(
+    index_file: Path, documents: list[str], values: dict, aliases: dict
+) -> int:
+    """Write the index file (header, JSON directory, documents, postings)
+
+    The file is written under a temporary name and renamed, so readers that
+    map the old index keep a consistent view. Returns the file size.
+    """
+    data = bytearray()
+    directory = {}
+    for field, field_values in values.items():
+        entries = []
+        for key, (label, ids) in sorted(
+            field_values.items(), key=lambda kv: (-len(kv[1][1]), kv[0])
+        ):
+            postings = Postings.from_ids(ids)
+            entries.append([key, label, len(ids), len(data), len(postings.containers)])
+            for high in sorted(postings.containers):
+                container = postings.containers[high]
+                kind = BITMAP_KIND if isinstance(container, int) else ARRAY_KIND
+                data += CONTAINER_STRUCT.pack(high, kind, container_length(container))
+            for high in sorted(postings.containers):
+                container = postings.containers[high]
+                if isinstance(container, int):
+                    data += container.to_bytes(BITMAP_BYTES, "little")
+                else:
+                    if sys.byteorder == "big":
+                        container = array("H", container)
+                        container.byteswap()
+                    data += container.tobytes()
+        directory[field] = entries
+
+    documents_blob = "\n".join(documents).encode("utf-8")
+    header = json.dumps(
+        {
+            "documents": len(documents),
+            "documents_bytes": len(documents_blob),
+            "aliases": aliases,
+            "fields": directory,
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = index_file.with_name(f".{index_file.name}.tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER_STRUCT.pack(MAGIC, len(header)))
+        f.write(header)
+        f.write(documents_blob)
+        f.write(data)
+    tmp_file.replace(index_file)
+    return index_file.stat().st_size
+
+
+class FacetIndex:
+    """Memory-mapped facet index written by write_index"""
+
+    def __init__(self, index_file: Path):
+        self._file = open(index_file, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = HEADER_STRUCT.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"Not a facet index: {index_file}")
+        header = json.loads(
+            self._map[HEADER_STRUCT.size : HEADER_STRUCT.size + header_length]
+        )
+        self.document_count = header["documents"]
+        self.aliases = header["aliases"]
+        self._documents_offset = HEADER_STRUCT.size + header_length
+        self._data_offset = self._documents_offset + header["documents_bytes"]
+        # field -> key -> (label, cardinality, offset, containers)
+        self.fields = {
+            field: {entry[0]: tuple(entry[1:]) for entry in entries}
+            for field, entries in header["fields"].items()
+        }
+        self._documents = None
+        self._postings = {}
+
+    def close(self):
+        self._postings.clear()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def postings(self, field: str, key: str) -> Postings:
+        """Posting list of a normalised value (empty if it does not occur)"""
+        cached = self._postings.get((field, key))
+        if cached is not None:
+            return cached
+        entry = self.fields[field].get(key)
+        if entry is None:
+            return Postings()
+        _, _, offset, container_count = entry
+        position = self._data_offset + offset
+        headers = []
+        for _ in range(container_count):
+            headers.append(CONTAINER_STRUCT.unpack_from(self._map, position))
+            position += CONTAINER_STRUCT.size
+        containers = {}
+        for high, kind, cardinality in headers:
+            if kind == BITMAP_KIND:
+                end = position + BITMAP_BYTES
+                containers[high] = int.from_bytes(self._map[position:end], "little")
+            else:
+                end = position + 2 * cardinality
+                container = array("H", self._map[position:end])
+                if sys.byteorder == "big":
+                    container.byteswap()
+                containers[high] = container
+            position = end
+        postings = self._postings[(field, key)] = Postings(containers)
+        return postings
+
+    def select(self, filters: dict) -> Postings | None:
+        """Documents matching every field's filter (None: no filters, all)
+
+        A filter is a value or a list of values, any of which may match.
+        """
+        matches = []
+        for field, wanted in filters.items():
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            field_postings = Postings()
+            for value in wanted:
+                field_postings |= self.postings(
+                    field, normalise_value(field, value, self.aliases)
+                )
+            matches.append(field_postings)
+        if not matches:
+            return None
+        matches.sort(key=len)
+        result = matches[0]
+        for postings in matches[1:]:
+            if not result.containers:
+                break
+            result &= postings
+        return result
+
+    def counts(
+        self, fields: list[str], filters: dict | None = None, top: int | None = None
+    ) -> dict[str, dict[str, int]]:
+        """Document counts per value of each field, most common first
+
+        Counts of a field ignore the filter on that field itself, so the
+        other values of a selected facet keep their counts (multi-select).
+        With `top`, values are visited by descending cardinality and counting
+        stops once no remaining value can enter the top: a long tail of rare
+        values is never intersected.
+        """
+        filters = filters or {}
+        selections = {}
+        result = {}
+        for field in fields:
+            others = tuple(sorted(name for name in filters if name != field))
+            if others not in selections:
+                selected = self.select({name: filters[name] for name in others})
+                selections[others] = None if selected is None else Selection(selected)
+            selection = selections[others]
+
+            counts = {}
+            best = []
+            # Entries are stored by descending cardinality, an upper bound of
+            # every count
+            for key, (label, cardinality, _, _) in self.fields.get(field, {}).items():
+                if top and len(best) == top and cardinality < best[0]:
+                    break
+                if selection is None:
+                    count = cardinality
+                else:
+                    count = selection.count(self.postings(field, key))
+                if not count:
+                    continue
+                counts[label] = count
+                if top:
+                    if len(best) < top:
+                        heapq.heappush(best, count)
+                    elif count > best[0]:
+                        heapq.heapreplace(best, count)
+            ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+            result[field] = dict(ranked[:top] if top else ranked)
+        return result
+
+    def documents(self, postings: Postings) -> list[str]:
+        """Paths ("<doc_type>/<file>") of the documents in a posting list"""
+        if self._documents is None:
+            start = self._documents_offset
+            blob = self._map[start : self._data_offset]
+            self._documents = blob.decode("utf-8").split("\n") if blob else []
+        return [self._documents[doc_id] for doc_id in postings]
+
+
+def parse_filter(text: str) -> tuple[str, str]:
+    """FIELD=VALUE from the command line"""
+    field, separator, value = text.partition("=")
+    if not separator or field not in FACET_FIELDS:
+        raise argparse.ArgumentTypeError(
+            f"expected FIELD=VALUE with FIELD one of {', '.join(FACET_FIELDS)}"
+        )
+    return field, value
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Build the facet index of a structured store and print facet counts",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--store-dir",
+        type=Path,
+        default=Path("ExtractedStore/"),
+        help="Parquet store written by structured_store.py",
+    )
+
+    parser.add_argument(
+        "--index-file",
+        type=Path,
+        default=Path("ExtractedStore/facets.idx"),
+        help="Facet index to write and query",
+    )
+
+    parser.add_argument(
+        "--aliases",
+        type=Path,
+        default=None,
+        help='JSON file of extra value aliases per field: {"field": {"raw": "canonical"}}',
+    )
+
+    parser.add_argument(
+        "--skip-build",
+        action="store_true",
+        default=False,
+        help="Query the existing index instead of rebuilding it from the store",
+    )
+
+    parser.add_argument(
+        "--filter",
+        type=parse_filter,
+        action="append",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="Restrict the printed counts; repeat a field to accept any of several values",
+    )
+
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of values printed per facet",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point for the script"""
+    args = parse_args()
+
+    if not args.skip_build:
+        if not args.store_dir.exists():
+            print(f"Error: Store directory does not exist: {args.store_dir}")
+            sys.exit(1)
+        print(f"Indexing facets of: {args.store_dir}")
+        start = time.perf_counter()
+        aliases = load_aliases(args.aliases)
+        documents, values = build_index(StructuredStore(args.store_dir), aliases)
+        size = write_index(args.index_file, documents, values, aliases)
+        print(
+            f"Indexed {len(documents)} documents in {time.perf_counter() - start:.1f}s "
+            f"({size / 1024:.0f} KiB)"
+        )
+    elif not args.index_file.exists():
+        print(f"Error: Index file does not exist: {args.index_file}")
+        sys.exit(1)
+
+    filters = {}
+    for field, value in args.filter:
+        filters.setdefault(field, []).append(value)
+
+    with FacetIndex(args.index_file) as index:
+        start = time.perf_counter()
+        counts = index.counts(FACET_FIELDS, filters, top=args.top)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        index.counts(FACET_FIELDS, filters, top=args.top)
+        warm = time.perf_counter() - start
+        matching = index.select(filters)
+
+        print(f"\n{'=' * 60}")
+        print("✓ Facet counts")
+        print(f"  Documents indexed: {index.document_count}")
+        print(
+            f"  Matching filters: {index.document_count if matching is None else len(matching)}"
+        )
+        print(f"  Count time: {cold * 1000:.2f} ms cold, {warm * 1000:.2f} ms warm")
+        for field, values in counts.items():
+            for_field = index.fields.get(field, {})
+            top = ", ".join(f"{label} ({count})" for label, count in values.items())
+            print(f"  {field} ({len(for_field)} values): {top or '-'}")
+
+
+if __name__ == "__main__":
+    main()
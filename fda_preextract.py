@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+FDA 510(k) Field Pre-Extraction Script
+
+Fills the fixed-format header fields of FDA 510(k) summaries and decision
+summaries with compiled patterns, so extract_structured.py only asks Gemini
+for the fields that could not be filled here (and skips the call entirely
+for fully resolved documents).
+
+Fields and the header lines they are read from:
+- product_code: "Product Code: DAP" (first of several codes)
+- fda_decision_date: "Decision Date: ...", "Date of Decision: ...",
+  normalised to mm-dd-yyyy
+- manufacturer_name: "Applicant: ...", "Manufacturer: ...", "Submitter: ..."
+- device_trade_name: "Proprietary Name: ...", "Trade Name: ...", "Device Name: ..."
+- analyte_biomarker: "Measurand: ..."
+- medical_specialty: "Panel: Hematology (81)" / "Review Panel: ..."
+- intended_use: the paragraph after an "Intended Use" / "Indications for Use" label
+
+A value is only returned when it looks well-formed (e.g. a product code is
+exactly three capital letters, a date parses); anything doubtful is left to
+the model. Run as a script to report field coverage over a markdown tree.
+"""
+
+import argparse
+import re
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Part of extract_structured.py's cache key: bump when a pattern changes what
+# is extracted, so cached results are recomputed
+PRE_EXTRACTOR_VERSION = "2"
+
+# Only the head of a summary holds the header block; bounding the scan keeps
+# extraction sub-millisecond even for very long documents
+SCAN_CHARS = 20000
+
+# Markdown and enumeration noise in front of labels: "## ", "**", "- ",
+# "1. ", "B. ", "| "
+LINE_PREFIX_PATTERN = re.compile(
+    r"^[\s>#*_|\-]*(?:[A-Z0-9]{1,2}[.)]\s+)?", re.MULTILINE
+)
+EMPHASIS_PATTERN = re.compile(r"\*\*|__|`")
+
+# Values must be on the label's line: a label left empty is often followed by
+# the next label, which would otherwise be captured as its value
+LABEL_END = r"[ \t]*(?:\([^)\n]{0,20}\))?[ \t]*[:\-–][ \t]*"
+
+# A captured value that is itself a label ("Type of Test:")
+LABEL_VALUE_PATTERN = re.compile(r"^[A-Z][\w ()/]+:$")
+
+# Trailing periods that belong to the value ("Inc.", "S.A.")
+ABBREVIATION_END_PATTERN = re.compile(
+    r"\b(?:Inc|Ltd|Co|Corp|Intl|L\.L\.C|S\.A|S\.p\.A|N\.V|B\.V|A\.G)\.$", re.IGNORECASE
+)
+
+
+def _label_pattern(labels: str) -> re.Pattern:
+    """Pattern for `<label>: <value to end of line>` at the start of a line"""
+    return re.compile(rf"^(?i:{labels}){LABEL_END}(.+?)[ \t]*$", re.MULTILINE)
+
+
+PRODUCT_CODE_PATTERN = re.compile(
+    rf"^(?i:(?:classification\s+)?product\s+codes?){LABEL_END}([A-Z]{{3}})\b",
+    re.MULTILINE,
+)
+DECISION_DATE_PATTERN = _label_pattern(
+    r"decision\s+date|date\s+of\s+decision|date\s+of\s+substantial\s+equivalence"
+)
+MANUFACTURER_PATTERN = _label_pattern(
+    r"applicant(?:\s+name)?|manufacturer(?:\s+name)?|510\(k\)\s+submitter|submitter(?:\s+name)?|sponsor"
+)
+TRADE_NAME_PATTERN = _label_pattern(
+    r"proprietary\s+and\s+established\s+names?|proprietary\s+names?|device\s+trade\s+names?|trade\s+names?|device\s+names?"
+)
+MEASURAND_PATTERN = _label_pattern(r"measurands?|analytes?")
+PANEL_PATTERN = _label_pattern(r"(?:review\s+|classification\s+)?panel")
+INTENDED_USE_LABEL = r"(?i:intended\s+use(?:\(s\)|s)?|indications?\s+for\s+use(?:\(s\)|s)?)(?:[ \t]*(?:and|/)[ \t]*(?i:indications?\s+for\s+use|intended\s+use))?"
+INTENDED_USE_PATTERN = re.compile(
+    rf"^{INTENDED_USE_LABEL}[ \t]*[:\-–]?[ \t]*(.*)$", re.MULTILINE
+)
+# Decision summaries nest "1. Intended use(s):" under "H. Intended Use:"
+INTENDED_USE_SUB_LABEL_PATTERN = re.compile(
+    rf"^(?:[0-9]{{1,2}}[.)]\s+)?{INTENDED_USE_LABEL}\s*[:\-–]\s*"
+)
+
+DATE_FORMATS = [
+    "%B %d, %Y",
+    "%B %d %Y",
+    "%b %d, %Y",
+    "%b %d %Y",
+    "%b. %d, %Y",
+    "%d %B %Y",
+    "%m/%d/%Y",
+    "%m-%d-%Y",
+    "%Y-%m-%d",
+    "%m/%d/%y",
+]
+DATE_PATTERN = re.compile(
+    r"[A-Z][a-z]{2,8}\.?\s+\d{1,2},?\s+\d{4}|\d{1,2}\s+[A-Z][a-z]{2,8}\s+\d{4}|\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}-\d{2}-\d{2}"
+)
+
+# Values that are labels or placeholders rather than data
+PLACEHOLDER_VALUES = {"", "n/a", "na", "none", "not applicable", "see below", "tbd"}
+
+MIN_INTENDED_USE_CHARS = 40
+MAX_VALUE_CHARS = 200
+
+
+def normalise(md_text: str) -> str:
+    """Strip markdown emphasis and line prefixes so labels start their lines"""
+    text = EMPHASIS_PATTERN.sub("", md_text[:SCAN_CHARS])
+    return LINE_PREFIX_PATTERN.sub("", text)
+
+
+def clean_value(value: str) -> str | None:
+    """Trim a captured value; None if it is a placeholder, a label or implausibly long"""
+    value = value.strip().strip("|").strip(" ;,")
+    if value.endswith(".") and not ABBREVIATION_END_PATTERN.search(value):
+        value = value.rstrip(" .")
+    if (
+        value.lower() in PLACEHOLDER_VALUES
+        or LABEL_VALUE_PATTERN.match(value)
+        or len(value) > MAX_VALUE_CHARS
+    ):
+        return None
+    return value
+
+
+def normalise_date(value: str) -> str | None:
+    """Parse a date in any common format into mm-dd-yyyy"""
+    match = DATE_PATTERN.search(value)
+    if match is None:
+        return None
+    candidate = re.sub(r"\s+", " ", match.group(0))
+    for date_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(candidate, date_format)
+        except ValueError:
+            continue
+        if 1976 <= parsed.year <= datetime.now().year:
+            return parsed.strftime("%m-%d-%Y")
+    return None
+
+
+def first_match(pattern: re.Pattern, text: str) -> str | None:
+    for match in pattern.finditer(text):
+        value = clean_value(match.group(1))
+        if value is not None:
+            return value
+    return None
+
+
+def intended_use(text: str) -> str | None:
+    """The text after an Intended Use label, up to the next blank line or label"""
+    for match in INTENDED_USE_PATTERN.finditer(text):
+        lines = [match.group(1).strip()]
+        for line in text[match.end() :].split("\n")[1:]:
+            line = line.strip()
+            if not line:
+                if "".join(lines):
+                    break
+                continue
+            if re.match(r"^[A-Z][A-Za-z ()/]{2,40}:", line):
+                if "".join(lines):
+                    # Next "Label:" line starts another field
+                    break
+                # Nested sub-label ("1. Intended use(s):") before the paragraph
+                line = line.split(":", 1)[1].strip()
+            lines.append(line)
+        value = " ".join(part for part in lines if part)
+        while match := INTENDED_USE_SUB_LABEL_PATTERN.match(value):
+            value = value[match.end() :]
+        if len(value) >= MIN_INTENDED_USE_CHARS:
+            return value[:2000]
+    return None
+
+
+def pre_extract_fda(md_text: str) -> dict:
+    """Fields of FDA510k that could be filled confidently from header lines"""
+    text = normalise(md_text)
+    fields = {}
+
+    match = PRODUCT_CODE_PATTERN.search(text)
+    if match:
+        fields["product_code"] = match.group(1)
+
+    for match in DECISION_DATE_PATTERN.finditer(text):
+        date = normalise_date(match.group(1))
+        if date is not None:
+            fields["fda_decision_date"] = date
+            break
+
+    for name, pattern in (
+        ("manufacturer_name", MANUFACTURER_PATTERN),
+        ("device_trade_name", TRADE_NAME_PATTERN),
+        ("analyte_biomarker", MEASURAND_PATTERN),
+    ):
+        value = first_match(pattern, text)
+        if value is not None:
+            fields[name] = value
+
+    panel = first_match(PANEL_PATTERN, text)
+    if panel is not None:
+        # "Hematology (81)" -> "Hematology"
+        specialty = re.sub(r"\s*\(?\d+\)?$", "", panel).strip()
+        if specialty:
+            fields["medical_specialty"] = specialty
+
+    use = intended_use(text)
+    if use is not None:
+        fields["intended_use"] = use
+
+    return fields
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Report how many FDA 510(k) fields the pattern pre-extractor fills",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--input-dir",
+        type=Path,
+        default=Path("MarkdownOutput/FDA/"),
+        help="Directory searched recursively for markdown files",
+    )
+
+    parser.add_argument(
+        "--show",
+        type=int,
+        default=0,
+        help="Print the extracted fields of the first N files",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point for the script"""
+    args = parse_args()
+
+    if not args.input_dir.exists():
+        print(f"Error: Input directory does not exist: {args.input_dir}")
+        sys.exit(1)
+
+    # Imported here so the pre-extractor itself has no third-party dependencies
+    from extraction_schemas import FDA510k
+
+    field_names = list(FDA510k.model_fields)
+    coverage = dict.fromkeys(field_names, 0)
+    resolved = 0
+    total = 0
+    for md_file in sorted(args.input_dir.rglob("*.md")):
+        if md_file.name.endswith("_REVIEW.md"):
+            continue
+        fields = pre_extract_fda(md_file.read_text(encoding="utf-8"))
+        total += 1
+        for name in fields:
+            coverage[name] += 1
+        if len(fields) == len(field_names):
+            resolved += 1
+        if total <= args.show:
+            print(f"{md_file.name}: {fields}")
+
+    print(f"\n{'=' * 60}")
+    print(f"Pre-extraction coverage over {total} files:")
+    for name in field_names:
+        print(
+            f"  {name:<20} {coverage[name]:7d} ({coverage[name] / max(1, total):.0%})"
+        )
+    print(
+        f"  Fully resolved (no API call needed): {resolved} ({resolved / max(1, total):.0%})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Markdown to Vespa Feed Script
+
+Turns converted markdown files into Vespa `put` operations for the `doc` schema
+(rag-blueprint/app/schemas/doc.sd), in the same format as
+rag-blueprint/dataset/docs.jsonl. Operations are streamed into gzip-compressed
+JSONL shards that can be fed with `vespa feed`.
+
+Fields written per document:
+- id: Path of the markdown file relative to the input directory, without suffix
+- title: First markdown heading, or the file name if there is none
+- text: Full markdown content (Vespa chunks it at feed time)
+- created_timestamp / modified_timestamp: From the source PDF's metadata when
+  --source-dir is given (as pdf2markdown.py does), else from the markdown file
+
+With --dedup-map (from dedup_markdown.py) only the canonical document of each
+near-duplicate cluster is fed.
+
+pdf2markdown.py can write the same operations during conversion (--feed-dir),
+so a fresh ingest needs only one pass over the documents.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+from dedup_markdown import load_duplicates
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+
+
+def doc_id_for(relative_md_path: str) -> str:
+    """Document id shared by every stage: the relative markdown path without suffix"""
+    return relative_md_path.removesuffix(".md")
+
+
+def markdown_title(md_text: str, fallback: str) -> str:
+    """First markdown heading with emphasis markers stripped, else the fallback"""
+    match = HEADING_PATTERN.search(md_text)
+    if match:
+        title = match.group(1).replace("**", "").replace("__", "").strip()
+        if title:
+            return title
+    return fallback
+
+
+def file_timestamps(source_stat: os.stat_result) -> tuple[int, int]:
+    """Created and modified times (epoch seconds) from file metadata
+
+    Birth time is only reported on some platforms; elsewhere the earlier of
+    ctime and mtime is the best available approximation.
+    """
+    created = getattr(
+        source_stat,
+        "st_birthtime",
+        min(source_stat.st_ctime, source_stat.st_mtime),
+    )
+    return int(created), int(source_stat.st_mtime)
+
+
+def build_put(relative_md_path: str, md_text: str, source_stat: os.stat_result) -> dict:
+    """Build a Vespa put operation for one markdown document"""
+    doc_id = doc_id_for(relative_md_path)
+    created, modified = file_timestamps(source_stat)
+    return {
+        "put": f"id:doc:doc::{doc_id}",
+        "fields": {
+            "id": doc_id,
+            "title": markdown_title(md_text, Path(relative_md_path).name),
+            "text": md_text,
+            "created_timestamp": created,
+            "modified_timestamp": modified,
+        },
+    }
+
+
+class FeedWriter:
+    """Writes put operations to rotating gzip-compressed JSONL shards
+
+    Each shard is written under a temporary name and renamed when it is full
+    or the writer is closed, so a feed client never picks up a partial file.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        docs_per_shard: int = 10000,
+        prefix: str = "feed",
+        compresslevel: int = 6,
+    ):
+        self.output_dir = output_dir
+        self.docs_per_shard = docs_per_shard
+        self.prefix = prefix
+        self.compresslevel = compresslevel
+        self.shards_written = []
+        self.docs_written = 0
+
+        self._shard_index = 0
+        self._shard_docs = 0
+        self._file = None
+        self._tmp_path = None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _shard_path(self, index: int) -> Path:
+        return self.output_dir / f"{self.prefix}-{index:05d}.jsonl.gz"
+
+    def _open_shard(self):
+        # Never overwrite shards from an earlier run with the same prefix
+        while self._shard_path(self._shard_index).exists():
+            self._shard_index += 1
+        final_path = self._shard_path(self._shard_index)
+        self._tmp_path = final_path.with_name(f".{final_path.name}.tmp")
+        self._file = gzip.open(
+            self._tmp_path, "wt", encoding="utf-8", compresslevel=self.compresslevel
+        )
+        self._shard_docs = 0
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+        self._file.close()
+        final_path = self._shard_path(self._shard_index)
+        os.replace(self._tmp_path, final_path)
+        self.shards_written.append(final_path)
+        self._file = None
+        self._shard_index += 1
+
+    def write(self, operation: dict):
+        if self._file is None:
+            self._open_shard()
+        self._file.write(json.dumps(operation, ensure_ascii=False) + "\n")
+        self._shard_docs += 1
+        self.docs_written += 1
+        if self._shard_docs >= self.docs_per_shard:
+            self._close_shard()
+
+    def close(self):
+        self._close_shard()
+
+
+def iter_markdown_files(input_dir: Path, exclude_reviews: bool):
+    """Walk the markdown tree lazily, optionally skipping *_REVIEW.md files"""
+    for md_file in input_dir.rglob("*.md"):
+        if exclude_reviews and md_file.name.endswith("_REVIEW.md"):
+            continue
+        yield md_file
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Convert markdown files into gzip-compressed Vespa feed shards",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--input-dir",
+        type=Path,
+        default=Path("MarkdownOutput/"),
+        help="Directory searched recursively for markdown files",
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=Path("VespaFeed/"),
+        help="Directory receiving feed-NNNNN.jsonl.gz shards",
+    )
+
+    parser.add_argument(
+        "--docs-per-shard",
+        type=int,
+        default=10000,
+        help="Number of documents per feed shard",
+    )
+
+    parser.add_argument(
+        "--exclude-reviews",
+        action="store_true",
+        default=False,
+        help="Exclude files ending with _REVIEW.md",
+    )
+
+    parser.add_argument(
+        "--dedup-map",
+        type=Path,
+        default=None,
+        help="Canonical-id map from dedup_markdown.py; non-canonical duplicates are skipped",
+    )
+
+    parser.add_argument(
+        "--source-dir",
+        type=Path,
+        default=None,
+        help="PDF tree the markdown was converted from (e.g. LabDocs/); its file times are used for the timestamps",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point for the script"""
+    args = parse_args()
+
+    if not args.input_dir.exists():
+        print(f"Error: Input directory does not exist: {args.input_dir}")
+        sys.exit(1)
+
+    print(f"Scanning for markdown files in: {args.input_dir}")
+
+    duplicates = set()
+    if args.dedup_map is not None:
+        duplicates = load_duplicates(args.dedup_map)
+        print(f"Skipping {len(duplicates)} near-duplicates listed in {args.dedup_map}")
+
+    skipped = 0
+    with FeedWriter(args.output_dir, args.docs_per_shard) as feed:
+        for md_file in iter_markdown_files(args.input_dir, args.exclude_reviews):
+            if duplicates and md_file.resolve() in duplicates:
+                skipped += 1
+                continue
+            relative_path = md_file.relative_to(args.input_dir).as_posix()
+            md_text = md_file.read_text(encoding="utf-8")
+            source_file = md_file
+            if args.source_dir is not None:
+                pdf_file = (args.source_dir / relative_path).with_suffix(".pdf")
+                if pdf_file.exists():
+                    source_file = pdf_file
+            feed.write(build_put(relative_path, md_text, source_file.stat()))
+
+    print(f"\n{'=' * 60}")
+    print("✓ Feed complete!")
+    print(f"  Documents written: {feed.docs_written}")
+    if args.dedup_map is not None:
+        print(f"  Near-duplicates skipped: {skipped}")
+    print(f"  Shards written: {len(feed.shards_written)}")
+    for shard in feed.shards_written:
+        print(f"  - {shard}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,1597 @@
 # convert the document to markdown
+import argparse
+import difflib
+import hashlib
+import heapq
+import json
+import math
 import os
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import random
+import re
+import resource
+import signal
+import socket
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
 from pathlib import Path
 
+import pymupdf
 import pymupdf4llm
 
-top_folder = Path("LabDocs/")
-out_folder = Path("MarkdownOutput/")
-out_folder.mkdir(exist_ok=True)
+try:
+    from pymupdf4llm.helpers.pymupdf_rag import IdentifyHeaders
+except ImportError:
+    # Without it header levels cannot be shared between page ranges, so
+    # documents going through the layout backend are converted unsplit
+    IdentifyHeaders = None
 
+from markdown2feed import FeedWriter, build_put
 
-def convert_pdf_to_markdown(pdf_file):
-    """Convert a single PDF file to markdown"""
+# Identifies the converter that produced an output; changing it forces reconversion
+CONVERTER_VERSIONS = {
+    "pymupdf4llm": "pymupdf4llm-"
+    + str(
+        getattr(pymupdf4llm, "__version__", getattr(pymupdf4llm, "version", "unknown"))
+    ),
+    "text": "text-pymupdf-" + str(getattr(pymupdf, "VersionBind", "unknown")),
+}
+
+# Routing thresholds, measured over the first CLASSIFY_PAGES pages: fewer
+# characters per page than this means a scanned or image-only layout, more
+# vector drawings (table rules, boxes) per page means tables worth detecting
+CLASSIFY_PAGES = 3
+MIN_TEXT_CHARS_PER_PAGE = 200
+MAX_DRAWINGS_PER_PAGE = 20
+
+WORD_PATTERN = re.compile(r"\w+")
+
+MANIFEST_NAME = ".conversion_manifest.jsonl"
+QUARANTINE_NAME = ".quarantine.jsonl"
+
+# Header levels of split documents are derived from at most this many pages,
+# spread evenly over the document, so every page range uses the same mapping
+HEADER_SAMPLE_PAGES = 20
+
+# PDFs are only opened by the workers, so the planner orders documents it has
+# no recorded page count for by a page count guessed from their size
+ESTIMATED_BYTES_PER_PAGE = 50_000
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    """Hash the content of a file without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def same_file(entry: dict | None, pdf_stat: os.stat_result) -> bool:
+    """Whether a manifest entry was recorded for a file of this size and mtime"""
+    return (
+        entry is not None
+        and entry["size"] == pdf_stat.st_size
+        and entry["mtime_ns"] == pdf_stat.st_mtime_ns
+    )
+
+
+def content_sha256(pdf_file: Path, pdf_stat: os.stat_result, previous: dict | None):
+    """Hash a PDF, reusing the manifest's hash while size and mtime still match"""
+    if same_file(previous, pdf_stat):
+        return previous["sha256"]
+    return file_sha256(pdf_file)
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Write data to a temp file next to `path`, then rename it into place
+
+    A crash can leave a stray temp file behind, but never a truncated `path`.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
     try:
-        # Calculate the relative path from top_folder to preserve directory structure
-        relative_path = pdf_file.relative_to(top_folder)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+class ConversionManifest:
+    """Append-only JSONL log of converted PDFs, keyed by path relative to the input dir
+
+    Each line records the PDF's content hash, size, mtime and converter version
+    together with the size of the markdown it produced. The last line for a
+    path wins, so re-recording a file never requires rewriting the log. The
+    quarantine list of poisonous PDFs is kept in the same format.
+
+    In sharded runs every shard appends to its own log; `also_read` loads the
+    other shards' logs (read-only) so their work is not redone.
+    """
+
+    def __init__(self, path: Path, also_read: list[Path] = ()):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._file = None
+
+        for log_path in [*also_read, path]:
+            if log_path.exists():
+                self._read(log_path)
+
+    def _read(self, path: Path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-append can leave one torn line; ignore it
+                    continue
+                current = self.entries.get(entry["pdf"])
+                if current is not None and entry.get("converted_at", "") < current.get(
+                    "converted_at", ""
+                ):
+                    # Another shard's log holds a newer conversion of this PDF
+                    continue
+                self.entries[entry["pdf"]] = entry
+
+    def get(self, key: str) -> dict | None:
+        return self.entries.get(key)
+
+    def record(self, entry: dict):
+        """Append an entry and flush it so a crash loses at most this line"""
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            needs_newline = self.path.exists() and self.path.stat().st_size > 0
+            if needs_newline:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    needs_newline = f.read(1) != b"\n"
+            self._file = open(self.path, "a", encoding="utf-8")
+            if needs_newline:
+                # Terminate a torn trailing line so it does not swallow this entry
+                self._file.write("\n")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self.entries[entry["pdf"]] = entry
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def log_path(out_folder: Path, name: str, tag: str | None) -> Path:
+    """Per-shard variant of a log file, e.g. .conversion_manifest.shard-0-of-4.jsonl"""
+    if tag is None:
+        return out_folder / name
+    stem, suffix = name.rsplit(".", 1)
+    return out_folder / f"{stem}.{tag}.{suffix}"
+
+
+def sibling_logs(out_folder: Path, name: str, own_path: Path) -> list[Path]:
+    """All shard variants of a log file in out_folder, except own_path"""
+    stem, suffix = name.rsplit(".", 1)
+    return sorted(
+        path for path in out_folder.glob(f"{stem}*.{suffix}") if path != own_path
+    )
+
+
+def output_path_for(pdf_file: Path, input_dir: Path, output_dir: Path) -> Path:
+    """Mirror the PDF's location under input_dir into output_dir"""
+    relative_path = pdf_file.relative_to(input_dir)
+    return output_dir / relative_path.parent / f"{pdf_file.stem}.md"
+
+
+def output_intact(entry: dict, output_file: Path) -> bool:
+    """Check that the recorded output still exists with the size we wrote"""
+    try:
+        return output_file.stat().st_size == entry["output_size"]
+    except FileNotFoundError:
+        return False
+
+
+def accepted_converters(backend: str) -> set[str]:
+    """Converter versions whose output satisfies the requested backend choice"""
+    if backend == "auto":
+        return set(CONVERTER_VERSIONS.values())
+    return {CONVERTER_VERSIONS[backend]}
+
+
+def is_up_to_date(
+    entry: dict | None,
+    pdf_stat: os.stat_result,
+    output_file: Path,
+    converters: set[str],
+) -> bool:
+    """Cheap check (no hashing) that a manifest entry still describes the PDF"""
+    return (
+        same_file(entry, pdf_stat)
+        and entry["converter"] in converters
+        and output_intact(entry, output_file)
+    )
+
+
+def manifest_entry(
+    pdf_file: Path,
+    input_dir: Path,
+    output_dir: Path,
+    sha256: str,
+    pdf_stat: os.stat_result,
+) -> dict:
+    """Describe a PDF for the manifest
+
+    The converter and output fields are filled in after writing, once the
+    backend that handled the document is known.
+    """
+    return {
+        "pdf": pdf_file.relative_to(input_dir).as_posix(),
+        "sha256": sha256,
+        "size": pdf_stat.st_size,
+        "mtime_ns": pdf_stat.st_mtime_ns,
+        "output": output_path_for(pdf_file, input_dir, output_dir)
+        .relative_to(output_dir)
+        .as_posix(),
+    }
+
+
+def is_unchanged(
+    previous: dict | None, sha256: str, output_file: Path, converters: set[str]
+) -> bool:
+    """Check that a PDF with a new mtime still has the content we converted"""
+    return (
+        previous is not None
+        and previous["sha256"] == sha256
+        and previous["converter"] in converters
+        and output_intact(previous, output_file)
+    )
+
+
+def carry_over(entry: dict, previous: dict):
+    """Copy the output fields of an unchanged PDF's previous manifest entry"""
+    for field in ("pages", "converter", "backend", "output_size", "converted_at"):
+        if field in previous:
+            entry[field] = previous[field]
+
+
+def finish_entry(entry: dict, backend: str, output_size: int):
+    """Fill in the output fields of a manifest entry after writing the markdown"""
+    entry["converter"] = CONVERTER_VERSIONS[backend]
+    entry["backend"] = backend
+    entry["output_size"] = output_size
+    entry["converted_at"] = datetime.now().isoformat()
+
+
+def layout_markdown(doc, pages: list[int] | None = None, hdr_info=None) -> str:
+    """Full layout analysis with pymupdf4llm: headers, tables, lists"""
+    if pages is None:
+        return pymupdf4llm.to_markdown(doc)
+    return pymupdf4llm.to_markdown(doc, pages=pages, hdr_info=hdr_info)
+
+
+def text_layer_markdown(doc, pages: list[int] | None = None, hdr_info=None) -> str:
+    """Raw text layer in reading order, one block per page, no layout analysis"""
+    page_numbers = range(doc.page_count) if pages is None else pages
+    return "".join(
+        doc[number].get_text("text", sort=True).strip() + "\n\n"
+        for number in page_numbers
+    )
+
+
+# Converter backends, all called as backend(doc, pages=None, hdr_info=None)
+# -> markdown; hdr_info is the header mapping shared by a split document's ranges
+BACKENDS = {
+    "pymupdf4llm": layout_markdown,
+    "text": text_layer_markdown,
+}
+
+
+def classify_document(doc) -> tuple[str, dict]:
+    """Pick the cheapest adequate backend from the first few pages
+
+    Plain text-layer documents go to the raw text backend. Pages with little
+    text (scans, image-only layouts), embedded images, or many vector drawings
+    (ruled tables, form boxes) need the full layout analysis. Only page-level
+    object lists are read, so this costs a fraction of a conversion.
+    """
+    sample = range(min(CLASSIFY_PAGES, doc.page_count))
+    features = {"chars": 0, "images": 0, "drawings": 0}
+    for number in sample:
+        page = doc[number]
+        features["chars"] += len(page.get_text("text"))
+        features["images"] += len(page.get_images())
+        features["drawings"] += len(page.get_drawings())
+
+    pages = max(1, len(sample))
+    if (
+        features["chars"] / pages < MIN_TEXT_CHARS_PER_PAGE
+        or features["images"] > 0
+        or features["drawings"] / pages > MAX_DRAWINGS_PER_PAGE
+    ):
+        return "pymupdf4llm", features
+    return "text", features
+
+
+def choose_backend(doc, backend: str) -> str:
+    """Resolve --backend: classify the document for auto, else use it as given"""
+    if backend == "auto":
+        return classify_document(doc)[0]
+    return backend
+
 
+def peak_rss_kb() -> int:
+    """Peak resident set size of the current process so far, in KiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def finish_metrics(metrics: dict, start_wall: float, start_cpu: float) -> dict:
+    """Add wall time, CPU time and peak RSS measured since the task started"""
+    metrics["wall_s"] = time.perf_counter() - start_wall
+    metrics["cpu_s"] = time.process_time() - start_cpu
+    metrics["peak_rss_kb"] = peak_rss_kb()
+    return metrics
+
+
+def convert_pdf_to_markdown(
+    pdf_file: Path,
+    input_dir: Path,
+    output_dir: Path,
+    previous: dict | None = None,
+    return_markdown: bool = False,
+    backend: str = "pymupdf4llm",
+    split_pages: int | None = None,
+) -> dict:
+    """Convert a single PDF file to markdown
+
+    `previous` is the manifest entry from an earlier run, if any. When the PDF
+    was only touched (same content hash) and its output is intact, the
+    conversion is skipped and a refreshed manifest entry is returned.
+    With `return_markdown` the text is also handed back to the caller, which
+    saves re-reading the output when feeding it onwards. `backend` is a key of
+    BACKENDS, or "auto" to route the document with classify_document.
+    A document with more than `split_pages` pages is not converted; the
+    result has status "split" and its manifest entry carries the page count,
+    so the caller can split it into page ranges. The backend is chosen and,
+    for the layout backend, the header mapping built here once, so that every
+    range converts with the same ones.
+    """
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    metrics = {"pages": 0, "bytes_in": 0, "bytes_out": 0}
+    try:
         # Create the output file path with the same folder structure
-        output_file = out_folder / relative_path.parent / f"{pdf_file.stem}.md"
+        output_file = output_path_for(pdf_file, input_dir, output_dir)
 
-        # Skip if output file already exists
-        if output_file.exists():
-            return {"status": "skipped", "file": str(pdf_file.name)}
+        pdf_stat = pdf_file.stat()
+        metrics["bytes_in"] = pdf_stat.st_size
+        sha256 = content_sha256(pdf_file, pdf_stat, previous)
+        entry = manifest_entry(pdf_file, input_dir, output_dir, sha256, pdf_stat)
+
+        # Skip if the content is unchanged and the previous output is intact
+        if is_unchanged(previous, sha256, output_file, accepted_converters(backend)):
+            carry_over(entry, previous)
+            return {"status": "skipped", "file": str(pdf_file.name), "manifest": entry}
+
+        # Convert PDF to markdown
+        with pymupdf.open(pdf_file) as doc:
+            metrics["pages"] = entry["pages"] = doc.page_count
+            metrics["backend"] = choose_backend(doc, backend)
+            layout = metrics["backend"] == "pymupdf4llm"
+            if (
+                split_pages is not None
+                and doc.page_count > split_pages
+                and not (layout and IdentifyHeaders is None)
+            ):
+                return {
+                    "status": "split",
+                    "file": str(pdf_file.name),
+                    "manifest": entry,
+                    "hdr_info": header_info(doc) if layout else None,
+                    "metrics": finish_metrics(metrics, start_wall, start_cpu),
+                }
+            md_text = BACKENDS[metrics["backend"]](doc)
 
         # Create parent directories if they don't exist
         output_file.parent.mkdir(parents=True, exist_ok=True)
+        md_bytes = md_text.encode()
+        atomic_write_bytes(output_file, md_bytes)
+
+        metrics["bytes_out"] = len(md_bytes)
+        finish_entry(entry, metrics["backend"], len(md_bytes))
+        result = {
+            "status": "success",
+            "file": str(pdf_file.name),
+            "manifest": entry,
+            "metrics": finish_metrics(metrics, start_wall, start_cpu),
+        }
+        if return_markdown:
+            result["markdown"] = md_text
+        return result
+
+    except Exception as e:
+        return {
+            "status": "error",
+            "file": str(pdf_file.name),
+            "error": str(e),
+            "metrics": finish_metrics(metrics, start_wall, start_cpu),
+        }
 
-        # Convert PDF to markdown
-        md_text = pymupdf4llm.to_markdown(str(pdf_file))
-        output_file.write_bytes(md_text.encode())
 
-        return {"status": "success", "file": str(pdf_file.name)}
+def header_sample_pages(page_count: int) -> list[int]:
+    """Pick the pages used to identify header font sizes in a split document"""
+    step = max(1, page_count // HEADER_SAMPLE_PAGES)
+    return list(range(0, page_count, step))[:HEADER_SAMPLE_PAGES]
+
+
+def header_info(doc):
+    """Header font size mapping of a split document, from a sample of its pages"""
+    return IdentifyHeaders(doc, pages=header_sample_pages(doc.page_count))
+
+
+def convert_pdf_pages(
+    pdf_file: Path, pages: list[int], backend: str, hdr_info=None
+) -> dict:
+    """Convert a page range of a PDF and return the markdown to the caller
+
+    Used for documents large enough to be split across workers; the parent
+    process stitches the ranges back together in page order. `backend` and
+    `hdr_info` were resolved once for the whole document by the worker that
+    found it too long, so all ranges agree on them.
+    """
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    metrics = {"pages": len(pages), "backend": backend}
+    try:
+        with pymupdf.open(pdf_file) as doc:
+            md_text = BACKENDS[backend](doc, pages=pages, hdr_info=hdr_info)
+        return {
+            "status": "success",
+            "file": str(pdf_file.name),
+            "markdown": md_text,
+            "metrics": finish_metrics(metrics, start_wall, start_cpu),
+        }
 
     except Exception as e:
-        return {"status": "error", "file": str(pdf_file.name), "error": str(e)}
+        return {
+            "status": "error",
+            "file": str(pdf_file.name),
+            "error": str(e),
+            "metrics": finish_metrics(metrics, start_wall, start_cpu),
+        }
 
 
-if __name__ == "__main__":
-    # Collect all PDF files
-    pdf_files = list(top_folder.rglob("*.pdf"))
-    total_files = len(pdf_files)
-    print(f"Found {total_files} PDF files to convert")
+def estimated_pages(previous: dict | None, pdf_stat: os.stat_result) -> int:
+    """Page count used to order tasks: the manifest's, else a guess from the size"""
+    if same_file(previous, pdf_stat) and "pages" in previous:
+        return previous["pages"]
+    return max(1, pdf_stat.st_size // ESTIMATED_BYTES_PER_PAGE)
+
+
+def page_ranges(page_count: int, chunk_pages: int) -> list[list[int]]:
+    """Split [0, page_count) into consecutive ranges of at most chunk_pages pages"""
+    return [
+        list(range(start, min(start + chunk_pages, page_count)))
+        for start in range(0, page_count, chunk_pages)
+    ]
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse an `i/N` shard spec (0 <= i < N)"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}") from None
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {count})")
+    return index, count
+
+
+def in_shard(key: str, shard: tuple[int, int] | None) -> bool:
+    """Deterministically assign a relative path to one of N shards"""
+    if shard is None:
+        return True
+    index, count = shard
+    digest = hashlib.sha1(key.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count == index
+
+
+class ClaimDirectory:
+    """Lock-free work claims on a filesystem shared by several hosts
+
+    A claim is a file created with O_CREAT | O_EXCL, which is atomic on local
+    filesystems and NFSv3+, so exactly one host wins each PDF without a lock
+    server. Finished claims are kept (marked done, with the PDF's size and
+    mtime) so hosts that start later do not redo the work. Claims left behind
+    by a crashed host are taken over after `ttl` seconds by renaming them away
+    first, which again only one host can do.
+    """
+
+    def __init__(self, path: Path, owner: str, ttl: float):
+        self.path = path
+        self.owner = owner
+        self.ttl = ttl
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _claim_path(self, key: str) -> Path:
+        return self.path / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+    def _claim_body(self, key: str, status: str, pdf_stat: os.stat_result) -> bytes:
+        return json.dumps(
+            {
+                "pdf": key,
+                "owner": self.owner,
+                "status": status,
+                "size": pdf_stat.st_size,
+                "mtime_ns": pdf_stat.st_mtime_ns,
+                "updated_at": datetime.now().isoformat(),
+            }
+        ).encode()
+
+    def try_claim(self, key: str, pdf_stat: os.stat_result) -> bool:
+        """Claim a PDF for this host; False if another host holds or finished it"""
+        claim_path = self._claim_path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._take_over(claim_path, pdf_stat):
+                    return False
+                continue
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._claim_body(key, "claimed", pdf_stat))
+            return True
+        return False
+
+    def _take_over(self, claim_path: Path, pdf_stat: os.stat_result) -> bool:
+        """Remove a claim that is stale or describes an older version of the PDF"""
+        try:
+            claim_stat = claim_path.stat()
+            raw_claim = claim_path.read_bytes()
+        except FileNotFoundError:
+            # Released in the meantime; try to create it again
+            return True
+        try:
+            claim = json.loads(raw_claim)
+        except json.JSONDecodeError:
+            # Empty or partial: its owner is writing it now, or died doing so
+            claim = None
+
+        fresh = time.time() - claim_stat.st_mtime < self.ttl
+        if claim is None:
+            if fresh:
+                return False
+        else:
+            same_pdf = (
+                claim.get("size") == pdf_stat.st_size
+                and claim.get("mtime_ns") == pdf_stat.st_mtime_ns
+            )
+            if same_pdf and (claim.get("status") == "done" or fresh):
+                return False
+
+        # Only one host can rename the claim away; the others see it vanish
+        moved = claim_path.with_name(f"{claim_path.name}.{self.owner}.stale")
+        try:
+            os.rename(claim_path, moved)
+        except FileNotFoundError:
+            return False
+        if moved.stat().st_mtime != claim_stat.st_mtime:
+            # Another host replaced the claim between our read and rename; put
+            # its fresh claim back unless yet another host already re-claimed
+            try:
+                os.link(moved, claim_path)
+            except FileExistsError:
+                pass
+            moved.unlink()
+            return False
+        moved.unlink()
+        return True
+
+    def mark_done(self, key: str, pdf_stat: os.stat_result):
+        atomic_write_bytes(
+            self._claim_path(key), self._claim_body(key, "done", pdf_stat)
+        )
+
+    def release(self, key: str):
+        """Give up a claim so another host may retry the PDF"""
+        self._claim_path(key).unlink(missing_ok=True)
+
+    def pending(self) -> list[dict]:
+        """Claims that were never marked done or released"""
+        stuck = []
+        for claim_path in self.path.glob("*.json"):
+            try:
+                claim = json.loads(claim_path.read_bytes())
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if claim.get("status") != "done":
+                stuck.append(claim)
+        return stuck
+
+
+def plan_tasks(
+    pdf_files,
+    top_folder: Path,
+    out_folder: Path,
+    manifest: ConversionManifest,
+    quarantine: ConversionManifest,
+    claims: ClaimDirectory | None,
+    args: argparse.Namespace,
+    counts: dict,
+):
+    """Lazily turn PDF paths into conversion tasks
+
+    Only files in this host's shard are considered, and with claims enabled
+    only those this host manages to claim. Files that the manifest shows as
+    up to date, and quarantined files that have not changed since they were
+    quarantined, are only counted. Every other file becomes a whole-document
+    task; a worker that finds more than args.split_pages pages hands it back
+    for split_tasks instead of converting it.
+    """
+    for pdf in pdf_files:
+        key = pdf.relative_to(top_folder).as_posix()
+        if not in_shard(key, args.shard):
+            continue
+        counts["found"] += 1
+        previous = None if args.force else manifest.get(key)
+        output_file = output_path_for(pdf, top_folder, out_folder)
+        pdf_stat = pdf.stat()
+        converters = accepted_converters(args.backend)
+
+        # Files whose size, mtime, converter and output all match the manifest
+        # are skipped without being hashed or sent to a worker
+        if is_up_to_date(previous, pdf_stat, output_file, converters):
+            counts["skipped"] += 1
+            continue
+
+        quarantined = quarantine.get(key)
+        if (
+            quarantined is not None
+            and not args.retry_quarantined
+            and quarantined["size"] == pdf_stat.st_size
+            and quarantined["mtime_ns"] == pdf_stat.st_mtime_ns
+        ):
+            counts["quarantined"] += 1
+            continue
+
+        if claims is not None and not claims.try_claim(key, pdf_stat):
+            counts["claimed_elsewhere"] += 1
+            continue
+
+        # Page counts and content hashes are left to the workers, so the
+        # planner only stats files and never holds up the window
+        yield {
+            "pdf": pdf,
+            "previous": previous,
+            "cost": estimated_pages(previous, pdf_stat),
+            "return_markdown": args.feed_dir is not None,
+            "backend": args.backend,
+            "split_pages": args.split_pages,
+        }
+
+
+def split_tasks(
+    task: dict, result: dict, out_folder: Path, chunk_pages: int, split_docs: dict
+) -> list[dict]:
+    """Turn a document a worker found too long into page-range tasks
+
+    The document is registered in split_docs until all of its ranges are back.
+    Touched-but-identical long documents never get here: the worker resolves
+    them from the content hash before opening the file.
+    """
+    entry = result["manifest"]
+    page_count = entry["pages"]
+    ranges = page_ranges(page_count, chunk_pages)
+    split_docs[entry["pdf"]] = {
+        "entry": entry,
+        "output_file": out_folder / entry["output"],
+        "parts": [None] * len(ranges),
+        "remaining": len(ranges),
+        "failed": False,
+        # Summed over ranges; peak RSS is the largest seen by any range
+        "metrics": {
+            "pages": page_count,
+            "bytes_in": entry["size"],
+            "bytes_out": 0,
+            "wall_s": result["metrics"]["wall_s"],
+            "cpu_s": result["metrics"]["cpu_s"],
+            "peak_rss_kb": 0,
+            "tasks": len(ranges),
+        },
+    }
+    return [
+        {
+            "pdf": task["pdf"],
+            "key": entry["pdf"],
+            "part": part,
+            "pages": pages,
+            "cost": len(pages),
+            "backend": result["metrics"]["backend"],
+            "hdr_info": result["hdr_info"],
+        }
+        for part, pages in enumerate(ranges)
+    ]
+
+
+def largest_first(tasks, lookahead: int):
+    """Reorder a task stream longest first within a bounded lookahead buffer
+
+    With a lookahead covering the whole run this is a full sort; smaller
+    values keep memory bounded while still pushing long tasks to the front.
+    """
+    heap = []
+    for seq, task in enumerate(tasks):
+        heapq.heappush(heap, (-task["cost"], seq, task))
+        if len(heap) > lookahead:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def run_with_deadline(timeout: int, fn, *args) -> dict:
+    """Run a worker function under a hard deadline enforced by the kernel
+
+    SIGALRM with its default action terminates the worker process, which works
+    even while it is stuck inside MuPDF's C code where no Python-level timeout
+    could fire. The parent sees the dead worker as a broken pool.
+    """
+    if timeout and hasattr(signal, "alarm"):
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        signal.alarm(timeout)
+    try:
+        return fn(*args)
+    finally:
+        if timeout and hasattr(signal, "alarm"):
+            signal.alarm(0)
+
+
+def submit_task(executor, task: dict, top_folder: Path, out_folder: Path, timeout: int):
+    """Submit a whole-document or page-range task to the pool"""
+    if "pages" in task:
+        return executor.submit(
+            run_with_deadline,
+            timeout,
+            convert_pdf_pages,
+            task["pdf"],
+            task["pages"],
+            task["backend"],
+            task["hdr_info"],
+        )
+    return executor.submit(
+        run_with_deadline,
+        timeout,
+        convert_pdf_to_markdown,
+        task["pdf"],
+        top_folder,
+        out_folder,
+        task["previous"],
+        task.get("return_markdown", False),
+        task["backend"],
+        task.get("split_pages"),
+    )
+
+
+class ConversionPool:
+    """Process pool that survives hung and crashing workers
+
+    A dead worker breaks a ProcessPoolExecutor for every task in flight, and
+    there is no telling which task killed it. After a break the pool is
+    replaced and the tasks that were in flight become suspects: they are
+    re-run one at a time in a single-worker probe pool, alongside the main
+    pool. A probe that dies again pins down the poisonous document exactly; it
+    is returned as an error flagged for quarantine.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_tasks_per_child: int | None,
+        timeout: int,
+        top_folder: Path,
+        out_folder: Path,
+    ):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.timeout = timeout
+        self.top_folder = top_folder
+        self.out_folder = out_folder
+        self.respawns = 0
+
+        self.executor = self._new_executor()
+        self.in_flight = {}
+        self.suspects = deque()
+        self.probe = None
+        self.probe_future = None
+        self.probe_task = None
+        self.probe_started = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.probe is not None:
+            self.probe.shutdown(wait=True, cancel_futures=True)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # Recycling workers caps the memory MuPDF accumulates over thousands of documents
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            max_tasks_per_child=self.max_tasks_per_child,
+        )
+
+    def _submit(self, executor, task: dict):
+        return submit_task(
+            executor, task, self.top_folder, self.out_folder, self.timeout
+        )
+
+    def idle(self) -> bool:
+        return not self.in_flight and not self.suspects and self.probe_future is None
+
+    def submit(self, task: dict) -> list[tuple[dict, dict]]:
+        """Queue a task on the main pool; returns results salvaged from a broken pool"""
+        finished = []
+        try:
+            future = self._submit(self.executor, task)
+        except BrokenProcessPool:
+            finished = self._replace_broken_pool()
+            future = self._submit(self.executor, task)
+        self.in_flight[future] = task
+        return finished
+
+    def wait(self) -> list[tuple[dict, dict]]:
+        """Block until at least one task finishes; return (task, result) pairs"""
+        if self.probe_future is None and self.suspects:
+            if self.probe is None:
+                self.probe = ProcessPoolExecutor(max_workers=1)
+            self.probe_task = self.suspects.popleft()
+            self.probe_started = time.perf_counter()
+            self.probe_future = self._submit(self.probe, self.probe_task)
+
+        futures = set(self.in_flight)
+        if self.probe_future is not None:
+            futures.add(self.probe_future)
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+        finished = []
+        broken = False
+        for future in done:
+            if future is self.probe_future:
+                finished.append(self._finish_probe())
+                continue
+            task = self.in_flight.pop(future)
+            try:
+                finished.append((task, future.result()))
+            except BrokenProcessPool:
+                self.suspects.append(task)
+                broken = True
+        if broken:
+            finished.extend(self._replace_broken_pool())
+        return finished
+
+    def _replace_broken_pool(self) -> list[tuple[dict, dict]]:
+        """Turn every unfinished task into a suspect and start a fresh pool"""
+        finished = []
+        for future, task in self.in_flight.items():
+            if future.done() and future.exception() is None:
+                finished.append((task, future.result()))
+            else:
+                self.suspects.append(task)
+        self.in_flight = {}
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._new_executor()
+        self.respawns += 1
+        return finished
+
+    def _finish_probe(self) -> tuple[dict, dict]:
+        task, future = self.probe_task, self.probe_future
+        self.probe_task = self.probe_future = None
+        try:
+            return task, future.result()
+        except BrokenProcessPool:
+            self.probe.shutdown(wait=False, cancel_futures=True)
+            self.probe = None
+
+        elapsed = time.perf_counter() - self.probe_started
+        if self.timeout and elapsed >= self.timeout:
+            reason = f"timed out after {self.timeout}s"
+        else:
+            reason = "worker process died"
+        metrics = {"pages": 0, "wall_s": elapsed, "cpu_s": 0.0, "peak_rss_kb": 0}
+        return task, {
+            "status": "error",
+            "file": str(task["pdf"].name),
+            "error": f"Quarantined: {reason}",
+            "quarantine": True,
+            "metrics": metrics,
+        }
+
+
+def collect_result(task: dict, result: dict, split_docs: dict) -> dict | None:
+    """Fold a task result into a per-document result
+
+    Returns None while a split document still has ranges outstanding. A failed
+    range is reported once; the document's remaining ranges are discarded.
+    """
+    if "pages" not in task:
+        return result
+
+    doc = split_docs[task["key"]]
+    doc["remaining"] -= 1
+    metrics = doc["metrics"]
+    metrics["wall_s"] += result["metrics"]["wall_s"]
+    metrics["cpu_s"] += result["metrics"]["cpu_s"]
+    metrics["peak_rss_kb"] = max(
+        metrics["peak_rss_kb"], result["metrics"]["peak_rss_kb"]
+    )
+
+    report = None
+    if doc["failed"]:
+        pass
+    elif result["status"] == "error":
+        doc["failed"] = True
+        report = {**result, "metrics": metrics}
+    else:
+        doc["parts"][task["part"]] = result["markdown"]
+        metrics["backend"] = result["metrics"]["backend"]
+
+    if doc["remaining"] == 0:
+        del split_docs[task["key"]]
+        if not doc["failed"]:
+            # All ranges are back: stitch them in page order
+            md_text = "".join(doc["parts"])
+            md_bytes = md_text.encode()
+            doc["output_file"].parent.mkdir(parents=True, exist_ok=True)
+            atomic_write_bytes(doc["output_file"], md_bytes)
+            metrics["bytes_out"] = len(md_bytes)
+            finish_entry(doc["entry"], metrics["backend"], len(md_bytes))
+            report = {
+                "status": "success",
+                "file": result["file"],
+                "manifest": doc["entry"],
+                "metrics": metrics,
+                "markdown": md_text,
+            }
+    return report
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(1, rank)) - 1]
+
+
+class ConversionMetrics:
+    """Per-document conversion metrics, logged as JSONL and summarised at the end
+
+    Each line holds page count, bytes in/out, wall and CPU seconds spent in
+    workers, and the worker's peak RSS when the document finished. Peak RSS is
+    per worker process, so it includes whatever earlier documents left behind.
+    """
+
+    def __init__(self, path: Path | None):
+        self.run_id = datetime.now().isoformat(timespec="seconds")
+        self.converted = []
+        self.backends = {}
+        self.peak_rss_kb = 0
+        self._file = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, pdf_key: str, result: dict):
+        metrics = result.get("metrics")
+        if metrics is None:
+            return
+        if self._file is not None:
+            line = {"run": self.run_id, "pdf": pdf_key, "status": result["status"]}
+            self._file.write(json.dumps(line | metrics) + "\n")
+        if result["status"] == "success":
+            self.converted.append(
+                (metrics["wall_s"], metrics["cpu_s"], metrics["pages"], pdf_key)
+            )
+            backend = metrics.get("backend")
+            self.backends[backend] = self.backends.get(backend, 0) + 1
+        self.peak_rss_kb = max(self.peak_rss_kb, metrics["peak_rss_kb"])
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def print_summary(self, elapsed_s: float, slowest: int = 20):
+        """Print latency percentiles, throughput and the slowest documents"""
+        if not self.converted:
+            return
+        latencies = sorted(wall for wall, _, _, _ in self.converted)
+        total_pages = sum(pages for _, _, pages, _ in self.converted)
+        total_cpu = sum(cpu for _, cpu, _, _ in self.converted)
+
+        print(f"\n{'=' * 60}")
+        print("Conversion metrics:")
+        print(f"  Documents measured: {len(self.converted)}")
+        print(f"  Pages converted: {total_pages}")
+        print(
+            f"  Latency per document: p50 {percentile(latencies, 50):.2f}s,"
+            f" p95 {percentile(latencies, 95):.2f}s,"
+            f" p99 {percentile(latencies, 99):.2f}s"
+        )
+        print(f"  Pages/second (wall clock): {total_pages / max(elapsed_s, 1e-9):.2f}")
+        print(f"  Pages/CPU-second: {total_pages / max(total_cpu, 1e-9):.2f}")
+        print(f"  Peak worker RSS: {self.peak_rss_kb / 1024:.1f} MiB")
+        print(
+            "  Documents per backend: "
+            + ", ".join(
+                f"{name} {count}" for name, count in sorted(self.backends.items())
+            )
+        )
+        print(f"\nSlowest {min(slowest, len(self.converted))} documents:")
+        for wall, _, pages, pdf_key in heapq.nlargest(slowest, self.converted):
+            print(f"  {wall:8.2f}s {pages:5d} pages  {pdf_key}")
+
+
+def comparable_words(md_text: str) -> list[str]:
+    """Lower-cased words of a markdown text, so formatting does not count as a diff"""
+    return WORD_PATTERN.findall(md_text.lower())
+
+
+def benchmark_pdf(pdf_file: Path) -> dict:
+    """Convert one PDF with every backend; time each and compare it with pymupdf4llm"""
+    result = {"pdf": str(pdf_file), "pages": 0, "backends": {}}
+    try:
+        with pymupdf.open(pdf_file) as doc:
+            result["pages"] = doc.page_count
+            start = time.perf_counter()
+            result["routed"], result["features"] = classify_document(doc)
+            result["classify_s"] = time.perf_counter() - start
+
+            outputs = {}
+            for name, backend in BACKENDS.items():
+                start = time.perf_counter()
+                outputs[name] = comparable_words(backend(doc))
+                result["backends"][name] = {"wall_s": time.perf_counter() - start}
+
+        reference = outputs["pymupdf4llm"]
+        for name, words in outputs.items():
+            result["backends"][name]["similarity"] = difflib.SequenceMatcher(
+                None, reference, words
+            ).ratio()
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def run_benchmark(top_folder: Path, out_folder: Path, sample_size: int, timeout: int):
+    """Compare backend throughput and output on a random sample of PDFs
+
+    Every sampled document is converted by every backend. Similarity is the
+    difflib ratio of its words against the pymupdf4llm output, which is the
+    reference. The "auto" row shows what routing each document would cost
+    and how close the routed output stays to the reference. Per-document
+    results are written to <output-dir>/backend_benchmark.jsonl.
+    """
+    pdf_files = sorted(top_folder.rglob("*.pdf"))
+    sample = random.Random(0).sample(pdf_files, min(sample_size, len(pdf_files)))
+    print(
+        f"Benchmarking {len(BACKENDS)} backends on {len(sample)} of {len(pdf_files)} PDF files"
+    )
+
+    results = []
+    max_workers = max(1, os.cpu_count() - 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(run_with_deadline, timeout, benchmark_pdf, pdf)
+            for pdf in sample
+        ]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                print("Error: A worker died (crash or --timeout); benchmark aborted")
+                executor.shutdown(wait=False, cancel_futures=True)
+                sys.exit(1)
+
+    details_path = out_folder / "backend_benchmark.jsonl"
+    atomic_write_bytes(
+        details_path, "".join(json.dumps(r) + "\n" for r in results).encode()
+    )
+
+    measured = [r for r in results if "error" not in r]
+    pages = sum(r["pages"] for r in measured)
+    rows = {}
+    for name in BACKENDS:
+        rows[name] = (
+            sum(r["backends"][name]["wall_s"] for r in measured),
+            [r["backends"][name]["similarity"] for r in measured],
+        )
+    rows["auto"] = (
+        sum(r["classify_s"] + r["backends"][r["routed"]]["wall_s"] for r in measured),
+        [r["backends"][r["routed"]]["similarity"] for r in measured],
+    )
+
+    print(f"\n{'=' * 60}")
+    print(f"Backend benchmark: {len(measured)} documents, {pages} pages")
+    print(
+        f"  {'backend':<12} {'pages/s':>9} {'sim mean':>9} {'sim p5':>7} {'sim min':>8}"
+    )
+    for name, (wall_s, similarities) in rows.items():
+        similarities.sort()
+        mean = sum(similarities) / max(1, len(similarities))
+        print(
+            f"  {name:<12} {pages / max(wall_s, 1e-9):9.1f} {mean:9.3f}"
+            f" {percentile(similarities, 5):7.3f} {min(similarities, default=0.0):8.3f}"
+        )
+
+    routed = {}
+    for r in measured:
+        routed[r["routed"]] = routed.get(r["routed"], 0) + 1
+    print(
+        "  Routing with --backend auto: "
+        + ", ".join(f"{name} {count}" for name, count in sorted(routed.items()))
+    )
+
+    # The documents routed to the text backend that lose the most against
+    # the reference show whether the classifier thresholds need tightening
+    worst = sorted(
+        (r["backends"]["text"]["similarity"], r["pdf"])
+        for r in measured
+        if r["routed"] == "text"
+    )[:10]
+    if worst:
+        print("\nLowest similarity among documents routed to text:")
+        for similarity, pdf in worst:
+            print(f"  {similarity:.3f}  {pdf}")
+    for r in results:
+        if "error" in r:
+            print(f"  ✗ {r['pdf']}: {r['error']}")
+    print(f"\nPer-document results saved to: {details_path}")
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Convert a tree of PDF files to markdown with pymupdf4llm or a raw text backend",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--input-dir",
+        type=Path,
+        default=Path("LabDocs/"),
+        help="Directory searched recursively for PDF files",
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=Path("MarkdownOutput/"),
+        help="Directory receiving the markdown files, mirroring the input tree",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=None,
+        help=f"Conversion manifest path (default: <output-dir>/{MANIFEST_NAME})",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="Reconvert every PDF, ignoring the manifest",
+    )
+
+    parser.add_argument(
+        "--backend",
+        choices=["auto", *BACKENDS],
+        default="pymupdf4llm",
+        help="Converter for every PDF; auto routes plain text-layer PDFs to the raw text backend and the rest to pymupdf4llm (check with --benchmark first)",
+    )
+
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Convert a random sample of N PDFs with every backend, report throughput and output similarity, then exit",
+    )
+
+    parser.add_argument(
+        "--split-pages",
+        type=int,
+        default=64,
+        help="Documents with more pages than this are split into page ranges",
+    )
+
+    parser.add_argument(
+        "--chunk-pages",
+        type=int,
+        default=16,
+        help="Number of pages per task when a document is split",
+    )
+
+    parser.add_argument(
+        "--queue-factor",
+        type=int,
+        default=2,
+        help="Keep at most this many tasks per worker submitted to the pool",
+    )
+
+    parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=4096,
+        help="Number of upcoming tasks reordered longest first",
+    )
+
+    parser.add_argument(
+        "--max-tasks-per-child",
+        type=int,
+        default=200,
+        help="Replace each worker process after this many tasks (0: never)",
+    )
+
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=600,
+        help="Kill a worker after this many seconds on one task (0: no limit)",
+    )
+
+    parser.add_argument(
+        "--quarantine-file",
+        type=Path,
+        default=None,
+        help=f"List of PDFs that hung or crashed a worker (default: <output-dir>/{QUARANTINE_NAME})",
+    )
+
+    parser.add_argument(
+        "--retry-quarantined",
+        action="store_true",
+        default=False,
+        help="Convert quarantined PDFs again instead of skipping them",
+    )
+
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="Only convert shard i of N (e.g. 0/4), partitioned by a hash of the relative path",
+    )
+
+    parser.add_argument(
+        "--claim",
+        action="store_true",
+        default=False,
+        help="Claim each PDF in <output-dir>/.claims before converting it, so hosts sharing the output dir never duplicate work (one process per host)",
+    )
+
+    parser.add_argument(
+        "--claim-ttl",
+        type=float,
+        default=12 * 3600,
+        help="Seconds after which an unfinished claim is considered abandoned",
+    )
+
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        default=False,
+        help="Merge all shard manifests into one and verify that every PDF is covered, then exit",
+    )
+
+    parser.add_argument(
+        "--feed-dir",
+        type=Path,
+        default=None,
+        help="Also write a Vespa put operation for every converted document to gzip JSONL shards here (see markdown2feed.py)",
+    )
+
+    parser.add_argument(
+        "--feed-docs-per-shard",
+        type=int,
+        default=10000,
+        help="Number of documents per feed shard",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        default=None,
+        help="Per-document metrics JSONL, appended to (default: <output-dir>/conversion_metrics.jsonl)",
+    )
+
+    return parser.parse_args()
+
+
+def merge_and_verify(top_folder: Path, out_folder: Path) -> int:
+    """Merge the shard manifests and check that every PDF is accounted for
+
+    Writes the merged manifest to <output-dir>/.conversion_manifest.jsonl and
+    the PDFs that have neither an up-to-date output nor a quarantine entry to
+    <output-dir>/coverage_missing.txt. Returns the number of such PDFs.
+    """
+    main_path = out_folder / MANIFEST_NAME
+    manifest = ConversionManifest(
+        main_path, also_read=sibling_logs(out_folder, MANIFEST_NAME, main_path)
+    )
+    quarantine_path = out_folder / QUARANTINE_NAME
+    quarantine = ConversionManifest(
+        quarantine_path,
+        also_read=sibling_logs(out_folder, QUARANTINE_NAME, quarantine_path),
+    )
+
+    # Compact the merged entries into the main manifest in one atomic write
+    atomic_write_bytes(
+        main_path,
+        "".join(
+            json.dumps(entry) + "\n" for entry in manifest.entries.values()
+        ).encode(),
+    )
+    print(f"Merged {len(manifest.entries)} manifest entries into {main_path}")
+
+    covered = 0
+    quarantined = []
+    missing = []
+    for pdf in top_folder.rglob("*.pdf"):
+        key = pdf.relative_to(top_folder).as_posix()
+        pdf_stat = pdf.stat()
+        entry = quarantine.get(key)
+        if is_up_to_date(
+            manifest.get(key),
+            pdf_stat,
+            output_path_for(pdf, top_folder, out_folder),
+            accepted_converters("auto"),
+        ):
+            covered += 1
+        elif (
+            entry is not None
+            and entry["size"] == pdf_stat.st_size
+            and entry["mtime_ns"] == pdf_stat.st_mtime_ns
+        ):
+            quarantined.append(entry)
+        else:
+            missing.append(key)
+
+    missing_path = out_folder / "coverage_missing.txt"
+    atomic_write_bytes(missing_path, "".join(f"{key}\n" for key in missing).encode())
+
+    total = covered + len(quarantined) + len(missing)
+    print(f"\n{'=' * 60}")
+    print("Coverage:")
+    print(f"  PDF files found: {total}")
+    print(f"  Converted and up to date: {covered}")
+    print(f"  Quarantined: {len(quarantined)}")
+    print(f"  Missing or stale: {len(missing)}")
+    claims_dir = out_folder / ".claims"
+    if claims_dir.exists():
+        pending = ClaimDirectory(claims_dir, "merge", ttl=0).pending()
+        print(f"  Claims never finished: {len(pending)}")
+    for entry in quarantined:
+        print(f"  ! {entry['pdf']}: {entry['reason']}")
+    if missing:
+        print(f"\nMissing files listed in: {missing_path}")
+    return len(missing)
+
+
+def main():
+    """Main entry point for the script"""
+    args = parse_args()
+    top_folder = args.input_dir
+    out_folder = args.output_dir
+    out_folder.mkdir(parents=True, exist_ok=True)
+
+    if args.merge:
+        sys.exit(1 if merge_and_verify(top_folder, out_folder) else 0)
+
+    if args.benchmark:
+        run_benchmark(top_folder, out_folder, args.benchmark, args.timeout)
+        return
+
+    # Sharded and claiming runs append to their own logs, so hosts sharing the
+    # output dir never write to the same file; everyone reads everyone's logs
+    tag_parts = []
+    if args.shard is not None:
+        tag_parts.append(f"shard-{args.shard[0]}-of-{args.shard[1]}")
+    if args.claim:
+        tag_parts.append(socket.gethostname())
+    tag = ".".join(tag_parts) or None
+
+    manifest_path = args.manifest or log_path(out_folder, MANIFEST_NAME, tag)
+    manifest = ConversionManifest(
+        manifest_path,
+        also_read=sibling_logs(out_folder, MANIFEST_NAME, manifest_path),
+    )
+    quarantine_path = args.quarantine_file or log_path(out_folder, QUARANTINE_NAME, tag)
+    quarantine = ConversionManifest(
+        quarantine_path,
+        also_read=sibling_logs(out_folder, QUARANTINE_NAME, quarantine_path),
+    )
+    metrics = ConversionMetrics(
+        args.metrics_file or log_path(out_folder, "conversion_metrics.jsonl", tag)
+    )
+    feed = None
+    if args.feed_dir is not None:
+        feed = FeedWriter(
+            args.feed_dir,
+            args.feed_docs_per_shard,
+            prefix=f"feed-{tag}" if tag else "feed",
+        )
+    claims = None
+    if args.claim:
+        claims = ClaimDirectory(
+            out_folder / ".claims",
+            owner=f"{socket.gethostname()}-{os.getpid()}",
+            ttl=args.claim_ttl,
+        )
+    start_time = time.perf_counter()
 
     # Use num_cpu - 1 workers for parallel processing
     max_workers = max(1, os.cpu_count() - 1)
-    print(f"Using {max_workers} parallel workers\n")
+    max_in_flight = max_workers * args.queue_factor
+
+    # PDFs are claimed as they are planned; a long lookahead would hoard work
+    # that idle hosts could otherwise pick up
+    lookahead = min(args.lookahead, max_in_flight) if args.claim else args.lookahead
+
+    # Walk the input tree lazily; tasks are planned only as the window needs them
+    print(f"Scanning for PDF files in: {top_folder}")
+    counts = {
+        "found": 0,
+        "skipped": 0,
+        "split": 0,
+        "quarantined": 0,
+        "claimed_elsewhere": 0,
+    }
+    split_docs = {}
+    task_stream = largest_first(
+        plan_tasks(
+            top_folder.rglob("*.pdf"),
+            top_folder,
+            out_folder,
+            manifest,
+            quarantine,
+            claims,
+            args,
+            counts,
+        ),
+        lookahead,
+    )
+
+    print(
+        f"Using {max_workers} parallel workers, at most {max_in_flight} queued tasks\n"
+    )
 
     # Process files in parallel with progress logging
-    completed = 0
-    skipped = 0
+    converted = 0
     errors = []
+    newly_quarantined = set()
 
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_pdf = {
-            executor.submit(convert_pdf_to_markdown, pdf): pdf for pdf in pdf_files
-        }
+    with ConversionPool(
+        max_workers,
+        args.max_tasks_per_child or None,
+        args.timeout,
+        top_folder,
+        out_folder,
+    ) as pool:
+        exhausted = False
+        # Page ranges of documents found too long, queued ahead of the stream
+        range_tasks = deque()
+        while True:
+            # Top up the window from the lazy task stream
+            finished = []
+            while len(pool.in_flight) < max_in_flight:
+                if range_tasks:
+                    task = range_tasks.popleft()
+                else:
+                    task = None if exhausted else next(task_stream, None)
+                if task is None:
+                    exhausted = True
+                    break
+                finished.extend(pool.submit(task))
 
-        # Process results as they complete
-        for future in as_completed(future_to_pdf):
-            completed += 1
-            result = future.result()
-
-            if result["status"] == "error":
-                errors.append(result)
-                print(
-                    f"[{completed}/{total_files}] ✗ {result['file']} - Error: {result['error']}"
-                )
-            elif result["status"] == "skipped":
-                skipped += 1
-                print(
-                    f"[{completed}/{total_files}] ⊘ {result['file']} (already exists)"
-                )
-            else:
-                print(f"[{completed}/{total_files}] ✓ {result['file']}")
+            if not finished:
+                if pool.idle():
+                    break
+                finished = pool.wait()
+
+            # Process results as they complete
+            for task, task_result in finished:
+                key = task["pdf"].relative_to(top_folder).as_posix()
+                if task_result.get("quarantine") and key not in newly_quarantined:
+                    # Keep the poisonous file out of future runs until it changes
+                    newly_quarantined.add(key)
+                    pdf_stat = task["pdf"].stat()
+                    quarantine.record(
+                        {
+                            "pdf": key,
+                            "size": pdf_stat.st_size,
+                            "mtime_ns": pdf_stat.st_mtime_ns,
+                            "reason": task_result["error"],
+                            "quarantined_at": datetime.now().isoformat(),
+                        }
+                    )
+
+                if task_result["status"] == "split":
+                    counts["split"] += 1
+                    range_tasks.extend(
+                        split_tasks(
+                            task, task_result, out_folder, args.chunk_pages, split_docs
+                        )
+                    )
+                    continue
+
+                result = collect_result(task, task_result, split_docs)
+                if result is None:
+                    continue
+                metrics.record(key, result)
+                if claims is not None:
+                    if result["status"] == "error":
+                        claims.release(key)
+                    else:
+                        claims.mark_done(key, task["pdf"].stat())
+
+                progress = converted + len(errors) + counts["skipped"] + 1
+                if result["status"] == "error":
+                    errors.append(result)
+                    print(f"[{progress}] ✗ {result['file']} - Error: {result['error']}")
+                elif result["status"] == "skipped":
+                    counts["skipped"] += 1
+                    manifest.record(result["manifest"])
+                    print(f"[{progress}] ⊘ {result['file']} (unchanged)")
+                else:
+                    converted += 1
+                    manifest.record(result["manifest"])
+                    if feed is not None:
+                        # Documents skipped as unchanged were fed by an earlier run
+                        feed.write(
+                            build_put(
+                                result["manifest"]["output"],
+                                result["markdown"],
+                                task["pdf"].stat(),
+                            )
+                        )
+                    print(f"[{progress}] ✓ {result['file']}")
+
+        respawns = pool.respawns
+
+    manifest.close()
+    quarantine.close()
+    metrics.close()
+    if feed is not None:
+        feed.close()
 
     # Summary
-    successful = completed - len(errors) - skipped
+    total_files = counts["found"]
     print(f"\n{'=' * 60}")
     print("✓ Conversion complete!")
-    print(f"  Successfully converted: {successful}/{total_files}")
-    print(f"  Skipped (already exist): {skipped}/{total_files}")
+    print(f"  PDF files found: {total_files}")
+    print(f"  Successfully converted: {converted}/{total_files}")
+    print(f"  Split into page ranges: {counts['split']}")
+    print(f"  Skipped (unchanged): {counts['skipped']}/{total_files}")
+    print(f"  Skipped (quarantined earlier): {counts['quarantined']}")
+    if args.claim:
+        print(f"  Claimed by other hosts: {counts['claimed_elsewhere']}")
+    if feed is not None:
+        print(
+            f"  Vespa feed: {feed.docs_written} documents in {len(feed.shards_written)} shards under {args.feed_dir}"
+        )
+    if respawns:
+        print(f"  Worker pool restarts after a crash or timeout: {respawns}")
     if errors:
-        print(f"  Failed: {len(errors)}")
+        print(f"  Failed: {len(errors)} ({len(newly_quarantined)} newly quarantined)")
         print("\nFailed files:")
         for error in errors:
             print(f"  - {error['file']}: {error['error']}")
+
+    metrics.print_summary(time.perf_counter() - start_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+rank-profile query-embeddings {
+        # Returns the embedded query tensors instead of ranking documents, so
+        # eval clients can cache them (see eval/embedding_cache.py). Query it
+        # with `where true` and hits=1.
+        inputs {
+            query(embedding) tensor<int8>(x[96])
+            query(float_embedding) tensor<float>(x[768])
+        }
+
+        first-phase {
+            expression: 0
+        }
+
+        summary-features {
+            query(embedding)
+            query(float_embedding)
+        }
+    }
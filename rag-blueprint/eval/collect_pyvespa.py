@@ -1,5 +1,4 @@
 # Copyright Vespa.ai. Licensed under the terms of the Apache 2.0 license. See LICENSE in the project root.
-from vespa.application import Vespa
 from vespa.evaluation import VespaFeatureCollector
 import vespa.querybuilder as qb
 from typing import Dict, Any
@@ -8,6 +7,9 @@ import logging
 from pathlib import Path
 import argparse
 
+from embedding_cache import open_embedding_cache, with_cached_embeddings
+from query_runner import PooledVespa
+
 
 def feature_collection_second_phase_query_fn(
     query_text: str, top_k: int = 10, query_id: str = None
@@ -160,12 +162,24 @@ def main(args):
         logging.info(f"Generated collector name: {args.collector_name}")
 
     logging.info(f"Connecting to Vespa at {args.vespa_url}:{args.vespa_port}")
-    app = Vespa(url=args.vespa_url, port=args.vespa_port)
+    app = PooledVespa(
+        url=args.vespa_url,
+        port=args.vespa_port,
+        concurrency=args.concurrency,
+        connections=args.connections,
+        max_retries=args.max_retries,
+        http2=not args.http1,
+    )
     function_to_use = (
         feature_collection_second_phase_query_fn
         if args.second_phase
         else feature_collection_first_phase_query_fn
     )
+    embedding_cache = open_embedding_cache(
+        args.embedding_cache, app, ids_to_text.values()
+    )
+    if embedding_cache is not None:
+        function_to_use = with_cached_embeddings(function_to_use, embedding_cache)
     feature_collector = VespaFeatureCollector(
         queries=ids_to_text,
         relevant_docs=relevant_docs,
@@ -181,6 +195,13 @@ def main(args):
         random_hits_value=1,
     )
     results = feature_collector.collect()
+    logging.info(f"Query runner: {app.runner.latency_summary()}")
+    if embedding_cache is not None:
+        logging.info(
+            f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses"
+        )
+        embedding_cache.close()
+    app.close()
     return results
 
 
@@ -215,6 +236,36 @@ if __name__ == "__main__":
     parser.add_argument(
         "--vespa_port", type=int, default=8080, help="Vespa application port."
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=32,
+        help="Maximum number of queries in flight.",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help="Number of pooled HTTP/2 connections to Vespa.",
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="Retries per query after transport errors, 429 or 5xx.",
+    )
+    parser.add_argument(
+        "--http1",
+        action="store_true",
+        default=False,
+        help="Query over HTTP/1.1 instead of HTTP/2, e.g. against query_runner.py's MockVespa.",
+    )
+    parser.add_argument(
+        "--embedding_cache",
+        type=str,
+        default=None,
+        help="SQLite file caching query embeddings, so repeated runs skip the embedder.",
+    )
     parser.add_argument(
         "--collector_name",
         type=str,
@@ -0,0 +1,287 @@
+# Copyright Vespa.ai. Licensed under the terms of the Apache 2.0 license. See LICENSE in the project root.
+"""
+Client-side cache of query embeddings for the eval scripts.
+
+The query functions ask Vespa to embed the query text for every request
+(`"input.query(embedding)": "embed(...)"`, and again for
+`query(float_embedding)`), so each sweep over queries.json runs the
+ModernBERT embedder once or twice per query. With the cache, each query
+text is embedded once per embedder:
+
+- `QueryEmbeddingCache.fill` fetches missing embeddings through the
+  `query-embeddings` rank profile, which returns the query tensors as
+  summary features (one `where true` query with hits=1 per text)
+- Tensors are persisted in SQLite keyed by (embedder, query text): the
+  float tensor and the packed-binary int8 tensor
+- `with_cached_embeddings` wraps a query function and replaces the
+  `embed(...)` inputs of cached texts with literal tensors
+
+The embedder key is the component id plus a digest of the component's
+configuration in app/services.xml (model and tokenizer URLs, prepended
+instructions, max tokens), so swapping the model invalidates the cache.
+"""
+
+import functools
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from vespa.application import Vespa
+
+# Embedder component in app/services.xml
+DEFAULT_EMBEDDER_ID = "nomicmb"
+SERVICES_XML = Path(__file__).parent.parent / "app" / "services.xml"
+
+# Query inputs filled by the embedder, and the tensor each one receives
+EMBEDDING_INPUTS = {
+    "input.query(embedding)": "binary",
+    "input.query(float_embedding)": "float",
+}
+
+EMBED_PATTERN = re.compile(r"^embed\((.*)\)$", re.DOTALL)
+QUOTED_PATTERN = re.compile(r'^"(.*)"$', re.DOTALL)
+
+
+def embeddings_query(query_text: str) -> Dict:
+    """Query body that returns the embeddings of a text as summary features"""
+    return {
+        "yql": "select * from doc where true",
+        "hits": 1,
+        "ranking": "query-embeddings",
+        "input.query(embedding)": f"embed({query_text})",
+        "input.query(float_embedding)": f"embed({query_text})",
+        "presentation.summary": "no-chunks",
+        "presentation.format.tensors": "short-value",
+    }
+
+
+def embedded_text(value: str, embedder_id: str) -> Optional[str]:
+    """
+    Text that an `embed(...)` query input asks an embedder for.
+
+    Args:
+        value: The query input, e.g. `embed(text)`, `embed("text")` or
+            `embed(<embedder id>, text)`.
+        embedder_id: The only id recognised before the first comma, so a
+            text like "Anemia, iron deficiency" is not split.
+
+    Returns:
+        The text, or None if the input is not an embed() call.
+    """
+    match = EMBED_PATTERN.match(value)
+    if match is None:
+        return None
+    argument = match.group(1)
+    prefix = re.match(rf"{re.escape(embedder_id)}\s*,\s*", argument)
+    if prefix is not None:
+        argument = argument[prefix.end() :]
+    quoted = QUOTED_PATTERN.match(argument)
+    return quoted.group(1) if quoted is not None else argument
+
+
+def embedder_fingerprint(embedder_id: str, services_xml: Path = SERVICES_XML) -> str:
+    """
+    Digest of an embedder component's configuration in services.xml.
+
+    Args:
+        embedder_id: The component id.
+        services_xml: The application's services.xml.
+
+    Returns:
+        The first 16 hex digits of the SHA-256 of the canonicalised component.
+    """
+    for component in ET.parse(services_xml).getroot().iter("component"):
+        if component.get("id") == embedder_id:
+            component.tail = None
+            canonical = ET.canonicalize(ET.tostring(component), strip_text=True)
+            return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+    raise ValueError(f"No component {embedder_id!r} in {services_xml}")
+
+
+def tensor_values(feature) -> List[float]:
+    """Values of an indexed tensor summary feature, in short or verbose form"""
+    if isinstance(feature, dict):
+        feature = feature.get("values", feature.get("cells"))
+    if feature and isinstance(feature[0], dict):
+        return [cell["value"] for cell in feature]
+    return list(feature)
+
+
+def tensor_literal(values: Iterable) -> str:
+    """Short-form literal of an indexed tensor, as accepted by the query API"""
+    # Float32 values round-trip with 9 significant digits
+    return "[" + ",".join(f"{value:.9g}" for value in values) + "]"
+
+
+class QueryEmbeddingCache:
+    """
+    SQLite cache of query tensors keyed by (embedder, query text).
+
+    Args:
+        path: SQLite file; it and its directory are created if missing.
+        embedder_id: The embedder component the tensors are from.
+        services_xml: services.xml declaring the component; its configuration
+            is part of the key. None keys on the component id alone.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        embedder_id: str = DEFAULT_EMBEDDER_ID,
+        services_xml: Optional[Path] = SERVICES_XML,
+    ):
+        self.path = path
+        self.embedder_id = embedder_id
+        self.embedder_key = embedder_id
+        if services_xml is not None:
+            fingerprint = embedder_fingerprint(embedder_id, services_xml)
+            self.embedder_key = f"{embedder_id}:{fingerprint}"
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                embedder TEXT NOT NULL,
+                query_text TEXT NOT NULL,
+                binary_embedding BLOB NOT NULL,
+                float_embedding BLOB NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (embedder, query_text)
+            )
+            """
+        )
+        self.conn.commit()
+        self._memory = {}
+
+    def get(self, query_text: str) -> Optional[Tuple[array, array]]:
+        """Packed-binary (int8) and float tensors of a text, if cached"""
+        if query_text in self._memory:
+            return self._memory[query_text]
+        row = self.conn.execute(
+            "SELECT binary_embedding, float_embedding FROM query_embeddings"
+            " WHERE embedder = ? AND query_text = ?",
+            (self.embedder_key, query_text),
+        ).fetchone()
+        if row is None:
+            return None
+        tensors = (array("b", row[0]), array("f", row[1]))
+        self._memory[query_text] = tensors
+        return tensors
+
+    def lookup(self, query_text: str) -> Optional[Tuple[array, array]]:
+        """Like get, but counted in hits and misses; safe across threads"""
+        tensors = self.get(query_text)
+        with self._stats_lock:
+            if tensors is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return tensors
+
+    def put(self, query_text: str, binary: Iterable[int], floats: Iterable[float]):
+        tensors = (array("b", map(int, binary)), array("f", floats))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?, ?)",
+            (
+                self.embedder_key,
+                query_text,
+                tensors[0].tobytes(),
+                tensors[1].tobytes(),
+                datetime.now().isoformat(),
+            ),
+        )
+        self._memory[query_text] = tensors
+
+    def fill(self, app: Vespa, query_texts: Iterable[str]) -> int:
+        """
+        Embed the texts that are not cached yet, through the Vespa embedder.
+
+        Args:
+            app: The Vespa application (its `query_many` is used, so a
+                PooledVespa sends the requests concurrently).
+            query_texts: Texts to make available.
+
+        Returns:
+            Number of texts embedded.
+        """
+        missing = sorted({text for text in query_texts if self.get(text) is None})
+        if not missing:
+            return 0
+        logging.info(f"Embedding {len(missing)} uncached query texts")
+        responses = app.query_many([embeddings_query(text) for text in missing])
+        embedded = 0
+        for text, response in zip(missing, responses, strict=True):
+            hits = response.hits if response.status_code == 200 else []
+            if not hits:
+                logging.warning(f"No embeddings returned for query: {text[:80]}")
+                continue
+            features = hits[0]["fields"]["summaryfeatures"]
+            self.put(
+                text,
+                tensor_values(features["query(embedding)"]),
+                tensor_values(features["query(float_embedding)"]),
+            )
+            embedded += 1
+        self.conn.commit()
+        return embedded
+
+    def close(self):
+        self.conn.close()
+
+
+def with_cached_embeddings(
+    query_fn: Callable[..., Dict], cache: QueryEmbeddingCache
+) -> Callable[..., Dict]:
+    """
+    Wrap a query function so cached embeddings are sent as literal tensors.
+
+    Inputs of the wrapped function's body that ask the cache's embedder for
+    a cached text (see embedded_text) are replaced; everything else,
+    including uncached texts, is left to Vespa. Query functions may be called
+    from several threads.
+    """
+
+    # wraps() keeps the signature pyvespa inspects for the query_id parameter
+    @functools.wraps(query_fn)
+    def cached_query_fn(query_text: str, *args, **kwargs) -> Dict:
+        body = query_fn(query_text, *args, **kwargs)
+        for name, tensor in EMBEDDING_INPUTS.items():
+            value = body.get(name)
+            text = (
+                embedded_text(value, cache.embedder_id)
+                if isinstance(value, str)
+                else None
+            )
+            if text is None:
+                continue
+            tensors = cache.lookup(text)
+            if tensors is None:
+                continue
+            body[name] = tensor_literal(
+                tensors[0] if tensor == "binary" else tensors[1]
+            )
+        return body
+
+    return cached_query_fn
+
+
+def open_embedding_cache(
+    path: Optional[Union[str, Path]], app: Vespa, query_texts: Iterable[str]
+) -> Optional[QueryEmbeddingCache]:
+    """Open the cache at `path` (None: caching disabled) and fill it"""
+    if not path:
+        return None
+    cache = QueryEmbeddingCache(Path(path))
+    cache.fill(app, query_texts)
+    return cache
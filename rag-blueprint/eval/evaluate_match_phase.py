@@ -1,110 +1,364 @@
 # Copyright Vespa.ai. Licensed under the terms of the Apache 2.0 license. See LICENSE in the project root.
 from vespa.evaluation import VespaMatchEvaluator
-from vespa.application import Vespa
 import vespa.querybuilder as qb
+import argparse
+import itertools
 import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from embedding_cache import open_embedding_cache, with_cached_embeddings
+from query_runner import PooledVespa
 
 SCHEMA_NAME = "doc"
-VESPA_URL = "http://localhost:8080"
-QUERY_FILE = Path(__file__).parent.parent / "queries" / "queries.json"
+STRATEGIES = ["semantic", "weakand", "hybrid"]
+# Strategies whose match phase includes nearestNeighbor, so targetHits and
+# hnsw.exploreAdditionalHits apply
+NEAREST_NEIGHBOR_STRATEGIES = {"semantic", "hybrid"}
 
+TABLE_COLUMNS = [
+    "config",
+    "match_recall",
+    "avg_recall_per_query",
+    "avg_matched_per_query",
+    "searchtime_avg",
+    "searchtime_q90",
+    "wall_seconds",
+]
 
-def match_weakand_query_fn(query_text: str, top_k: int) -> dict:
-    return {
-        "yql": str(qb.select("*").from_(SCHEMA_NAME).where(qb.userQuery(query_text))),
-        "query": query_text,
-        "ranking": "match-only",
-        "input.query(embedding)": f"embed({query_text})",
-        "presentation.summary": "no-chunks",
-    }
 
+def nearest_neighbor_condition(target_hits: int, explore_additional_hits: int):
+    annotations = {"targetHits": target_hits}
+    if explore_additional_hits:
+        annotations["hnsw.exploreAdditionalHits"] = explore_additional_hits
+    return qb.nearestNeighbor(
+        field="title_embedding",
+        query_vector="embedding",
+        annotations=annotations,
+    ) | qb.nearestNeighbor(
+        field="chunk_embeddings",
+        query_vector="embedding",
+        annotations=annotations,
+    )
 
-def match_hybrid_query_fn(query_text: str, top_k: int) -> dict:
-    return {
-        "yql": str(
-            qb.select("*")
-            .from_(SCHEMA_NAME)
-            .where(
-                qb.nearestNeighbor(
-                    field="title_embedding",
-                    query_vector="embedding",
-                    annotations={"targetHits": 100},
-                )
-                | qb.nearestNeighbor(
-                    field="chunk_embeddings",
-                    query_vector="embedding",
-                    annotations={"targetHits": 100},
-                )
-                | qb.userQuery(
-                    query_text,
-                )
-            )
-        ),
-        "query": query_text,
-        "ranking": "match-only",
-        "input.query(embedding)": f"embed({query_text})",
-        "presentation.summary": "no-chunks",
-    }
 
+def make_match_query_fn(
+    strategy: str, target_hits: int = 100, explore_additional_hits: int = 0
+) -> Callable[[str, int], dict]:
+    """
+    Create a match-phase query function for one strategy and its parameters.
 
-def match_semantic_query_fn(query_text: str, top_k: int) -> dict:
-    return {
-        "yql": str(
-            qb.select("*")
-            .from_(SCHEMA_NAME)
-            .where(
-                qb.nearestNeighbor(
-                    field="title_embedding",
-                    query_vector="embedding",
-                    annotations={"targetHits": 100},
-                )
-                | qb.nearestNeighbor(
-                    field="chunk_embeddings",
-                    query_vector="embedding",
-                    annotations={"targetHits": 100},
-                )
-            )
-        ),
-        "query": query_text,
-        "ranking": "match-only",
-        "input.query(embedding)": f"embed({query_text})",
-        "presentation.summary": "no-chunks",
-    }
+    Args:
+        strategy: "semantic" (nearestNeighbor), "weakand" (userQuery) or
+            "hybrid" (both).
+        target_hits: targetHits of the nearestNeighbor operators.
+        explore_additional_hits: hnsw.exploreAdditionalHits of the
+            nearestNeighbor operators (0: Vespa's default).
+
+    Returns:
+        A query function for VespaMatchEvaluator.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown match strategy: {strategy}")
+
+    def match_query_fn(query_text: str, top_k: int) -> dict:
+        if strategy == "weakand":
+            condition = qb.userQuery(query_text)
+        elif strategy == "semantic":
+            condition = nearest_neighbor_condition(target_hits, explore_additional_hits)
+        else:
+            condition = nearest_neighbor_condition(
+                target_hits, explore_additional_hits
+            ) | qb.userQuery(query_text)
+        return {
+            "yql": str(qb.select("*").from_(SCHEMA_NAME).where(condition)),
+            "query": query_text,
+            "ranking": "match-only",
+            "input.query(embedding)": f"embed({query_text})",
+            "presentation.summary": "no-chunks",
+        }
+
+    match_query_fn.__name__ = f"match_{strategy}_query_fn"
+    return match_query_fn
 
 
-app = Vespa(VESPA_URL)
+match_semantic_query_fn = make_match_query_fn("semantic")
+match_weakand_query_fn = make_match_query_fn("weakand")
+match_hybrid_query_fn = make_match_query_fn("hybrid")
 
-with open(QUERY_FILE, "r") as f:
-    queries = json.load(f)
 
-ids_to_query = {query["query_id"]: query["query_text"] for query in queries}
-relevant_docs = {
-    query["query_id"]: set(query["relevant_document_ids"])
-    for query in queries
-    if "relevant_document_ids" in query
-}
+def sweep_configs(
+    strategies: List[str],
+    target_hits: List[int],
+    explore_additional_hits: List[int],
+) -> List[Dict]:
+    """
+    Expand the grid of strategies x targetHits x exploreAdditionalHits.
 
-match_results = {}
-for evaluator_name, query_fn in [
-    ("semantic", match_semantic_query_fn),
-    ("weakand", match_weakand_query_fn),
-    ("hybrid", match_hybrid_query_fn),
-]:
-    print(f"Evaluating {evaluator_name}...")
+    The nearestNeighbor parameters do not apply to weakand, so it is
+    evaluated once instead of once per grid point.
+    """
+    configs = []
+    seen = set()
+    for strategy, hits, explore in itertools.product(
+        strategies, target_hits, explore_additional_hits
+    ):
+        if strategy not in NEAREST_NEIGHBOR_STRATEGIES:
+            hits, explore = None, None
+        if (strategy, hits, explore) in seen:
+            continue
+        seen.add((strategy, hits, explore))
+        name = strategy if hits is None else f"{strategy}-th{hits}-ex{explore}"
+        configs.append(
+            {
+                "config": name,
+                "strategy": strategy,
+                "target_hits": hits,
+                "explore_additional_hits": explore,
+            }
+        )
+    return configs
+
+
+def evaluate_config(
+    config: Dict,
+    app: PooledVespa,
+    ids_to_query: Dict[str, str],
+    relevant_docs: Dict[str, set],
+    embedding_cache,
+    write_verbose: bool,
+) -> Dict:
+    """Run VespaMatchEvaluator for one configuration and return its table row"""
+    query_fn = make_match_query_fn(
+        config["strategy"],
+        config["target_hits"] or 0,
+        config["explore_additional_hits"] or 0,
+    )
+    if embedding_cache is not None:
+        query_fn = with_cached_embeddings(query_fn, embedding_cache)
 
+    logging.info(f"Evaluating {config['config']}...")
+    start = time.perf_counter()
     match_evaluator = VespaMatchEvaluator(
         queries=ids_to_query,
         relevant_docs=relevant_docs,
         vespa_query_fn=query_fn,
         app=app,
-        name="test-run",
+        name=config["config"],
         id_field="id",
-        write_csv=True,
-        write_verbose=True,  # optionally write verbose metrics to CSV
+        write_csv=False,
+        write_verbose=write_verbose,
     )
-
     results = match_evaluator()
-    match_results[evaluator_name] = results
-    print(f"Results for {evaluator_name}:")
-    print(results)
+    return config | results | {"wall_seconds": time.perf_counter() - start}
+
+
+def cheapest_config(table: pd.DataFrame, recall_tolerance: float) -> Optional[Dict]:
+    """
+    The configuration matching the fewest documents (then the fastest)
+    whose match recall is within `recall_tolerance` of the best one.
+    """
+    if table.empty:
+        return None
+    best_recall = table["match_recall"].max()
+    candidates = table[table["match_recall"] >= best_recall - recall_tolerance]
+    return (
+        candidates.sort_values(["avg_matched_per_query", "searchtime_avg"])
+        .iloc[0]
+        .to_dict()
+    )
+
+
+def main(args):
+    dataset_path = Path(args.dataset_dir)
+    queries_path = dataset_path / args.queries_filename
+
+    # Validate file exists
+    if not queries_path.exists():
+        raise FileNotFoundError(f"Queries file not found: {queries_path}")
+
+    logging.info(f"Loading queries from: {queries_path}")
+    with open(queries_path, "r") as f:
+        queries = json.load(f)
+
+    ids_to_query = {query["query_id"]: query["query_text"] for query in queries}
+    relevant_docs = {
+        query["query_id"]: set(query["relevant_document_ids"])
+        for query in queries
+        if "relevant_document_ids" in query
+    }
+
+    logging.info(f"Connecting to Vespa at {args.vespa_url}:{args.vespa_port}")
+    # All configurations share the runner's concurrency limit
+    app = PooledVespa(
+        url=args.vespa_url,
+        port=args.vespa_port,
+        concurrency=args.concurrency,
+        connections=args.connections,
+        max_retries=args.max_retries,
+        http2=not args.http1,
+    )
+    embedding_cache = open_embedding_cache(
+        args.embedding_cache, app, ids_to_query.values()
+    )
+
+    configs = sweep_configs(
+        args.strategies, args.target_hits, args.explore_additional_hits
+    )
+    logging.info(
+        f"Evaluating {len(configs)} configurations, {args.parallel_configs} at a time"
+    )
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.parallel_configs) as executor:
+        rows = list(
+            executor.map(
+                lambda config: evaluate_config(
+                    config,
+                    app,
+                    ids_to_query,
+                    relevant_docs,
+                    embedding_cache,
+                    args.write_verbose,
+                ),
+                configs,
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    table = pd.DataFrame(rows).sort_values(
+        ["avg_matched_per_query", "match_recall"], ascending=[True, False]
+    )
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    csv_path = (
+        output_dir / f"match_phase_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    )
+    table.to_csv(csv_path, index=False)
+
+    print(table[TABLE_COLUMNS].to_string(index=False, float_format="{:.4f}".format))
+    cheapest = cheapest_config(table, args.recall_tolerance)
+    if cheapest is not None:
+        print(
+            f"\nCheapest configuration within {args.recall_tolerance} of the best "
+            f"recall: {cheapest['config']} (recall {cheapest['match_recall']:.4f}, "
+            f"{cheapest['avg_matched_per_query']:.1f} matched per query)"
+        )
+    print(f"Sweep took {elapsed:.1f}s; table written to {csv_path}")
+    logging.info(f"Query runner: {app.runner.latency_summary()}")
+    if embedding_cache is not None:
+        embedding_cache.close()
+    app.close()
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweep match-phase configurations using VespaMatchEvaluator."
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default=str(Path(__file__).parent.parent / "queries"),
+        help="Directory containing the queries JSON file.",
+    )
+    parser.add_argument(
+        "--queries_filename",
+        type=str,
+        default="queries.json",
+        help="Filename of the JSON file containing queries.",
+    )
+    parser.add_argument(
+        "--vespa_url",
+        type=str,
+        default="http://localhost",
+        help="Vespa application URL.",
+    )
+    parser.add_argument(
+        "--vespa_port", type=int, default=8080, help="Vespa application port."
+    )
+    parser.add_argument(
+        "--strategies",
+        type=str,
+        nargs="+",
+        choices=STRATEGIES,
+        default=STRATEGIES,
+        help="Match strategies to evaluate.",
+    )
+    parser.add_argument(
+        "--target_hits",
+        type=int,
+        nargs="+",
+        default=[100],
+        help="targetHits values of the nearestNeighbor operators.",
+    )
+    parser.add_argument(
+        "--explore_additional_hits",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="hnsw.exploreAdditionalHits values of the nearestNeighbor operators (0: Vespa's default).",
+    )
+    parser.add_argument(
+        "--parallel_configs",
+        type=int,
+        default=4,
+        help="Number of configurations evaluated at the same time.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=32,
+        help="Maximum number of queries in flight, over all configurations.",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help="Number of pooled HTTP/2 connections to Vespa.",
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="Retries per query after transport errors, 429 or 5xx.",
+    )
+    parser.add_argument(
+        "--http1",
+        action="store_true",
+        default=False,
+        help="Query over HTTP/1.1 instead of HTTP/2, e.g. against query_runner.py's MockVespa.",
+    )
+    parser.add_argument(
+        "--embedding_cache",
+        type=str,
+        default=None,
+        help="SQLite file caching query embeddings, so repeated runs skip the embedder.",
+    )
+    parser.add_argument(
+        "--recall_tolerance",
+        type=float,
+        default=0.0,
+        help="Recall a configuration may lose against the best one and still be picked as the cheapest.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=str(Path(__file__).parent / "output"),
+        help="Directory receiving the sweep table as CSV.",
+    )
+    parser.add_argument(
+        "--write_verbose",
+        action="store_true",
+        default=False,
+        help="Write pyvespa's per-query CSV for every configuration.",
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    main(args)
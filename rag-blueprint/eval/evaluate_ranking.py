@@ -1,12 +1,14 @@
 # Copyright Vespa.ai. Licensed under the terms of the Apache 2.0 license. See LICENSE in the project root.
 from vespa.evaluation import VespaEvaluator
-from vespa.application import Vespa
 import vespa.querybuilder as qb
 import json
 from pathlib import Path
 import argparse
 import logging
 
+from embedding_cache import open_embedding_cache, with_cached_embeddings
+from query_runner import PooledVespa
+
 SCHEMA_NAME = "doc"
 
 # match_avg_top_3_chunk_sim_scores   : 13.383840
@@ -108,11 +110,23 @@ def main(args):
     }
 
     logging.info(f"Connecting to Vespa at {args.vespa_url}:{args.vespa_port}")
-    app = Vespa(url=args.vespa_url, port=args.vespa_port)
+    app = PooledVespa(
+        url=args.vespa_url,
+        port=args.vespa_port,
+        concurrency=args.concurrency,
+        connections=args.connections,
+        max_retries=args.max_retries,
+        http2=not args.http1,
+    )
 
     function_to_use = (
         rank_second_phase_query_fn if args.second_phase else rank_first_phase_query_fn
     )
+    embedding_cache = open_embedding_cache(
+        args.embedding_cache, app, ids_to_query.values()
+    )
+    if embedding_cache is not None:
+        function_to_use = with_cached_embeddings(function_to_use, embedding_cache)
 
     match_evaluator = VespaEvaluator(
         queries=ids_to_query,
@@ -126,6 +140,13 @@ def main(args):
     )
 
     results = match_evaluator()
+    logging.info(f"Query runner: {app.runner.latency_summary()}")
+    if embedding_cache is not None:
+        logging.info(
+            f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses"
+        )
+        embedding_cache.close()
+    app.close()
     print(results)
     return results
 
@@ -161,6 +182,36 @@ if __name__ == "__main__":
     parser.add_argument(
         "--vespa_port", type=int, default=8080, help="Vespa application port."
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=32,
+        help="Maximum number of queries in flight.",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help="Number of pooled HTTP/2 connections to Vespa.",
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="Retries per query after transport errors, 429 or 5xx.",
+    )
+    parser.add_argument(
+        "--http1",
+        action="store_true",
+        default=False,
+        help="Query over HTTP/1.1 instead of HTTP/2, e.g. against query_runner.py's MockVespa.",
+    )
+    parser.add_argument(
+        "--embedding_cache",
+        type=str,
+        default=None,
+        help="SQLite file caching query embeddings, so repeated runs skip the embedder.",
+    )
     parser.add_argument(
         "--evaluator_name",
         type=str,
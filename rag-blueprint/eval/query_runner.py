@@ -0,0 +1,468 @@
+# Copyright Vespa.ai. Licensed under the terms of the Apache 2.0 license. See LICENSE in the project root.
+"""
+Shared query runner for the eval scripts.
+
+pyvespa's evaluators and collectors send their queries through
+`app.query_many`, which opens a new client (one connection) per call and
+retries on its own schedule. `PooledVespa` replaces that with one
+`AsyncQueryRunner` per application:
+
+- A long-lived `httpx.AsyncClient` with HTTP/2 and a keep-alive connection
+  pool, running on a background event loop, so connections are reused across
+  evaluators and calls
+- A concurrency limit shared by every caller (including several threads)
+- Retries with exponential backoff on transport errors, 429 and 5xx
+
+`MockVespa` serves a local `/search/` endpoint with configurable latency and
+failure rate, so the runner can be exercised without a Vespa instance:
+
+    python query_runner.py --mock --num_queries 2000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from vespa.application import Vespa
+from vespa.io import VespaQueryResponse
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+class AsyncQueryRunner:
+    """
+    Sends Vespa queries concurrently over a pooled HTTP connection.
+
+    The client and its connections live on a background event loop, so the
+    runner can be called from synchronous code, from several threads, and
+    from notebooks that already run an event loop.
+
+    Args:
+        search_url: The /search/ endpoint of the Vespa application.
+        concurrency: Maximum number of queries in flight, over all callers.
+        connections: Size of the connection pool. With HTTP/2 every
+            connection multiplexes many queries; over HTTP/1.1 the pool
+            grows to `concurrency`, one query per connection.
+        max_retries: Retries per query after transport errors, 429 or 5xx.
+        timeout: Request timeout in seconds.
+        http2: Use HTTP/2 (prior knowledge on plain http, as pyvespa does).
+            Disable for HTTP/1.1-only endpoints such as `MockVespa` (the
+            eval scripts' --http1); a prior-knowledge HTTP/2 client cannot
+            talk to them at all.
+        headers: Headers sent with every request (e.g. authorization).
+        cert: Client certificate for mTLS.
+        key: Client key for mTLS.
+    """
+
+    def __init__(
+        self,
+        search_url: str,
+        concurrency: int = 32,
+        connections: int = 4,
+        max_retries: int = 3,
+        timeout: float = 30.0,
+        http2: bool = True,
+        headers: Optional[Dict[str, str]] = None,
+        cert: Optional[str] = None,
+        key: Optional[str] = None,
+    ):
+        self.search_url = search_url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.stats = {"queries": 0, "retries": 0, "failures": 0, "latencies": []}
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="query-runner", daemon=True
+        )
+        self._thread.start()
+        if not http2:
+            connections = max(connections, concurrency)
+
+        async def open_client():
+            self._semaphore = asyncio.Semaphore(concurrency)
+            return httpx.AsyncClient(
+                http1=not http2,
+                http2=http2,
+                timeout=httpx.Timeout(timeout),
+                limits=httpx.Limits(
+                    max_connections=connections,
+                    max_keepalive_connections=connections,
+                ),
+                headers=headers,
+                verify=httpx.create_ssl_context(cert=(cert, key)) if cert else True,
+            )
+
+        self._client = self._run(open_client())
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _query(
+        self, body: Dict[str, Any], params: Dict[str, Any]
+    ) -> VespaQueryResponse:
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    response = await self._client.post(
+                        self.search_url, json=body, params=params
+                    )
+                except httpx.TransportError as e:
+                    if attempt == self.max_retries:
+                        self.stats["failures"] += 1
+                        return VespaQueryResponse(
+                            json={"error": repr(e)},
+                            status_code=599,
+                            url=self.search_url,
+                            request_body=body,
+                        )
+                else:
+                    if (
+                        response.status_code not in RETRY_STATUS_CODES
+                        or attempt == self.max_retries
+                    ):
+                        self.stats["queries"] += 1
+                        self.stats["latencies"].append(time.perf_counter() - start)
+                        if response.status_code != 200:
+                            self.stats["failures"] += 1
+                        try:
+                            content = response.json()
+                        except ValueError:
+                            content = {"error": response.text}
+                        return VespaQueryResponse(
+                            json=content,
+                            status_code=response.status_code,
+                            url=str(response.url),
+                            request_body=body,
+                        )
+                self.stats["retries"] += 1
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, 0.1 * 2**attempt))
+
+    async def _query_all(
+        self, bodies: List[Dict[str, Any]], params: Dict[str, Any]
+    ) -> List[VespaQueryResponse]:
+        return await asyncio.gather(*(self._query(body, params) for body in bodies))
+
+    def query_many(
+        self, bodies: Iterable[Dict[str, Any]], **params
+    ) -> List[VespaQueryResponse]:
+        """Send all query bodies and return their responses in order"""
+        return self._run(self._query_all(list(bodies), params))
+
+    def latency_summary(self) -> Dict[str, float]:
+        """Count and percentiles (ms) of the request latencies so far"""
+        latencies = sorted(self.stats["latencies"])
+        if not latencies:
+            return {}
+
+        def percentile(p: float) -> float:
+            return 1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "queries": self.stats["queries"],
+            "retries": self.stats["retries"],
+            "failures": self.stats["failures"],
+            "latency_p50_ms": percentile(0.50),
+            "latency_p90_ms": percentile(0.90),
+            "latency_p99_ms": percentile(0.99),
+        }
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PooledVespa(Vespa):
+    """
+    Vespa application whose queries go through a shared AsyncQueryRunner.
+
+    Drop-in replacement for `Vespa` in the evaluators and collectors: their
+    `query_many` calls (and single `query` calls) use the runner's pooled
+    connections, concurrency limit and retries.
+
+    Args:
+        url: Vespa application URL.
+        port: Vespa application port.
+        concurrency, connections, max_retries, timeout, http2: See
+            AsyncQueryRunner.
+        **kwargs: Further arguments of `Vespa` (cert, key,
+            vespa_cloud_secret_token, ...).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        port: Optional[int] = None,
+        concurrency: int = 32,
+        connections: int = 4,
+        max_retries: int = 3,
+        timeout: float = 30.0,
+        http2: bool = True,
+        **kwargs,
+    ):
+        super().__init__(url=url, port=port, **kwargs)
+        self.runner = AsyncQueryRunner(
+            self.search_end_point,
+            concurrency=concurrency,
+            connections=connections,
+            max_retries=max_retries,
+            timeout=timeout,
+            http2=http2,
+            headers=self.base_headers,
+            cert=self.cert,
+            key=self.key,
+        )
+
+    def query_many(
+        self, queries: Iterable[Dict], *args, **query_kwargs
+    ) -> List[VespaQueryResponse]:
+        # pyvespa's connection and concurrency arguments are superseded by the
+        # runner's settings
+        for name in ("num_connections", "max_concurrent", "client_kwargs"):
+            query_kwargs.pop(name, None)
+        return self.runner.query_many(queries, **query_kwargs)
+
+    def query(
+        self, body: Optional[Dict] = None, groupname: str | None = None, **kwargs
+    ) -> VespaQueryResponse:
+        if groupname:
+            kwargs["streaming.groupname"] = groupname
+        return self.runner.query_many([body or {}], **kwargs)[0]
+
+    def close(self):
+        self.runner.close()
+
+
+class MockVespa:
+    """
+    Local stand-in for a Vespa /search/ endpoint (HTTP/1.1).
+
+    Every query returns `hits` documents whose ids depend only on the query
+    text, after `latency` seconds; a `failure_rate` share of requests fail
+    with 503 to exercise retries. The `query-embeddings` rank profile returns
+    pseudo-embeddings as summary features, and `embed_calls` counts the
+    `embed(...)` inputs received. `requests` counts all requests, and
+    `max_in_flight` is the most requests seen being served at once.
+    """
+
+    def __init__(
+        self,
+        hits: int = 10,
+        latency: float = 0.02,
+        failure_rate: float = 0.0,
+        port: int = 0,
+    ):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock._lock:
+                    mock.requests += 1
+                    mock.in_flight += 1
+                    mock.max_in_flight = max(mock.max_in_flight, mock.in_flight)
+                time.sleep(latency)
+                with mock._lock:
+                    mock.in_flight -= 1
+                if random.random() < failure_rate:
+                    self._reply(503, {"root": {"errors": [{"message": "overloaded"}]}})
+                    return
+                self._reply(200, mock.response_for(body))
+
+            def _reply(self, status: int, content: Dict):
+                payload = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            # The default backlog of 5 refuses bursts of new connections
+            request_queue_size = 256
+
+        self.hits = hits
+        self.embed_calls = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.server = Server(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def response_for(self, body: Dict) -> Dict:
+        query_text = body.get("query", "")
+        embed_inputs = [
+            value
+            for name, value in body.items()
+            if name.startswith("input.") and str(value).startswith("embed(")
+        ]
+        with self._lock:
+            self.embed_calls += len(embed_inputs)
+        if body.get("ranking") == "query-embeddings":
+            query_text = embed_inputs[0][len("embed(") : -1]
+        seed = int(hashlib.md5(query_text.encode()).hexdigest()[:8], 16)
+
+        if body.get("ranking") == "query-embeddings":
+            rng = random.Random(seed)
+            features = {
+                "query(embedding)": [rng.randint(-128, 127) for _ in range(96)],
+                "query(float_embedding)": [rng.gauss(0, 1) for _ in range(768)],
+            }
+            return {
+                "root": {
+                    "fields": {"totalCount": 1},
+                    "children": [
+                        {
+                            "id": "id:doc:doc::0",
+                            "relevance": 0.0,
+                            "fields": {"id": "0", "summaryfeatures": features},
+                        }
+                    ],
+                }
+            }
+
+        children = [
+            {
+                "id": f"id:doc:doc::{(seed + rank) % 1000}",
+                "relevance": 1.0 / (rank + 1),
+                "fields": {"id": str((seed + rank) % 1000)},
+            }
+            for rank in range(self.hits)
+        ]
+        return {
+            "timing": {"searchtime": 0.001},
+            "root": {
+                "fields": {"totalCount": len(children)},
+                "coverage": {"documents": 1000},
+                "children": children,
+            },
+        }
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(args):
+    bodies = [
+        {"yql": "select * from doc where userQuery()", "query": f"query {i}"}
+        for i in range(args.num_queries)
+    ]
+
+    server = (
+        MockVespa(latency=args.mock_latency, failure_rate=args.mock_failure_rate)
+        if args.mock
+        else contextlib.nullcontext()
+    )
+    with server:
+        url = server.url if args.mock else f"{args.vespa_url}:{args.vespa_port}"
+        logging.info(f"Sending {len(bodies)} queries to {url}/search/")
+        with AsyncQueryRunner(
+            f"{url}/search/",
+            concurrency=args.concurrency,
+            connections=args.connections,
+            max_retries=args.max_retries,
+            http2=not (args.mock or args.http1),
+        ) as runner:
+            start = time.perf_counter()
+            responses = runner.query_many(bodies)
+            elapsed = time.perf_counter() - start
+            summary = runner.latency_summary()
+
+    ok = sum(response.status_code == 200 for response in responses)
+    print(f"{ok}/{len(responses)} queries succeeded in {elapsed:.2f}s")
+    print(f"Throughput: {len(responses) / elapsed:.1f} queries/s")
+    for name, value in summary.items():
+        print(
+            f"{name}: {value:.1f}" if isinstance(value, float) else f"{name}: {value}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pooled async query runner against Vespa or a local mock."
+    )
+    parser.add_argument(
+        "--mock",
+        action="store_true",
+        default=False,
+        help="Query a local mock /search/ endpoint instead of Vespa.",
+    )
+    parser.add_argument(
+        "--vespa_url",
+        type=str,
+        default="http://localhost",
+        help="Vespa application URL.",
+    )
+    parser.add_argument(
+        "--vespa_port", type=int, default=8080, help="Vespa application port."
+    )
+    parser.add_argument(
+        "--num_queries", type=int, default=1000, help="Number of queries to send."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="Maximum queries in flight."
+    )
+    parser.add_argument(
+        "--connections", type=int, default=4, help="Size of the connection pool."
+    )
+    parser.add_argument(
+        "--max_retries", type=int, default=3, help="Retries per failed query."
+    )
+    parser.add_argument(
+        "--http1",
+        action="store_true",
+        default=False,
+        help="Query over HTTP/1.1 instead of HTTP/2 (implied by --mock).",
+    )
+    parser.add_argument(
+        "--mock_latency",
+        type=float,
+        default=0.02,
+        help="Seconds the mock endpoint takes per query.",
+    )
+    parser.add_argument(
+        "--mock_failure_rate",
+        type=float,
+        default=0.0,
+        help="Share of mock requests that fail with 503.",
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # httpx logs every request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    main(args)
@@ -0,0 +1,103 @@
+# Copyright Vespa.ai. Licensed under the terms of the Apache 2.0 license. See LICENSE in the project root.
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from embedding_cache import (
+    SERVICES_XML,
+    QueryEmbeddingCache,
+    embedded_text,
+    embedder_fingerprint,
+    with_cached_embeddings,
+)
+from query_runner import MockVespa, PooledVespa
+
+
+@pytest.fixture
+def swapped_services_xml(tmp_path):
+    """services.xml with another embedder model"""
+    path = tmp_path / "services.xml"
+    path.write_text(
+        SERVICES_XML.read_text().replace(
+            "nomic-ai-modernbert-embed-base/model.onnx", "other-model/model.onnx"
+        )
+    )
+    return path
+
+
+def query_fn(query_text: str, top_k: int) -> dict:
+    return {
+        "yql": "select * from doc where true",
+        "input.query(embedding)": f"embed({query_text})",
+    }
+
+
+def test_cache_is_created_in_a_new_directory(tmp_path):
+    path = tmp_path / "new" / "dir" / "embeddings.db"
+    cache = QueryEmbeddingCache(path)
+    cache.put("query", [1, -2], [0.5, 0.25])
+    cache.conn.commit()
+    cache.close()
+
+    assert QueryEmbeddingCache(path).get("query") is not None
+
+
+def test_model_swap_invalidates_the_cache(tmp_path, swapped_services_xml):
+    assert embedder_fingerprint("nomicmb") != embedder_fingerprint(
+        "nomicmb", swapped_services_xml
+    )
+
+    path = tmp_path / "embeddings.db"
+    cache = QueryEmbeddingCache(path)
+    cache.put("query", [1, -2], [0.5, 0.25])
+    cache.conn.commit()
+    cache.close()
+
+    assert (
+        QueryEmbeddingCache(path, services_xml=swapped_services_xml).get("query")
+        is None
+    )
+    assert QueryEmbeddingCache(path).get("query") is not None
+
+
+def test_cached_texts_are_not_embedded_again(tmp_path):
+    texts = [f"query {i}" for i in range(5)]
+    with MockVespa(latency=0.0) as mock:
+        app = PooledVespa(url=mock.url, http2=False)
+        try:
+            cache = QueryEmbeddingCache(tmp_path / "embeddings.db")
+            assert cache.fill(app, texts) == len(texts)
+            embed_calls = mock.embed_calls
+            assert cache.fill(app, texts) == 0
+            assert mock.embed_calls == embed_calls
+
+            body = with_cached_embeddings(query_fn, cache)("query 0", 10)
+            assert body["input.query(embedding)"].startswith("[")
+            assert cache.hits == 1
+        finally:
+            app.close()
+
+
+@pytest.mark.parametrize(
+    "value, text",
+    [
+        ("embed(Anemia, iron deficiency)", "Anemia, iron deficiency"),
+        ('embed("Anemia, iron deficiency")', "Anemia, iron deficiency"),
+        ("embed(nomicmb, Anemia, iron deficiency)", "Anemia, iron deficiency"),
+        ('embed(nomicmb, "Anemia, iron deficiency")', "Anemia, iron deficiency"),
+        ("Anemia, iron deficiency", None),
+    ],
+)
+def test_embedded_text(value, text):
+    assert embedded_text(value, "nomicmb") == text
+
+
+def test_hits_and_misses_are_counted_across_threads(tmp_path):
+    cache = QueryEmbeddingCache(tmp_path / "embeddings.db")
+    cache.put("cached", [1, -2], [0.5, 0.25])
+    cached_query_fn = with_cached_embeddings(query_fn, cache)
+    texts = ["cached", "uncached"] * 500
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(cached_query_fn, texts, [10] * len(texts)))
+
+    assert (cache.hits, cache.misses) == (500, 500)
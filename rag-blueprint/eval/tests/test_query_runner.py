@@ -0,0 +1,131 @@
+# Copyright Vespa.ai. Licensed under the terms of the Apache 2.0 license. See LICENSE in the project root.
+import json
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import evaluate_match_phase
+from query_runner import MockVespa, PooledVespa
+
+
+def query_bodies(count: int):
+    return [
+        {"yql": "select * from doc where userQuery()", "query": f"query {i}"}
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def pooled():
+    """Open PooledVespa apps against a mock and close them after the test"""
+    apps = []
+
+    def open_app(mock: MockVespa, **kwargs) -> PooledVespa:
+        app = PooledVespa(url=mock.url, http2=False, **kwargs)
+        apps.append(app)
+        return app
+
+    yield open_app
+    for app in apps:
+        app.close()
+
+
+def test_responses_are_in_query_order(pooled):
+    with MockVespa(latency=0.0) as mock:
+        app = pooled(mock, concurrency=8)
+        bodies = query_bodies(50)
+        responses = app.query_many(bodies)
+
+        assert [response.status_code for response in responses] == [200] * 50
+        for body, response in zip(bodies, responses, strict=True):
+            expected = mock.response_for(body)["root"]["children"]
+            assert [hit["id"] for hit in response.hits] == [
+                hit["id"] for hit in expected
+            ]
+
+
+def test_single_queries_go_through_the_runner(pooled):
+    with MockVespa(latency=0.0) as mock:
+        app = pooled(mock)
+        response = app.query(body=query_bodies(1)[0])
+
+        assert response.status_code == 200
+        assert mock.requests == 1
+        assert app.runner.stats["queries"] == 1
+
+
+def test_503_is_retried(pooled):
+    with MockVespa(latency=0.0, failure_rate=0.3) as mock:
+        app = pooled(mock, max_retries=10)
+        responses = app.query_many(query_bodies(40))
+
+        assert all(response.status_code == 200 for response in responses)
+        assert app.runner.stats["retries"] > 0
+        assert mock.requests == 40 + app.runner.stats["retries"]
+
+
+def test_retries_are_bounded(pooled):
+    with MockVespa(latency=0.0, failure_rate=1.0) as mock:
+        app = pooled(mock, max_retries=2)
+        responses = app.query_many(query_bodies(5))
+
+        assert [response.status_code for response in responses] == [503] * 5
+        assert mock.requests == 5 * 3
+        assert app.runner.stats["failures"] == 5
+
+
+def test_concurrency_cap_is_shared_across_threads(pooled):
+    with MockVespa(latency=0.05) as mock:
+        app = pooled(mock, concurrency=4)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            batches = list(
+                executor.map(app.query_many, [query_bodies(12) for _ in range(3)])
+            )
+
+        assert all(
+            response.status_code == 200 for batch in batches for response in batch
+        )
+        assert mock.max_in_flight == 4
+
+
+def test_match_phase_sweep_runs_against_the_mock(tmp_path):
+    queries = [
+        {
+            "query_id": f"q{i}",
+            "query_text": f"query {i}",
+            "relevant_document_ids": [str(i)],
+        }
+        for i in range(5)
+    ]
+    (tmp_path / "queries.json").write_text(json.dumps(queries))
+    args = Namespace(
+        dataset_dir=str(tmp_path),
+        queries_filename="queries.json",
+        strategies=["semantic", "weakand"],
+        target_hits=[10, 100],
+        explore_additional_hits=[0],
+        parallel_configs=2,
+        concurrency=8,
+        connections=4,
+        max_retries=3,
+        http1=True,
+        embedding_cache=None,
+        recall_tolerance=0.0,
+        output_dir=str(tmp_path / "output"),
+        write_verbose=False,
+    )
+
+    with MockVespa(latency=0.0) as mock:
+        args.vespa_url, args.vespa_port = mock.url.rsplit(":", 1)
+        args.vespa_port = int(args.vespa_port)
+        table = evaluate_match_phase.main(args)
+
+    assert sorted(table["config"]) == [
+        "semantic-th10-ex0",
+        "semantic-th100-ex0",
+        "weakand",
+    ]
+    # Every query of every configuration was answered by the mock
+    assert list(table["avg_matched_per_query"]) == [mock.hits] * 3
+    assert list((tmp_path / "output").glob("match_phase_sweep_*.csv"))
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Structured Extraction Store Script
+
+Merges the runs of extract_structured.py into a Parquet dataset, so the
+extracted FDA510k / LabSOP records can be filtered and faceted without
+loading whole run files:
+
+    ExtractedStore/doc_type=fda/medical_specialty=Hematology/part-0.parquet
+
+Inputs, any mix of:
+- Legacy runs: one indented JSON per run with "metadata" and "results"
+- JSONL runs with their .meta.json sidecar, including the per-type outputs
+  of mixed runs (run.fda.jsonl, run.sop.jsonl)
+
+There is one row per extracted file and document type. When several runs
+(or the existing store) hold the same file, the most recent extraction
+wins, so runs can be merged in any order and re-merging is idempotent.
+
+Columns are the fields of the document type's schema plus file, run and
+extracted_at. FDA records also get decision_date, a date parsed from
+fda_decision_date, so date ranges can be filtered and sorted. Medical
+specialties are grouped case-insensitively under their most common
+spelling before they become partition directories.
+
+Query API (predicates and projections are pushed down to the Parquet
+reader, and filters on medical_specialty only open the matching partitions):
+
+    store = StructuredStore(Path("ExtractedStore/"))
+    store.query(
+        "fda",
+        columns=["file", "device_trade_name", "decision_date"],
+        where={"product_code": "DAP"},
+        date_from=date(2016, 1, 1),
+    )
+    store.facets(["medical_specialty", "product_code"], where={...})
+"""
+
+import argparse
+import json
+import shutil
+import sys
+from datetime import date, datetime
+from pathlib import Path
+from typing import get_origin
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from extraction_schemas import DOC_TYPES
+from fda_preextract import normalise_date
+
+# Document types are partitioned into separate directories because their
+# schemas differ; specialty is the facet the frontend filters on first
+PARTITION_FIELD = "medical_specialty"
+
+RUN_PATTERNS = ("*_extracted_*.json", "*_extracted_*.jsonl")
+# Sidecars of JSONL runs, which RUN_PATTERNS also match
+METADATA_SUFFIX = ".meta.json"
+
+
+def arrow_schema(doc_type: str) -> pa.Schema:
+    """Arrow schema for the records of one document type"""
+    fields = [
+        pa.field("file", pa.string(), nullable=False),
+        pa.field("run", pa.string()),
+        pa.field("extracted_at", pa.timestamp("s")),
+    ]
+    for name, field in DOC_TYPES[doc_type]["schema"].model_fields.items():
+        if name == PARTITION_FIELD:
+            continue
+        is_list = get_origin(field.annotation) is list
+        fields.append(pa.field(name, pa.list_(pa.string()) if is_list else pa.string()))
+    if doc_type == "fda":
+        fields.append(pa.field("decision_date", pa.date32()))
+    fields.append(pa.field(PARTITION_FIELD, pa.string()))
+    return pa.schema(fields)
+
+
+def parse_decision_date(value: str | None) -> date | None:
+    """fda_decision_date (ideally mm-dd-yyyy, but the model varies) as a date"""
+    normalised = normalise_date(value) if value else None
+    if normalised is None:
+        return None
+    return datetime.strptime(normalised, "%m-%d-%Y").date()
+
+
+def run_metadata(run_file: Path) -> dict:
+    """Metadata of a JSONL run, from run.meta.json (also for run.fda.jsonl)"""
+    for candidate in (
+        run_file.with_suffix(".meta.json"),
+        run_file.with_suffix("").with_suffix(".meta.json"),
+    ):
+        if candidate.exists():
+            return json.loads(candidate.read_text(encoding="utf-8"))
+    return {}
+
+
+def run_doc_type(run_file: Path, metadata: dict) -> str:
+    """Document type of a run: its partition suffix, else its metadata"""
+    suffixes = run_file.suffixes
+    if len(suffixes) >= 2 and suffixes[-2].lstrip(".") in DOC_TYPES:
+        return suffixes[-2].lstrip(".")
+    doc_type = metadata.get("document_type")
+    # Runs of undetected documents used the FDA extraction
+    return doc_type if doc_type in DOC_TYPES else "fda"
+
+
+def jsonl_results(run_file: Path):
+    """Yield the complete records of a JSONL run file"""
+    with open(run_file, encoding="utf-8") as f:
+        for line in f:
+            # A torn last line is the only damage an interrupted run can leave
+            if line.endswith("\n"):
+                yield json.loads(line)
+
+
+def iter_run_records(run_file: Path):
+    """Yield (doc_type, record) for the successful extractions of one run file"""
+    if run_file.suffix == ".json":
+        run = json.loads(run_file.read_text(encoding="utf-8"))
+        metadata = run.get("metadata", {})
+        results = run.get("results", [])
+    else:
+        metadata = run_metadata(run_file)
+        results = jsonl_results(run_file)
+
+    doc_type = run_doc_type(run_file, metadata)
+    extracted_at = metadata.get("last_updated") or metadata.get("extraction_date")
+    extracted_at = (
+        datetime.fromisoformat(extracted_at).replace(microsecond=0)
+        if extracted_at
+        else datetime.fromtimestamp(int(run_file.stat().st_mtime))
+    )
+    for result in results:
+        if result.get("status", "success") != "success":
+            continue
+        yield (
+            doc_type,
+            {
+                "file": result["file"],
+                "run": run_file.name,
+                "extracted_at": extracted_at,
+                **result["data"],
+            },
+        )
+
+
+def find_run_files(paths: list[Path]) -> list[Path]:
+    """Run files given directly, or found in the given directories"""
+    run_files = []
+    for path in paths:
+        if path.is_dir():
+            for pattern in RUN_PATTERNS:
+                run_files.extend(
+                    run_file
+                    for run_file in path.glob(pattern)
+                    if not run_file.name.endswith(METADATA_SUFFIX)
+                )
+        elif path.exists():
+            run_files.append(path)
+    return sorted(set(run_files))
+
+
+def canonical_specialties(values: list[str | None]) -> dict[str, str]:
+    """Map each spelling to the most common spelling of its case-folded form"""
+    counts = {}
+    for value in values:
+        if value:
+            counts[value] = counts.get(value, 0) + 1
+    best = {}
+    for value, count in counts.items():
+        key = value.casefold()
+        if key not in best or count > counts[best[key]]:
+            best[key] = value
+    return {value: best[value.casefold()] for value in counts}
+
+
+class StructuredStore:
+    """Query API over a store written by StructuredStore.write"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._datasets = {}
+
+    def doc_types(self) -> list[str]:
+        return [
+            doc_type
+            for doc_type in DOC_TYPES
+            if (self.root / f"doc_type={doc_type}").is_dir()
+        ]
+
+    def dataset(self, doc_type: str) -> ds.Dataset:
+        if doc_type not in self._datasets:
+            self._datasets[doc_type] = ds.dataset(
+                self.root / f"doc_type={doc_type}",
+                schema=arrow_schema(doc_type),
+                format="parquet",
+                partitioning=ds.partitioning(
+                    pa.schema([(PARTITION_FIELD, pa.string())]), flavor="hive"
+                ),
+            )
+        return self._datasets[doc_type]
+
+    def _filter(
+        self,
+        doc_type: str,
+        where: dict | None,
+        date_from: date | None,
+        date_to: date | None,
+    ) -> ds.Expression | None:
+        """Equality (or membership) tests and the decision date range, ANDed"""
+        schema = arrow_schema(doc_type)
+        expression = None
+        conditions = []
+        for name, value in (where or {}).items():
+            if schema.field(name).type == pa.list_(pa.string()):
+                raise ValueError(f"Cannot filter on list field {name}")
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(ds.field(name).isin(list(value)))
+            elif value is None:
+                conditions.append(ds.field(name).is_null())
+            else:
+                conditions.append(ds.field(name) == value)
+        if date_from is not None:
+            conditions.append(ds.field("decision_date") >= date_from)
+        if date_to is not None:
+            conditions.append(ds.field("decision_date") <= date_to)
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def query(
+        self,
+        doc_type: str,
+        columns: list[str] | None = None,
+        where: dict | None = None,
+        date_from: date | None = None,
+        date_to: date | None = None,
+        limit: int | None = None,
+    ) -> pa.Table:
+        """Rows of one document type matching `where` and the date range
+
+        `where` maps column names to a value, a list of accepted values or
+        None (is null). Date bounds are inclusive and only apply to FDA
+        records (decision_date).
+        """
+        if doc_type not in self.doc_types():
+            return (
+                arrow_schema(doc_type)
+                .empty_table()
+                .select(columns or arrow_schema(doc_type).names)
+            )
+        dataset = self.dataset(doc_type)
+        expression = self._filter(doc_type, where, date_from, date_to)
+        if limit is not None:
+            return dataset.head(limit, columns=columns, filter=expression)
+        return dataset.to_table(columns=columns, filter=expression)
+
+    def facets(
+        self,
+        fields: list[str],
+        doc_type: str | None = None,
+        where: dict | None = None,
+        date_from: date | None = None,
+        date_to: date | None = None,
+    ) -> dict[str, dict[str, int]]:
+        """Value counts of each field over the matching rows, most common first
+
+        Without doc_type the counts of all document types that have the field
+        are added up. List fields count each item; missing values are left out.
+        """
+        counts = {name: {} for name in fields}
+        for current_type in [doc_type] if doc_type else self.doc_types():
+            schema = arrow_schema(current_type)
+            present = [name for name in fields if name in schema.names]
+            if not present or (where and not set(where) <= set(schema.names)):
+                continue
+            table = self.query(current_type, present, where, date_from, date_to)
+            for name in present:
+                column = table.column(name)
+                if column.type == pa.list_(pa.string()):
+                    column = pc.list_flatten(column)
+                for item in pc.value_counts(column.drop_null()).to_pylist():
+                    value = item["values"]
+                    counts[name][value] = counts[name].get(value, 0) + item["counts"]
+        return {
+            name: dict(sorted(values.items(), key=lambda kv: (-kv[1], kv[0])))
+            for name, values in counts.items()
+        }
+
+    def read_all(self, doc_type: str) -> pa.Table:
+        if doc_type not in self.doc_types():
+            return arrow_schema(doc_type).empty_table()
+        return self.dataset(doc_type).to_table()
+
+    def write(self, records: dict[str, list[dict]]):
+        """Replace the store with the given records per document type
+
+        Each document type is written to a temporary directory first and then
+        swapped in with two renames. The swap is not atomic: a reader opening
+        the store between the renames finds the document type missing, and a
+        crash there leaves the previous data in `.doc_type=<type>.old`.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        # One spelling per specialty across document types, so facets add up
+        canonical = canonical_specialties(
+            [row.get(PARTITION_FIELD) for rows in records.values() for row in rows]
+        )
+        for doc_type, rows in records.items():
+            schema = arrow_schema(doc_type)
+            for row in rows:
+                if row.get(PARTITION_FIELD):
+                    row[PARTITION_FIELD] = canonical[row[PARTITION_FIELD]]
+                if doc_type == "fda":
+                    row["decision_date"] = parse_decision_date(
+                        row.get("fda_decision_date")
+                    )
+            table = pa.Table.from_pylist(rows, schema=schema).sort_by(
+                [(PARTITION_FIELD, "ascending"), ("file", "ascending")]
+            )
+
+            final_dir = self.root / f"doc_type={doc_type}"
+            tmp_dir = self.root / f".doc_type={doc_type}.tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            ds.write_dataset(
+                table,
+                tmp_dir,
+                format="parquet",
+                partitioning=ds.partitioning(
+                    pa.schema([(PARTITION_FIELD, pa.string())]), flavor="hive"
+                ),
+                existing_data_behavior="error",
+            )
+            old_dir = self.root / f".doc_type={doc_type}.old"
+            # Left behind by a write that was interrupted mid-swap
+            shutil.rmtree(old_dir, ignore_errors=True)
+            if final_dir.exists():
+                final_dir.rename(old_dir)
+            tmp_dir.rename(final_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            self._datasets.pop(doc_type, None)
+
+
+def merge_runs(store: StructuredStore, run_files: list[Path]) -> tuple[dict, int]:
+    """Records of the existing store and the runs, the latest per (type, file)
+
+    Returns the merged records per document type and the number of records
+    read from the runs.
+    """
+    latest = {}
+
+    def offer(doc_type: str, record: dict):
+        key = (doc_type, record["file"])
+        current = latest.get(key)
+        if current is None or record["extracted_at"] >= current["extracted_at"]:
+            latest[key] = record
+
+    for doc_type in store.doc_types():
+        for record in store.read_all(doc_type).to_pylist():
+            record.pop("decision_date", None)
+            offer(doc_type, record)
+
+    read = 0
+    for run_file in run_files:
+        for doc_type, record in iter_run_records(run_file):
+            read += 1
+            offer(doc_type, record)
+
+    merged = {}
+    for (doc_type, _), record in latest.items():
+        merged.setdefault(doc_type, []).append(record)
+    return merged, read
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Merge extraction runs into a partitioned Parquet store",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--runs",
+        type=Path,
+        nargs="+",
+        default=[Path(".")],
+        help="Run files (.json or .jsonl), or directories searched for *_extracted_* runs",
+    )
+
+    parser.add_argument(
+        "--store-dir",
+        type=Path,
+        default=Path("ExtractedStore/"),
+        help="Root of the Parquet store; records already in it are kept unless a run has a newer extraction",
+    )
+
+    parser.add_argument(
+        "--facets",
+        type=str,
+        nargs="*",
+        default=["medical_specialty", "product_code"],
+        help="Fields whose top values are printed after merging",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point for the script"""
+    args = parse_args()
+
+    run_files = find_run_files(args.runs)
+    if not run_files:
+        print(f"Error: No run files found in: {', '.join(map(str, args.runs))}")
+        sys.exit(1)
+
+    print(f"Merging {len(run_files)} run files into: {args.store_dir}")
+    store = StructuredStore(args.store_dir)
+    merged, read = merge_runs(store, run_files)
+    store.write(merged)
+
+    print(f"\n{'=' * 60}")
+    print("✓ Store updated!")
+    print(f"  Records read from runs: {read}")
+    for doc_type, rows in sorted(merged.items()):
+        print(f"  {DOC_TYPES[doc_type]['label']} records: {len(rows)}")
+    for name, values in store.facets(args.facets).items():
+        top = ", ".join(
+            f"{value} ({count})" for value, count in list(values.items())[:10]
+        )
+        print(f"  Top {name}: {top or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""In-process stand-in for genai.Client, for tests that must not reach the API"""
+
+from types import SimpleNamespace
+
+
+class FakeGenaiClient:
+    """Answers client.aio.models.generate_content from a script
+
+    Each call takes the next entry of `script`: an exception is raised, a
+    callable is called with (contents, response_schema) and its return value
+    becomes the response's parsed value, anything else is the parsed value
+    itself. The contents of every call are recorded in `calls`.
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = []
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self.generate_content)
+        )
+
+    async def generate_content(self, model, contents, config):
+        self.calls.append(contents)
+        outcome = self.script.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        if callable(outcome):
+            outcome = outcome(contents, config.response_schema)
+        return SimpleNamespace(parsed=outcome)
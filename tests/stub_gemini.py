@@ -0,0 +1,121 @@
+"""Local stand-in for the Gemini generateContent REST endpoint
+
+Point the real client at it with make_client(api_key, api_base_url=stub.url),
+the same way --api-base-url does.
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DOCUMENT_PATTERN = re.compile(r"<document index=(\d+)>\n(.*?)\n</document>", re.DOTALL)
+HEADING_PATTERN = re.compile(r"^# (.+)$", re.MULTILINE)
+
+
+def sop_record(content: str) -> dict:
+    """LabSOP fields of a test document: its first heading names the procedure"""
+    match = HEADING_PATTERN.search(content)
+    return {
+        "procedure_name": match.group(1) if match else "unknown",
+        "specimen_type": "Serum",
+        "purpose": "Testing",
+    }
+
+
+class StubGemini:
+    """Threaded HTTP server answering generateContent requests for LabSOP
+
+    A prompt holding <document index=N> tags is a pack and gets one item per
+    tag; any other prompt gets a single record. `respond(prompt)` may return
+    an HTTP status to fail the request with, or a body to send instead of the
+    default; None keeps the default. Every request waits `latency` seconds.
+    Prompts are recorded in `prompts`, and `max_in_flight` is the largest
+    number of requests seen at the same time.
+    """
+
+    def __init__(self, respond=None, latency: float = 0.0):
+        self.respond = respond or (lambda prompt: None)
+        self.latency = latency
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 256
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def packed_prompts(self) -> list[str]:
+        return [prompt for prompt in self.prompts if DOCUMENT_PATTERN.search(prompt)]
+
+    @property
+    def single_prompts(self) -> list[str]:
+        return [
+            prompt for prompt in self.prompts if not DOCUMENT_PATTERN.search(prompt)
+        ]
+
+    def default_body(self, prompt: str):
+        documents = DOCUMENT_PATTERN.findall(prompt)
+        if documents:
+            return [
+                {"doc_index": int(index), "data": sop_record(content)}
+                for index, content in documents
+            ]
+        return sop_record(prompt)
+
+    def answer(self, body: dict) -> tuple[int, dict]:
+        prompt = body["contents"][0]["parts"][0]["text"]
+        with self._lock:
+            self.prompts.append(prompt)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            reply = self.respond(prompt)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        if isinstance(reply, int):
+            return reply, {
+                "error": {"code": reply, "message": "stub", "status": "STUB"}
+            }
+        text = json.dumps(self.default_body(prompt) if reply is None else reply)
+        return 200, {
+            "candidates": [
+                {
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                    "finishReason": "STOP",
+                }
+            ]
+        }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                status, body = stub.answer(json.loads(self.rfile.read(length)))
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,23 @@
+from dedup_markdown import BAND_ROWS, NUM_BINS, cluster_signatures
+
+
+def test_similar_documents_behind_a_dissimilar_bucket_head_are_merged():
+    # b and c only share their first band, whose bucket a reaches first; every
+    # other band of c differs from b in one bin
+    a = (0,) * NUM_BINS
+    b = (0,) * BAND_ROWS + (1,) * (NUM_BINS - BAND_ROWS)
+    c = list(b)
+    for band_start in range(BAND_ROWS, NUM_BINS, BAND_ROWS):
+        c[band_start] = 2
+    clusters, _ = cluster_signatures([a, b, tuple(c)], threshold=0.85)
+
+    assert clusters.find(1) == clusters.find(2)
+    assert clusters.find(0) != clusters.find(1)
+
+
+def test_identical_documents_cost_one_comparison_each():
+    signatures = [(7,) * NUM_BINS] * 5
+    clusters, comparisons = cluster_signatures(signatures, threshold=0.85)
+
+    assert len({clusters.find(i) for i in range(5)}) == 1
+    assert comparisons == 4
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from extract_structured import make_client, process_all_files
+from stub_gemini import DOCUMENT_PATTERN, StubGemini, sop_record
+
+PROCEDURES = ["Glucose", "Lactate", "Ferritin", "Troponin", "D-Dimer", "Sodium"]
+
+
+@pytest.fixture
+def sop_files(tmp_path):
+    files = []
+    for name in PROCEDURES:
+        path = tmp_path / "sop" / f"{name.lower()}.md"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(f"# {name}\n\nSerum specimen.\n", encoding="utf-8")
+        files.append(path)
+    return files
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(random, "uniform", lambda low, high: 0.0)
+
+
+def run(stub, files, output_file, **options):
+    options = {
+        "batch_size": 100,
+        "doc_type": "sop",
+        "concurrency": 4,
+        "max_retries": 1,
+        "pack_size": 3,
+        **options,
+    }
+    successes, errors = asyncio.run(
+        process_all_files(
+            files,
+            client=make_client("test-key", api_base_url=stub.url),
+            output_file=output_file,
+            **options,
+        )
+    )
+    records = {
+        record["file"]: record
+        for record in map(json.loads, output_file.read_text().splitlines())
+    }
+    return successes, errors, records
+
+
+def assert_extracted(records, files):
+    for path, name in zip(files, PROCEDURES, strict=True):
+        assert records[path.name]["status"] == "success"
+        assert records[path.name]["data"]["procedure_name"] == name
+
+
+def drop_index(index):
+    """Answer packs with every item except the one for document `index`"""
+
+    def respond(prompt):
+        documents = DOCUMENT_PATTERN.findall(prompt)
+        if not documents:
+            return None
+        return [
+            {"doc_index": int(i), "data": sop_record(content)}
+            for i, content in documents
+            if int(i) != index
+        ]
+
+    return respond
+
+
+def test_small_documents_share_requests(sop_files, tmp_path):
+    with StubGemini() as stub:
+        successes, errors, records = run(stub, sop_files, tmp_path / "out.jsonl")
+
+    assert successes == len(sop_files) and errors == []
+    assert len(stub.packed_prompts) == 2
+    assert stub.single_prompts == []
+    assert_extracted(records, sop_files)
+
+
+def test_missing_items_are_requested_alone(sop_files, tmp_path):
+    with StubGemini(respond=drop_index(1)) as stub:
+        successes, errors, records = run(stub, sop_files, tmp_path / "out.jsonl")
+
+    assert successes == len(sop_files) and errors == []
+    assert len(stub.packed_prompts) == 2
+    # The second document of each pack came back without an item
+    assert len(stub.single_prompts) == 2
+    assert_extracted(records, sop_files)
+
+
+@pytest.mark.parametrize("reply", [400, {"not": "a list"}])
+def test_rejected_or_unparseable_packs_are_split(sop_files, tmp_path, reply):
+    def respond(prompt):
+        return reply if DOCUMENT_PATTERN.search(prompt) else None
+
+    with StubGemini(respond=respond) as stub:
+        successes, errors, records = run(stub, sop_files, tmp_path / "out.jsonl")
+
+    assert successes == len(sop_files) and errors == []
+    assert len(stub.packed_prompts) == 2
+    assert len(stub.single_prompts) == len(sop_files)
+    assert_extracted(records, sop_files)
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_transiently_failing_packs_are_not_split(sop_files, tmp_path, status):
+    def respond(prompt):
+        return status if DOCUMENT_PATTERN.search(prompt) else None
+
+    with StubGemini(respond=respond) as stub:
+        successes, errors, records = run(
+            stub, sop_files, tmp_path / "out.jsonl", max_retries=2
+        )
+
+    assert successes == 0
+    assert len(errors) == len(sop_files)
+    assert all(error["transient"] for error in errors)
+    assert sorted(records) == sorted(path.name for path in sop_files)
+    assert all(record["status"] == "error" for record in records.values())
+    # Two packs, each tried 1 + max_retries times, and no single requests
+    assert len(stub.packed_prompts) == 6
+    assert stub.single_prompts == []
+
+
+def test_packs_are_sent_concurrently(sop_files, tmp_path):
+    with StubGemini(latency=0.2) as stub:
+        successes, _, _ = run(
+            stub, sop_files, tmp_path / "out.jsonl", pack_size=2, concurrency=2
+        )
+
+    assert successes == len(sop_files)
+    assert len(stub.packed_prompts) == 3
+    assert stub.max_in_flight == 2
@@ -0,0 +1,157 @@
+import asyncio
+import random
+
+import httpx
+import pytest
+from google.genai import errors as genai_errors
+
+from extract_structured import (
+    RateLimiter,
+    backoff_delay,
+    error_result,
+    extract_document,
+    is_transient,
+)
+from extraction_schemas import LabSOP
+from fake_genai import FakeGenaiClient
+
+SOP = LabSOP(procedure_name="D-Dimer", specimen_type="Plasma", purpose="Rule out DVT")
+
+
+def api_error(code: int) -> genai_errors.APIError:
+    return genai_errors.APIError(code, {"error": {"code": code, "message": "test"}})
+
+
+class FakeTime:
+    """Clock and sleep for RateLimiter: sleeping advances the clock at once"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_time():
+    return FakeTime()
+
+
+@pytest.fixture
+def limiter(fake_time):
+    return RateLimiter(60, None, clock=fake_time.clock, sleep=fake_time.sleep)
+
+
+@pytest.fixture
+def sop_file(tmp_path):
+    path = tmp_path / "sop.md"
+    path.write_text("# D-Dimer\n\nPlasma, citrated.\n", encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def max_jitter(monkeypatch):
+    """Make backoff_delay return its upper bound"""
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+
+
+def extract(sop_file, client, limiter, max_retries=5):
+    return asyncio.run(extract_document(sop_file, client, "sop", limiter, max_retries))
+
+
+def test_transient_errors_are_retried_with_backoff(
+    sop_file, limiter, fake_time, max_jitter
+):
+    client = FakeGenaiClient([api_error(503), httpx.ConnectError("reset"), SOP])
+
+    result = extract(sop_file, client, limiter)
+
+    assert result["status"] == "success"
+    assert result["data"] == SOP
+    assert result["attempts"] == 3
+    assert len(client.calls) == 3
+    assert fake_time.sleeps == [1.0, 2.0]
+
+
+def test_rate_limit_halves_the_budget(sop_file, limiter, max_jitter):
+    client = FakeGenaiClient([api_error(429), SOP])
+
+    result = extract(sop_file, client, limiter)
+
+    assert result["status"] == "success"
+    assert limiter.throttled_count == 1
+    # Halved by the 429, then one additive increase for the success
+    assert limiter.factor == pytest.approx(0.5 + limiter.increase)
+
+
+def test_permanent_error_is_not_retried(sop_file, limiter, fake_time):
+    client = FakeGenaiClient([api_error(400), SOP])
+
+    result = extract(sop_file, client, limiter)
+
+    assert result["status"] == "error"
+    assert result["transient"] is False
+    assert len(client.calls) == 1
+    assert fake_time.sleeps == []
+
+
+def test_exhausted_retries_stay_transient(sop_file, limiter, fake_time):
+    client = FakeGenaiClient([api_error(503)] * 3)
+
+    result = extract(sop_file, client, limiter, max_retries=2)
+
+    assert result["status"] == "error"
+    assert result["transient"] is True
+    assert len(client.calls) == 3
+    assert len(fake_time.sleeps) == 2
+
+
+def test_unreadable_input_is_permanent(tmp_path, limiter):
+    client = FakeGenaiClient([])
+
+    missing = extract(tmp_path / "missing.md", client, limiter)
+    directory = extract(tmp_path, client, limiter)
+
+    assert missing["transient"] is False
+    assert directory["transient"] is False
+    assert client.calls == []
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (api_error(429), True),
+        (api_error(500), True),
+        (api_error(503), True),
+        (api_error(400), False),
+        (api_error(403), False),
+        (httpx.ReadTimeout("slow"), True),
+        (httpx.ConnectError("refused"), True),
+        (ConnectionResetError(), True),
+        (TimeoutError(), True),
+        (FileNotFoundError("a.md"), False),
+        (PermissionError("a.md"), False),
+        (IsADirectoryError("a.md"), False),
+        (ValueError("schema"), False),
+    ],
+)
+def test_is_transient(error, transient):
+    assert is_transient(error) is transient
+    assert error_result(__file__, "sop", error)["transient"] is transient
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    rng_state = random.getstate()
+    try:
+        random.seed(0)
+        for attempt in range(10):
+            delays = [backoff_delay(attempt, base=1.0, cap=60.0) for _ in range(100)]
+            assert all(0 <= delay <= min(60.0, 2**attempt) for delay in delays)
+            assert len(set(delays)) > 1
+    finally:
+        random.setstate(rng_state)
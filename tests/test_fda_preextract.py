@@ -0,0 +1,134 @@
+from pathlib import Path
+
+import pytest
+
+from extract_structured import prepare_document
+from fda_preextract import clean_value, pre_extract_fda
+
+# Header block of a decision summary as pymupdf4llm renders it: one label per
+# line, enumerated and in bold
+DECISION_SUMMARY = """\
+# 510(k) SUBSTANTIAL EQUIVALENCE DETERMINATION DECISION SUMMARY ASSAY ONLY TEMPLATE
+
+**A.** **510(k) Number:** k093626
+
+**B.** **Purpose for Submission:** New device
+
+**C.** **Measurand:** D-dimer
+
+**D.** **Type of Test:** Quantitative, immunoturbidimetric
+
+**E.** **Applicant:** Siemens Healthcare Diagnostics Products GmbH
+
+**F.** **Proprietary and Established Names:** INNOVANCE D-Dimer
+
+**G.** **Regulatory Information:**
+
+1. Regulation section:
+
+21 CFR 864.7320, Fibrinogen/fibrin degradation products assay
+
+2. Classification: Class II
+
+3. Product code: DAP
+
+4. Panel: Hematology (81)
+
+**H.** **Intended Use:**
+
+1. Intended use(s):
+
+For the quantitative determination of cross-linked fibrin degradation products (D-dimers) in human plasma (sodium citrate) on the BCS XP System.
+
+2. Indication(s) for use:
+
+Same as Intended Use
+
+**I.** **Device Description:**
+"""
+
+# The same header with the applicant and measurand left empty
+EMPTY_FIELDS = """\
+**A. 510(k) Number:** k150012
+
+**B. Purpose for Submission:** New device
+
+**C. Measurand:**
+
+**D. Type of Test:** Qualitative
+
+**E. Applicant:**
+
+**F. Proprietary and Established Names:** ACME Troponin I Test
+
+**G. Regulatory Information:**
+"""
+
+# 510(k) summary style: the sub-label shares the line with the section label
+SUMMARY_INLINE_SUB_LABEL = """\
+## 510(k) Summary
+
+Submitter: Abbott Laboratories Inc.
+
+Device Trade Name: ARCHITECT STAT High Sensitive Troponin-I
+
+Decision Date: December 7, 2017
+
+Intended Use: 1. Intended use(s): The ARCHITECT STAT High Sensitive Troponin-I assay is a chemiluminescent microparticle immunoassay for the quantitative determination of cardiac troponin I in human plasma and serum.
+"""
+
+
+def test_decision_summary_header():
+    fields = pre_extract_fda(DECISION_SUMMARY)
+
+    assert fields["analyte_biomarker"] == "D-dimer"
+    assert fields["manufacturer_name"] == "Siemens Healthcare Diagnostics Products GmbH"
+    assert fields["device_trade_name"] == "INNOVANCE D-Dimer"
+    assert fields["product_code"] == "DAP"
+    assert fields["medical_specialty"] == "Hematology"
+    assert fields["intended_use"].startswith(
+        "For the quantitative determination of cross-linked fibrin"
+    )
+    assert "Intended use" not in fields["intended_use"]
+    assert "Indication" not in fields["intended_use"]
+
+
+def test_empty_fields_do_not_capture_the_next_label():
+    fields = pre_extract_fda(EMPTY_FIELDS)
+
+    assert "manufacturer_name" not in fields
+    assert "analyte_biomarker" not in fields
+    assert fields["device_trade_name"] == "ACME Troponin I Test"
+
+
+def test_empty_fields_are_left_to_the_model():
+    plan = prepare_document(Path("k150012.md"), EMPTY_FIELDS, "fda")
+
+    assert "manufacturer_name" not in plan["prefilled"]
+    assert "manufacturer_name" in plan["schema"].model_fields
+    assert "analyte_biomarker" in plan["schema"].model_fields
+
+
+def test_inline_intended_use_sub_label_is_stripped():
+    fields = pre_extract_fda(SUMMARY_INLINE_SUB_LABEL)
+
+    assert fields["intended_use"].startswith("The ARCHITECT STAT High Sensitive")
+    assert fields["manufacturer_name"] == "Abbott Laboratories Inc."
+    assert fields["fda_decision_date"] == "12-07-2017"
+
+
+@pytest.mark.parametrize(
+    "raw, value",
+    [
+        ("Abbott Laboratories Inc.", "Abbott Laboratories Inc."),
+        ("Randox Laboratories Ltd.", "Randox Laboratories Ltd."),
+        ("Bio-Rad Laboratories, Inc. ;", "Bio-Rad Laboratories, Inc."),
+        ("Hematology.", "Hematology"),
+        ("| D-dimer |", "D-dimer"),
+        ("Proprietary and Established Names:", None),
+        ("Type of Test:", None),
+        ("N/A", None),
+    ],
+)
+def test_clean_value(raw, value):
+    assert clean_value(raw) == value